@@ -1,6 +1,6 @@
 from django.urls import path
 from .views import (UsersManagerView, UserEditView, UserEditConfirmView,
-                     UserDeleteView, PicturesManagerView, ImageDeleteView,)
+                     UserDeleteView, PicturesManagerView, ImageDeleteView, StageTimingsView,)
 
 app_name = 'adminpanel'
 
@@ -20,6 +20,9 @@ urlpatterns = [
     # 画像解析管理画面（全ユーザー分）
     path('pictures/', PicturesManagerView.as_view(), name='pictures_manager'),
 
+    # 工程別所要時間（p50/p95/p99）
+    path('timings/', StageTimingsView.as_view(), name='stage_timings'),
+
     # 画像削除画面
     path('pictures/<int:image_id>/delete/', ImageDeleteView.as_view(), name='image_delete'),
 ]
\ No newline at end of file
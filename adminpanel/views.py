@@ -4,9 +4,12 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.db.models import Q
+from django.utils import timezone
+from datetime import timedelta
 
 from accounts.models import MstUsers
 from analyzer.models import MstImages, TransAnalysis
+from analyzer import facets, pagination, queue_position, timing
 
 
 class PicturesManagerView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
@@ -29,7 +32,7 @@ class PicturesManagerView(LoginRequiredMixin, UserPassesTestMixin, TemplateView)
         # フィルタ構築
         filters = Q()
         if selected_user:
-            filters &= Q(image__user__email=selected_user)
+            filters &= Q(user__email=selected_user)
         if selected_status:
             filters &= Q(status=selected_status)
         if selected_error:
@@ -37,46 +40,22 @@ class PicturesManagerView(LoginRequiredMixin, UserPassesTestMixin, TemplateView)
         if selected_model:
             filters &= Q(model_name=selected_model)
 
-        order_field = 'image__uploaded_at'
-        order_by = order_field if sort_order == 'asc' else f'-{order_field}'
-
-        # データ取得
-        analyses = (
-            TransAnalysis.objects
-            .filter(filters)
-            .select_related('image', 'image__user')
-            .order_by(order_by)
+        # データ取得（アップロード日時順のキーセットページング）
+        page = pagination.paginate(
+            TransAnalysis.objects.filter(filters).select_related('image', 'image__user'),
+            cursor=self.request.GET.get('cursor'),
+            descending=sort_order != 'asc',
         )
+        analyses = page.items
 
-        # 準備中の順番算出
-        waiting_list = list(
-            TransAnalysis.objects
-            .filter(status="準備中")
-            .order_by('image__uploaded_at')
-            .values_list('analysis_id', flat=True)
-        )
-        waiting_position = {aid: idx + 1 for idx, aid in enumerate(waiting_list)}
-
-        for analysis in analyses:
-            if analysis.status == "準備中":
-                analysis.waiting_number = waiting_position.get(analysis.analysis_id, None)
-            else:
-                analysis.waiting_number = None
-
-        # プルダウン選択肢用
-        all_users = MstUsers.objects.filter(is_active=True).values_list('email', flat=True).distinct()
-        all_errors = (
-            TransAnalysis.objects
-            .exclude(error_name__isnull=True)
-            .exclude(error_name__exact="")
-            .values_list('error_name', flat=True)
-            .distinct()
-        )
-        all_models = (
-            TransAnalysis.objects
-            .values_list('model_name', flat=True)
-            .distinct()
-        )
+        # 準備中の順番算出（投入番号から求める）
+        queue_position.annotate(analyses)
+
+        # プルダウン選択肢・ステータス別件数用（エラー名・モデル名は集計テーブルから取得）
+        all_users = MstUsers.objects.filter(is_active=True).values_list('email', flat=True)
+        all_errors = facets.values(facets.ERROR)
+        all_models = facets.values(facets.MODEL)
+        status_counts = facets.counts(facets.STATUS)
 
         context.update({
             'analyses': analyses,
@@ -88,6 +67,54 @@ class PicturesManagerView(LoginRequiredMixin, UserPassesTestMixin, TemplateView)
             'user_options': all_users,
             'error_options': all_errors,
             'model_options': all_models,
+            'status_counts': [(value, label, status_counts.get(value, 0)) for value, label in TransAnalysis.S_CHOICES],
+            **pagination.page_queries(self.request.GET, page),
+        })
+        return context
+
+
+class StageTimingsView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """工程ごとの所要時間（p50/p95/p99）をモデル別に表示"""
+    template_name = 'adminpanel/stage_timings.html'
+
+    # 集計期間の選択肢（表示名, 時間）
+    WINDOWS = [('1h', 1), ('24h', 24), ('7d', 24 * 7), ('30d', 24 * 30)]
+    DEFAULT_WINDOW = '24h'
+    # 集計に使う最大件数（新しい順）
+    MAX_ROWS = 20000
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+
+        windows = dict(self.WINDOWS)
+        selected_window = self.request.GET.get('window')
+        if selected_window not in windows:
+            selected_window = self.DEFAULT_WINDOW
+        selected_model = self.request.GET.get('model')
+
+        # 期間内に終了した解析（終了日時のインデックスで範囲検索）
+        since = timezone.now() - timedelta(hours=windows[selected_window])
+        analyses = TransAnalysis.objects.filter(ended_at__gte=since, stage_timings__isnull=False)
+        if selected_model:
+            analyses = analyses.filter(model_name=selected_model)
+        rows = list(
+            analyses.order_by('-ended_at').values_list('model_name', 'stage_timings')[:self.MAX_ROWS + 1]
+        )
+        truncated = len(rows) > self.MAX_ROWS
+
+        summary = timing.summarize(rows[:self.MAX_ROWS])
+        context.update({
+            'summary': [(model, list(stages.items())) for model, stages in summary.items()],
+            'window_options': [name for name, _ in self.WINDOWS],
+            'selected_window': selected_window,
+            'selected_model': selected_model,
+            'model_options': facets.values(facets.MODEL),
+            'since': since,
+            'row_count': min(len(rows), self.MAX_ROWS),
+            'truncated': truncated,
         })
         return context
 
@@ -235,4 +262,5 @@ user_edit = UserEditView.as_view()
 user_edit_confirm = UserEditConfirmView.as_view()
 user_delete = UserDeleteView.as_view()
 pictures_manager = PicturesManagerView.as_view()
+stage_timings = StageTimingsView.as_view()
 image_delete = ImageDeleteView.as_view()
@@ -0,0 +1,235 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import transport
+
+logger = logging.getLogger(__name__)
+
+# 名前 → S3キー（ANALYZER_MODEL_ARTIFACTSのprefix以下）
+ARTIFACTS = {
+    "effb0_1001human_model.keras": "effb0_1001human_model.keras",
+    "effb0_5class_model.keras": "effb0_5class_model.keras",
+    "imagenet_class_index_extended.json": "imagenet_class_index_extended.json",
+    "class_index_5class.json": "class_index_5class.json",
+    # Keras標準モデルのImageNet重み・ラベル（実行時にインターネットから取得しない）
+    "imagenet_class_index.json": "keras/imagenet_class_index.json",
+    "efficientnetb0.h5": "keras/efficientnetb0.h5",
+    "mobilenet_v2_1.0_224.h5": "keras/mobilenet_v2_weights_tf_dim_ordering_tf_kernels_1.0_224.h5",
+    "resnet50.h5": "keras/resnet50_weights_tf_dim_ordering_tf_kernels.h5",
+}
+
+# Keras標準モデルの重み・ラベル。ANALYZER_STOCK_WEIGHTS_FROM_BUNDLE が有効な場合（既定）だけバンドルから取得する
+STOCK_ARTIFACTS = (
+    "imagenet_class_index.json",
+    "efficientnetb0.h5",
+    "mobilenet_v2_1.0_224.h5",
+    "resnet50.h5",
+)
+
+MANIFEST = "manifest.json"
+
+_lock = threading.Lock()
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def _conf():
+    conf = {
+        "version": "v1",
+        "cache_dir": "models",
+        "bucket": settings.AWS_STORAGE_BUCKET_NAME,
+        "prefix": "models/",
+        # TrueならS3に接続せず、cache_dirに置いてあるファイルだけを使う（オフラインのベンチマーク等）
+        "offline": False,
+    }
+    conf.update(getattr(settings, "ANALYZER_MODEL_ARTIFACTS", {}) or {})
+    return conf
+
+
+def cache_dir():
+    """バージョンごとのキャッシュディレクトリ"""
+    conf = _conf()
+    return os.path.join(str(conf["cache_dir"]), conf["version"])
+
+
+def stock_from_bundle():
+    """Keras標準モデルの重み・ラベルを自前のバンドルから取得するか（無効ならKerasが配布元から取得）"""
+    return bool(getattr(settings, "ANALYZER_STOCK_WEIGHTS_FROM_BUNDLE", True))
+
+
+def default_names():
+    """名前を省略したときに揃える成果物（バンドルを使わない設定なら標準モデルの分は除く）"""
+    if stock_from_bundle():
+        return list(ARTIFACTS)
+    return [n for n in ARTIFACTS if n not in STOCK_ARTIFACTS]
+
+
+def local_path(name):
+    """ダウンロード済みかどうかに関係なくローカルの保存先を返す"""
+    return os.path.join(cache_dir(), name)
+
+
+def s3_key(name):
+    return _conf()["prefix"] + ARTIFACTS[name]
+
+
+def _read_manifest():
+    try:
+        with open(os.path.join(cache_dir(), MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(manifest):
+    path = os.path.join(cache_dir(), MANIFEST)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _host_lock():
+    """同じホストの他のワーカーと同時にダウンロードしないためのファイルロック"""
+    os.makedirs(cache_dir(), exist_ok=True)
+    with open(os.path.join(cache_dir(), ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _is_present(name, manifest):
+    entry = manifest.get(name)
+    path = local_path(name)
+    return bool(entry) and os.path.exists(path) and os.path.getsize(path) == entry["size"]
+
+
+def _download(name):
+    """一時ファイルへダウンロードし、ETag/チェックサムを検証してから置き換える"""
+    conf = _conf()
+    key = s3_key(name)
+    client = transport.s3_client()
+    try:
+        head = client.head_object(Bucket=conf["bucket"], Key=key)
+    except Exception as e:
+        if not transport.is_not_found(e):
+            raise
+        hint = " (run `manage.py fetch_model_artifacts --publish-stock`)" if name in STOCK_ARTIFACTS else ""
+        raise ArtifactError(f"{name}: s3://{conf['bucket']}/{key} not found in the bundle{hint}") from e
+    etag = head["ETag"].strip('"')
+    expected_sha256 = head.get("Metadata", {}).get("sha256")
+
+    path = local_path(name)
+    tmp = f"{path}.part.{os.getpid()}.{threading.get_ident()}"
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        body = client.get_object(Bucket=conf["bucket"], Key=key, IfMatch=head["ETag"])["Body"]
+        with open(tmp, "wb") as f:
+            for chunk in body.iter_chunks(1024 * 1024):
+                f.write(chunk)
+                md5.update(chunk)
+                sha256.update(chunk)
+                size += len(chunk)
+
+        if size != head["ContentLength"]:
+            raise ArtifactError(f"{name}: size mismatch ({size} != {head['ContentLength']})")
+        if expected_sha256 and expected_sha256 != sha256.hexdigest():
+            raise ArtifactError(f"{name}: sha256 mismatch")
+        # マルチパートアップロードのETagはMD5ではないので比較しない
+        if "-" not in etag and etag != md5.hexdigest():
+            raise ArtifactError(f"{name}: ETag mismatch")
+
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    logger.info("artifact downloaded: %s (%d bytes)", key, size)
+    return {"etag": etag, "sha256": sha256.hexdigest(), "size": size, "key": key}
+
+
+def ensure(names=None, refresh=False):
+    """
+    指定した成果物（省略時は default_names()）をローカルに揃える
+    足りない物だけを並列でダウンロードし、1件終わるごとにマニフェストに記録する
+    一部が失敗しても成功した分は記録してから、最初のエラーを送出する
+    """
+    names = list(names or default_names())
+    with _lock, _host_lock():
+        manifest = _read_manifest()
+        missing = [n for n in names if refresh or not _is_present(n, manifest)]
+        errors = []
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(8, len(missing))) as pool:
+                futures = {pool.submit(_download, name): name for name in missing}
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        manifest[name] = future.result()
+                    except Exception as e:
+                        logger.warning("artifact download failed: %s", name, exc_info=True)
+                        errors.append(e)
+                        continue
+                    _write_manifest(manifest)
+        if errors:
+            raise errors[0]
+    return {n: local_path(n) for n in names}
+
+
+def path(name):
+    """成果物のローカルパス（無ければダウンロード）"""
+    if not _is_present(name, _read_manifest()):
+        if _conf()["offline"]:
+            if os.path.exists(local_path(name)):
+                return local_path(name)
+            raise ArtifactError(f"{name}: not found in {cache_dir()} (offline)")
+        ensure([name])
+    return local_path(name)
+
+
+def verify(names=None):
+    """ローカルの成果物がS3上の最新と一致するか（ETag比較）"""
+    conf = _conf()
+    manifest = _read_manifest()
+    result = {}
+    for name in names or default_names():
+        try:
+            head = transport.s3_client().head_object(Bucket=conf["bucket"], Key=s3_key(name))
+        except Exception as e:
+            result[name] = f"missing in S3 ({type(e).__name__})"
+            continue
+        if not _is_present(name, manifest):
+            result[name] = "not downloaded"
+        elif manifest[name]["etag"] != head["ETag"].strip('"'):
+            result[name] = "stale"
+        else:
+            result[name] = "ok"
+    return result
+
+
+def publish(name, source_path):
+    """ローカルのファイルをS3のバンドルへアップロード（sha256をメタデータに付ける）"""
+    sha256 = hashlib.sha256()
+    with open(source_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    transport.s3_client().upload_file(
+        source_path, _conf()["bucket"], s3_key(name),
+        ExtraArgs={"Metadata": {"sha256": sha256.hexdigest()}},
+    )
+    return s3_key(name)
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    __slots__ = ("x", "future", "enqueued_at")
+
+    def __init__(self, x):
+        self.x = x
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """
+    同じモデル宛ての推論リクエストを短い時間窓でまとめて1回のpredictで処理する
+    最初のリクエストが来てから window 秒経過するか max_batch_size に達した時点で実行する
+    （スレッドプールのワーカーで複数タスクが同時に実行される場合に効果がある）
+    """
+
+    def __init__(self, predict_fn, window=0.05, max_batch_size=16):
+        self._predict_fn = predict_fn
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._queues = {}
+        self._cond = threading.Condition()
+        self._workers = {}
+
+        self.batch_sizes = {}
+        self.wait_seconds_max = 0.0
+
+    def submit(self, model_name, x):
+        """x: (n, 224, 224, 3) の配列。Futureで(n, classes)の予測を返す"""
+        pending = _Pending(x)
+        with self._cond:
+            self._queues.setdefault(model_name, []).append(pending)
+            if model_name not in self._workers:
+                worker = threading.Thread(
+                    target=self._run, args=(model_name,),
+                    name=f"microbatch-{model_name}", daemon=True,
+                )
+                self._workers[model_name] = worker
+                worker.start()
+            self._cond.notify_all()
+        return pending.future
+
+    def predict(self, model_name, x):
+        return self.submit(model_name, x).result()
+
+    def _take_batch(self, model_name):
+        """窓が閉じるまで待ってバッチを取り出す（呼び出し時はロック保持）"""
+        queue = self._queues[model_name]
+        while not queue:
+            self._cond.wait()
+        deadline = queue[0].enqueued_at + self.window
+        while self._queued_rows(queue) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+
+        batch, rows = [], 0
+        while queue and (not batch or rows + len(queue[0].x) <= self.max_batch_size):
+            item = queue.pop(0)
+            batch.append(item)
+            rows += len(item.x)
+        return batch
+
+    @staticmethod
+    def _queued_rows(queue):
+        return sum(len(p.x) for p in queue)
+
+    def _run(self, model_name):
+        while True:
+            with self._cond:
+                batch = self._take_batch(model_name)
+            self._execute(model_name, batch)
+
+    def _execute(self, model_name, batch):
+        now = time.monotonic()
+        sizes = [len(p.x) for p in batch]
+        try:
+            x = np.concatenate([p.x for p in batch], axis=0)
+            preds = self._predict_fn(model_name, x)
+        except Exception as e:
+            for p in batch:
+                p.future.set_exception(e)
+            return
+
+        # 結果を各リクエストに振り分け（複数出力モデルは出力ごとに切り出す）
+        offset = 0
+        for p, n in zip(batch, sizes):
+            if isinstance(preds, (list, tuple)):
+                p.future.set_result([out[offset:offset + n] for out in preds])
+            else:
+                p.future.set_result(preds[offset:offset + n])
+            offset += n
+
+        with self._cond:
+            hist = self.batch_sizes.setdefault(model_name, Counter())
+            hist[sum(sizes)] += 1
+            waited = max(now - p.enqueued_at for p in batch)
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        logger.debug("microbatch %s: size=%d", model_name, sum(sizes))
+
+    def stats(self):
+        """モデルごとのバッチサイズ分布"""
+        with self._cond:
+            return {
+                "window": self.window,
+                "max_batch_size": self.max_batch_size,
+                "batch_sizes": {m: dict(sorted(h.items())) for m, h in self.batch_sizes.items()},
+                "wait_seconds_max": self.wait_seconds_max,
+                "queued": {m: self._queued_rows(q) for m, q in self._queues.items()},
+            }
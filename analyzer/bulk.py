@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+from django.db.models import Count
+
+from .models import MstImages, TransAnalysis, TransBatch
+from .uploads import IMAGE_EXTENSIONS, MAX_UPLOAD_BYTES, build_upload_key
+from . import facets, queue_position, signatures, transport
+
+logger = logging.getLogger(__name__)
+
+# 1メッセージでまとめて投入する解析の件数
+ENQUEUE_GROUP_SIZE = 10
+
+# S3へ同時にアップロードする件数（読み込んでアップロード待ちにする件数はこの2倍まで）
+UPLOAD_CONCURRENCY = 8
+
+
+class BulkUploadError(Exception):
+    pass
+
+
+def _is_image_name(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_members(files, archive=None):
+    """アップロードされたファイルとzip内の画像を (ファイル名, ストリーム) で順に返す"""
+    for f in files:
+        if f.size <= MAX_UPLOAD_BYTES and _is_image_name(f.name):
+            yield f.name, f
+    if archive is not None:
+        try:
+            zf = zipfile.ZipFile(archive)
+        except zipfile.BadZipFile:
+            raise BulkUploadError("The archive is not a valid zip file.")
+        with zf:
+            for info in zf.infolist():
+                if info.is_dir() or info.file_size > MAX_UPLOAD_BYTES or not _is_image_name(info.filename):
+                    continue
+                with zf.open(info) as member:
+                    yield info.filename, member
+
+
+def _upload(key, name, data):
+    transport.put_object(key, data, ContentType=mimetypes.guess_type(name)[0] or "application/octet-stream")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _upload_all(members, max_files, futures):
+    """
+    各画像を並列にS3へ保存し、futures に {キー: SHA-256のFuture} を追加する
+    途中で例外が出ても投入済みのキーが呼び出し側に残るよう、辞書は呼び出し側が渡す
+    アップロードされたファイルは既に一時ファイルに書き出されているので、1件ずつ読み込んでから送る
+    """
+    slots = threading.BoundedSemaphore(UPLOAD_CONCURRENCY * 2)
+    with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as pool:
+        for name, fileobj in members:
+            if len(futures) >= max_files:
+                break
+            key = build_upload_key(name)
+            # zipのメンバーは次のメンバーを開く前に読み切る（1件はMAX_UPLOAD_BYTES以下）
+            data = fileobj.read()
+            slots.acquire()
+            futures[key] = pool.submit(_upload, key, name, data)
+            futures[key].add_done_callback(lambda _: slots.release())
+
+
+def _delete_uploaded(keys):
+    """レコードを作れなかった画像をS3から消す"""
+    try:
+        transport.delete_objects(keys)
+    except Exception:
+        logger.warning("could not delete %d uploaded objects", len(keys), exc_info=True)
+
+
+def ingest(user, model_name, use_category, members, max_files):
+    """
+    各画像をS3へ保存し、レコードをbulk_createでまとめて作成して解析を投入する
+    途中で失敗した場合は保存済みの画像を消す。作成した TransBatch を返す
+    """
+    futures = {}
+    try:
+        _upload_all(members, max_files, futures)
+        hashes = {key: future.result() for key, future in futures.items()}
+        keys = list(hashes)
+        if not keys:
+            raise BulkUploadError("No valid image files were found.")
+        batch = _create_records(user, model_name, use_category, keys, hashes)
+    except BaseException:
+        if futures:
+            _delete_uploaded(list(futures))
+        raise
+
+    analysis_ids = list(
+        TransAnalysis.objects.filter(batch=batch).order_by("analysis_id").values_list("analysis_id", flat=True)
+    )
+    for i in range(0, len(analysis_ids), ENQUEUE_GROUP_SIZE):
+        signatures.analyze_images(analysis_ids[i:i + ENQUEUE_GROUP_SIZE], model_name, use_category)
+    return batch
+
+
+def _create_records(user, model_name, use_category, keys, hashes):
+    with transaction.atomic():
+        batch = TransBatch.objects.create(
+            user=user, model_name=model_name, use_category=use_category, total=len(keys)
+        )
+        MstImages.objects.bulk_create(
+            [MstImages(user=user, image=key, content_hash=hashes[key]) for key in keys],
+            batch_size=500,
+        )
+        # MySQLはbulk_createで主キーが返らないので取り直す
+        images = {
+            key: (image_id, uploaded_at)
+            for key, image_id, uploaded_at in MstImages.objects.filter(user=user, image__in=keys)
+            .values_list("image", "image_id", "uploaded_at")
+        }
+        first_seq = queue_position.allocate(len(keys))
+        TransAnalysis.objects.bulk_create(
+            [
+                TransAnalysis(image_id=images[key][0], user=user, uploaded_at=images[key][1], model_name=model_name,
+                              use_category=use_category, batch=batch, status="準備中",
+                              enqueue_seq=first_seq + i)
+                for i, key in enumerate(keys)
+            ],
+            batch_size=500,
+        )
+        facets.record_created(user.pk, model_name, len(keys))
+    return batch
+
+
+def progress(batch):
+    """バッチ全体の進捗（ステータスごとの件数）"""
+    counts = dict(
+        TransAnalysis.objects.filter(batch=batch)
+        .values("status")
+        .annotate(n=Count("analysis_id"))
+        .values_list("status", "n")
+    )
+    done = counts.get("成功", 0) + counts.get("失敗", 0)
+    return {
+        "batch_id": str(batch.batch_id),
+        "total": batch.total,
+        "counts": counts,
+        "done": done,
+        "progress": done / batch.total if batch.total else 1.0,
+        "finished": done >= batch.total,
+    }
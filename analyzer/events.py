@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BACKEND_LOCAL = "local"  # 同じプロセス内だけで配信（開発・単一プロセス用）
+BACKEND_REDIS = "redis"  # ワーカーからRedisのpub/subで全Webプロセスへ配信
+
+# キューが溢れた接続に送るイベント（クライアントは画面を読み直す）
+RESYNC = {"type": "resync"}
+
+
+def _conf():
+    conf = {
+        "backend": "",
+        "redis_url": "redis://localhost:6379/0",
+        "channel": "pic-analyzer-events",
+        "max_queue": 100,
+        "keepalive": 15,
+    }
+    conf.update(getattr(settings, "ANALYZER_EVENTS", {}) or {})
+    return conf
+
+
+def enabled():
+    return _conf()["backend"] in (BACKEND_LOCAL, BACKEND_REDIS)
+
+
+def keepalive_seconds():
+    return _conf()["keepalive"]
+
+
+class Subscriber:
+    """
+    1接続分の受信キュー（上限 max_queue 件）
+    溢れたら溜まっている分を捨てて resync だけを送る
+    """
+
+    def __init__(self, user_id, max_queue):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_queue)
+
+    def put(self, event):
+        """イベントループのスレッドで呼ぶ"""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Broker:
+    """ユーザーIDごとの接続へのファンアウト（どのスレッドからでも publish できる）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, user_id, max_queue):
+        subscriber = Subscriber(user_id, max_queue)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[subscriber.user_id]
+
+    def dispatch(self, user_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.put, event)
+            except RuntimeError:
+                # 接続のイベントループが既に終了している
+                self.unsubscribe(subscriber)
+
+    def connections(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+
+broker = Broker()
+
+_redis = None
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _redis_client():
+    global _redis
+    if _redis is None:
+        import redis
+
+        _redis = redis.Redis.from_url(_conf()["redis_url"])
+    return _redis
+
+
+def _listen():
+    """Redisのチャンネルを購読してこのプロセスの接続へ配る（切断されたら再接続）"""
+    channel = _conf()["channel"]
+    while True:
+        try:
+            pubsub = _redis_client().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel)
+            for message in pubsub.listen():
+                payload = json.loads(message["data"])
+                broker.dispatch(payload["user_id"], payload["event"])
+        except Exception:
+            logger.warning("event listener disconnected", exc_info=True)
+            time.sleep(1)
+
+
+def _ensure_listener():
+    global _listener
+    if _listener is None:
+        with _listener_lock:
+            if _listener is None:
+                _listener = threading.Thread(target=_listen, name="event-listener", daemon=True)
+                _listener.start()
+
+
+def subscribe(user_id):
+    """接続（SSE）ごとに呼ぶ。イベントループ内から呼ぶこと"""
+    conf = _conf()
+    if conf["backend"] == BACKEND_REDIS:
+        _ensure_listener()
+    return broker.subscribe(user_id, conf["max_queue"])
+
+
+def unsubscribe(subscriber):
+    broker.unsubscribe(subscriber)
+
+
+def publish(user_id, event):
+    """解析の状態・結果の変更を送る。配信に失敗しても解析処理は止めない"""
+    conf = _conf()
+    if conf["backend"] == BACKEND_LOCAL:
+        broker.dispatch(user_id, event)
+    elif conf["backend"] == BACKEND_REDIS:
+        try:
+            _redis_client().publish(conf["channel"], json.dumps({"user_id": user_id, "event": event}))
+        except Exception:
+            logger.warning("event publish failed", exc_info=True)
+
+
+def analysis_event(analysis_id, fields):
+    """TransAnalysisに書き込んだ列から画面の更新に必要なものだけを送る"""
+    event = {"type": "analysis", "analysis_id": analysis_id}
+    for name in ("status", "label", "error_name"):
+        if name in fields:
+            event[name] = fields[name]
+    if fields.get("reliability") is not None:
+        event["reliability"] = round(float(fields["reliability"]))
+    return event
+
+
+def publish_analyses(results):
+    """{analysis_id: 書き込んだ列} をそれぞれの所有ユーザーへ送る"""
+    if not enabled() or not results:
+        return
+    from .models import TransAnalysis
+
+    owners = dict(
+        TransAnalysis.objects.filter(pk__in=list(results)).values_list("analysis_id", "image__user_id")
+    )
+    for analysis_id, fields in results.items():
+        if analysis_id in owners:
+            publish(owners[analysis_id], analysis_event(analysis_id, fields))
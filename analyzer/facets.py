@@ -0,0 +1,136 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from .models import TransAnalysis, TransFacet
+
+LABEL = "label"    # ユーザーごと
+ERROR = "error"    # 全体
+MODEL = "model"    # 全体
+STATUS = "status"  # 全体
+
+ALL_USERS = 0
+
+# 集計する列（facetの種類, TransAnalysisの列, ユーザーごとか）
+FIELDS = [
+    (LABEL, "label", True),
+    (ERROR, "error_name", False),
+    (MODEL, "model_name", False),
+    (STATUS, "status", False),
+]
+
+
+def diff(user_id, before=None, after=None):
+    """
+    解析1件の変更前後（{列名: 値}、作成時はbefore=None、削除時はafter=None）から件数の差分を作る
+    afterに無い列は変更なしとみなす
+    """
+    before = before or {}
+    deltas = Counter()
+    for kind, field, per_user in FIELDS:
+        if after is not None and field not in after:
+            continue
+        scope = user_id if per_user else ALL_USERS
+        old = before.get(field)
+        new = after.get(field) if after is not None else None
+        if old == new:
+            continue
+        if old:
+            deltas[(kind, scope, old)] -= 1
+        if new:
+            deltas[(kind, scope, new)] += 1
+    return deltas
+
+
+def apply(deltas):
+    """差分を TransFacet に反映（行が無ければ作成）"""
+    for (kind, user_id, value), delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        rows = TransFacet.objects.filter(kind=kind, user_id=user_id, value=value)
+        if rows.update(count=F("count") + delta):
+            continue
+        try:
+            with transaction.atomic():
+                TransFacet.objects.create(kind=kind, user_id=user_id, value=value, count=max(delta, 0))
+        except IntegrityError:
+            # 同時に作成された場合は加算し直す
+            rows.update(count=F("count") + delta)
+
+
+def record_created(user_id, model_name, n=1):
+    """準備中の解析をn件作成した"""
+    apply(Counter({
+        (STATUS, ALL_USERS, "準備中"): n,
+        (MODEL, ALL_USERS, model_name): n,
+    }))
+
+
+def record_results(results, previous_status="解析中"):
+    """
+    解析中の行に結果（{analysis_id: {列名: 値}}）を書き込んだ
+    ラベルはユーザーごとなので、ラベルのある行だけユーザーIDを引く
+    """
+    labelled = [aid for aid, fields in results.items() if fields.get("label")]
+    users = dict(
+        TransAnalysis.objects.filter(pk__in=labelled).values_list("analysis_id", "image__user_id")
+    ) if labelled else {}
+
+    deltas = Counter()
+    for analysis_id, fields in results.items():
+        before = {"status": previous_status} if "status" in fields else {}
+        deltas.update(diff(users.get(analysis_id, ALL_USERS), before, fields))
+    apply(deltas)
+
+
+def record_deleted(analyses):
+    """
+    削除する解析（クエリセット）の件数を値ごとにまとめて差し引く
+    画像・ユーザーの削除前に呼ぶ（解析1件ごとに数えると削除が1件ずつになるため）
+    """
+    deltas = Counter()
+    for kind, user_id, value, n in _aggregate(analyses):
+        deltas[(kind, user_id, value)] -= n
+    apply(deltas)
+
+
+def values(kind, user_id=ALL_USERS):
+    """件数が1件以上の値の一覧（プルダウンの選択肢）"""
+    return list(
+        TransFacet.objects.filter(kind=kind, user_id=user_id, count__gt=0)
+        .order_by("value")
+        .values_list("value", flat=True)
+    )
+
+
+def counts(kind, user_id=ALL_USERS):
+    return dict(
+        TransFacet.objects.filter(kind=kind, user_id=user_id, count__gt=0).values_list("value", "count")
+    )
+
+
+def _aggregate(analyses):
+    """解析のクエリセットを (facetの種類, ユーザーID, 値, 件数) に集計"""
+    for kind, field, per_user in FIELDS:
+        group = ["image__user_id", field] if per_user else [field]
+        aggregated = (
+            analyses.exclude(**{f"{field}__isnull": True}).exclude(**{field: ""})
+            .values(*group).annotate(n=Count("analysis_id")).values_list(*group, "n")
+        )
+        for row in aggregated:
+            user_id, value, n = row if per_user else (ALL_USERS, *row)
+            yield kind, user_id, value, n
+
+
+def rebuild():
+    """TransAnalysisから全件を数え直す（差分更新のずれの補正用。解析を直接削除した場合もこれで直す）"""
+    rows = [
+        TransFacet(kind=kind, user_id=user_id, value=value, count=n)
+        for kind, user_id, value, n in _aggregate(TransAnalysis.objects.all())
+    ]
+
+    with transaction.atomic():
+        TransFacet.objects.all().delete()
+        TransFacet.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
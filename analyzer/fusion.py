@@ -0,0 +1,72 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _nested_backbone(model):
+    """転移学習モデル（入力 → ベースモデル → ヘッド）のベース部分を探す"""
+    for layer in model.layers:
+        if hasattr(layer, "layers") and len(layer.layers) > 1:
+            return layer
+    return None
+
+
+def _same_weights(backbone, model):
+    """backboneの各層がmodelの同名層と同じ重みか"""
+    for layer in backbone.layers:
+        weights = layer.get_weights()
+        if not weights:
+            continue
+        try:
+            other = model.get_layer(layer.name).get_weights()
+        except ValueError:
+            return False
+        if len(other) != len(weights):
+            return False
+        if not all(np.array_equal(a, b) for a, b in zip(weights, other)):
+            return False
+    return True
+
+
+def _shared_backbone_outputs(primary, human):
+    """
+    Human専用モデルのベースが主モデルと同じ重みなら、主モデルの中間出力にHumanのヘッドだけを繋ぐ
+    共有できない構成ならNoneを返す
+    """
+    backbone = _nested_backbone(human)
+    if backbone is None:
+        return None
+    try:
+        feature = primary.get_layer(backbone.layers[-1].name).output
+    except ValueError:
+        return None
+    if not _same_weights(backbone, primary):
+        return None
+
+    # ベース以降のヘッド層を順に適用（直列構成のみ対応）
+    head = human.layers[human.layers.index(backbone) + 1:]
+    x = feature
+    for layer in head:
+        x = layer(x)
+    return x
+
+
+class BackboneNotShared(Exception):
+    """主モデルとHuman専用モデルのベースを共有できない"""
+
+
+def build_fused_model(primary, human):
+    """
+    主モデルとHuman専用モデルを1つの多出力グラフにまとめる
+    出力は [主モデルの予測, Human専用の予測]
+    ベースを共有できない場合は BackboneNotShared（2つのベースを毎回推論すると倍のコストになるため融合しない）
+    """
+    import keras
+
+    human_out = _shared_backbone_outputs(primary, human)
+    if human_out is None:
+        raise BackboneNotShared(f"{primary.name} and {human.name} do not share a backbone")
+    logger.info("fused model: sharing backbone between %s and %s", primary.name, human.name)
+    return keras.Model(primary.inputs, [primary.outputs[0], human_out])
@@ -0,0 +1,88 @@
+import resource
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# MODEL_MAPの全モデル共通の入力サイズ
+TARGET_SIZE = (224, 224)
+
+_RESAMPLE = {
+    "nearest": Image.NEAREST,
+    "bilinear": Image.BILINEAR,
+    "bicubic": Image.BICUBIC,
+}
+
+
+def decode_image(data, size=TARGET_SIZE, interpolation="nearest"):
+    """
+    画像（bytes またはファイルオブジェクト）を (224, 224, 3) のuint8配列にする
+    JPEGはdraftモードでDCT段階で縮小してからデコードするので、大きな写真でも速く省メモリ
+    EXIFの回転情報も反映する（floatへの変換は各モデルのpreprocess直前に行う）
+    """
+    img = Image.open(BytesIO(data) if isinstance(data, (bytes, bytearray, memoryview)) else data)
+    # 1/2, 1/4, 1/8 のうち size を下回らない最小の縮尺でデコードされる
+    img.draft("RGB", size)
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if img.size != size:
+        img = img.resize(size, _RESAMPLE[interpolation])
+    return np.asarray(img, dtype=np.uint8)
+
+
+def decode_batch(items, size=TARGET_SIZE):
+    """複数画像を (n, 224, 224, 3) のuint8配列にする"""
+    arrays = [decode_image(item, size) for item in items]
+    if not arrays:
+        return np.zeros((0, size[1], size[0], 3), dtype=np.uint8)
+    return np.stack(arrays)
+
+
+def _legacy_decoder():
+    """従来の読み込み（keras.preprocessing.image、フル解像度デコード + float32）を返す"""
+    from tensorflow.keras.preprocessing import image
+
+    def decode(data):
+        img = image.load_img(BytesIO(data), target_size=TARGET_SIZE)
+        return image.img_to_array(img)
+
+    return decode
+
+
+def benchmark_decode(kind, paths, repeat=3):
+    """
+    デコード方式ごとの速度とピークRSSを計測する（方式ごとに別プロセスで呼ぶこと）
+    kind: "draft"（decode_image）または "legacy"
+    """
+    # TensorFlowの読み込みと初回呼び出しのコストを計測に含めないよう、先に1回デコードしておく
+    decode = decode_image if kind == "draft" else _legacy_decoder()
+    blobs = []
+    for path in paths:
+        with open(path, "rb") as f:
+            blobs.append(f.read())
+    if blobs:
+        decode(blobs[0])
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    latencies = []
+    for _ in range(repeat):
+        for data in blobs:
+            start = time.perf_counter()
+            decode(data)
+            latencies.append(time.perf_counter() - start)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "kind": kind,
+        "images": len(blobs),
+        "decodes": len(latencies),
+        "mean_ms": float(latencies_ms.mean()) if len(latencies_ms) else 0.0,
+        "p50_ms": float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else 0.0,
+        "p95_ms": float(np.percentile(latencies_ms, 95)) if len(latencies_ms) else 0.0,
+        # ru_maxrss はLinuxではKB単位
+        "peak_rss_mb": rss_after / 1024,
+        "peak_rss_growth_mb": (rss_after - rss_before) / 1024,
+    }
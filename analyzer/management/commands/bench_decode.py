@@ -0,0 +1,30 @@
+import json
+import multiprocessing
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analyzer import imaging, quantize
+
+
+class Command(BaseCommand):
+    help = "画像デコード（draft縮小デコード / 従来のkeras読み込み）の速度とピークRSSを比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("images", help="計測に使う画像ディレクトリ")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--limit", type=int, default=None)
+        parser.add_argument("--kinds", nargs="*", default=["legacy", "draft"])
+
+    def handle(self, *args, **options):
+        paths = quantize.list_images(options["images"], options["limit"])
+        if not paths:
+            raise CommandError("No images found.")
+
+        # ピークRSSが混ざらないよう方式ごとに新しいプロセスで計測
+        ctx = multiprocessing.get_context("spawn")
+        results = []
+        for kind in options["kinds"]:
+            with ctx.Pool(1) as pool:
+                results.append(pool.apply(imaging.benchmark_decode, (kind, paths, options["repeat"])))
+
+        self.stdout.write(json.dumps(results, indent=2))
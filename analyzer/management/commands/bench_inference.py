@@ -0,0 +1,156 @@
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from analyzer import quantize
+
+
+def benchmark_inference(model_name, paths, batch_size, threads, repeat, use_category):
+    """
+    1つのモデル・バッチサイズ・スレッド数で推論を計測する（組み合わせごとに新しいプロセスで呼ぶこと）
+    S3・SQS・DBには接続しない（モデルの成果物は cache_dir にあるものだけを使う）
+    """
+    import django
+
+    # モデル定義の読み込みでもDBドライバを使うので、接続先を使い捨てのSQLiteにしておく
+    settings.DATABASES = {"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}}
+    django.setup()
+    settings.ANALYZER_INFERENCE_THREADS = threads
+    settings.ANALYZER_BATCHING = {**settings.ANALYZER_BATCHING, "enabled": False}
+    settings.ANALYZER_MODEL_ARTIFACTS = {**settings.ANALYZER_MODEL_ARTIFACTS, "offline": True}
+
+    import numpy as np
+    from analyzer import tasks
+    from analyzer.imaging import decode_batch
+
+    # int8は変換済みのファイルがある場合だけ計測する（変換時間が初回の計測に混ざらないように）
+    if tasks.model_backend(model_name) == quantize.BACKEND_INT8:
+        path = tasks.int8_model_path(model_name)
+        if not os.path.exists(path):
+            return {"model_name": model_name, "backend": quantize.BACKEND_INT8, "batch_size": batch_size,
+                    "threads": threads, "skipped": f"{path} not found (run manage.py quantize_models)"}
+
+    x = decode_batch(paths)
+    batches = [x[i:i + batch_size] for i in range(0, len(x), batch_size)]
+
+    def run(batch):
+        # run_model_inference と同じく推論してからラベル・カテゴリ集計（バッチの全行）
+        preds = tasks.predict(model_name, batch)
+        for row in range(len(batch)):
+            tasks.summarize_predictions(model_name, preds, use_category, top=30, row=row)
+
+    # 初回はモデル・ラベルのロードを含む
+    start = time.perf_counter()
+    run(batches[0])
+    cold_start = time.perf_counter() - start
+
+    latencies = []
+    images = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for batch in batches:
+            batch_start = time.perf_counter()
+            run(batch)
+            elapsed = time.perf_counter() - batch_start
+            # バッチ内の画像はどれもバッチ全体の完了を待つ
+            latencies.extend([elapsed] * len(batch))
+            images += len(batch)
+    warm_seconds = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "model_name": model_name,
+        "backend": tasks.model_backend(model_name),
+        "batch_size": batch_size,
+        "threads": threads,
+        "images": images,
+        "cold_start_seconds": cold_start,
+        "latency_ms": {
+            f"p{q}": float(np.percentile(latencies_ms, q)) for q in (50, 95, 99)
+        },
+        "ms_per_image": warm_seconds * 1000 / images,
+        "images_per_second": images / warm_seconds,
+        # ru_maxrss はLinuxではKB単位
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=str(settings.BASE_DIR),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "MODEL_MAPのモデルごとに、ローカルの画像で推論速度（バッチサイズ・スレッド数別）とピークRSSを計測する"
+
+    # DBに接続しない
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument("images", help="計測に使う画像ディレクトリ")
+        parser.add_argument("--models", nargs="*", default=None, help="対象モデル（省略時は全モデル）")
+        parser.add_argument("--batch-sizes", nargs="*", type=int, default=[1, 8, 32])
+        parser.add_argument("--threads", nargs="*", type=int, default=[1, os.cpu_count() or 1])
+        parser.add_argument("--repeat", type=int, default=3, help="画像全体を推論する回数（初回を除く）")
+        parser.add_argument("--limit", type=int, default=None)
+        parser.add_argument("--no-category", action="store_true", help="カテゴリ集計をしない")
+        parser.add_argument("--output", help="結果のJSONを書き込むファイル（省略時は標準出力）")
+
+    def handle(self, *args, **options):
+        # analyzer.tasks は TensorFlow を読み込むので、親プロセスではモデル名の一覧だけを使う
+        from analyzer.model_names import MODEL_NAMES
+
+        model_names = options["models"] or list(MODEL_NAMES)
+        unknown = [m for m in model_names if m not in MODEL_NAMES]
+        if unknown:
+            raise CommandError(f"Unknown model(s): {', '.join(unknown)}")
+
+        paths = quantize.list_images(options["images"], options["limit"])
+        if not paths:
+            raise CommandError("No images found.")
+
+        # ピークRSS・初回の所要時間が混ざらないよう組み合わせごとに新しいプロセスで計測
+        ctx = multiprocessing.get_context("spawn")
+        runs = []
+        for name in model_names:
+            for threads in options["threads"]:
+                for batch_size in options["batch_sizes"]:
+                    args = (name, paths, batch_size, threads, options["repeat"], not options["no_category"])
+                    try:
+                        with ctx.Pool(1) as pool:
+                            result = pool.apply(benchmark_inference, args)
+                    except Exception as e:
+                        result = {"model_name": name, "batch_size": batch_size, "threads": threads,
+                                  "error": f"{type(e).__name__}: {e}"}
+                    runs.append(result)
+                    status = result.get("images_per_second", result.get("error", result.get("skipped")))
+                    self.stderr.write(f"{name} batch={batch_size} threads={threads}: {status}")
+
+        report = {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "images": len(paths),
+            "repeat": options["repeat"],
+            "runs": runs,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
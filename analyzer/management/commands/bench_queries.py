@@ -0,0 +1,162 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test import RequestFactory
+
+from accounts.models import MstUsers
+from adminpanel.views import PicturesManagerView
+from analyzer import facets
+from analyzer.models import MstImages, TransAnalysis
+from analyzer.views import TopView
+
+BENCH_EMAIL = "bench-{}@example.com"
+LABELS = [f"label_{i:02d}" for i in range(30)]
+ERRORS = ["ValueError", "OSError", "UnidentifiedImageErr", "ResourceExhaustedErr"]
+MODELS = ["efficientnet_b0", "mobilenet_v2", "resnet50", "effb0_5class"]
+# (ステータス, 割合)
+STATUSES = [("成功", 80), ("失敗", 5), ("準備中", 10), ("解析中", 5)]
+# 実行計画でインデックス順に読めず並べ替えている印（sqlite / MySQL）
+SORT_MARKERS = ("USE TEMP B-TREE FOR ORDER BY", "Using filesort")
+
+
+class Command(BaseCommand):
+    help = (
+        "一覧画面（top / pictures_manager）のクエリの実行計画と所要時間をインデックス追加前後で比較する"
+        "（インデックスを一時的に削除するのでベンチマーク用のDBで実行すること）"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", action="store_true", help="計測用のユーザー・画像を作成する")
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--images", type=int, default=2000, help="1ユーザーあたりの画像数")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--current", action="store_true", help="インデックスを削除せず現在のスキーマで1回だけ計測する")
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            self.seed(options["users"], options["images"])
+
+        user = MstUsers.objects.filter(email=BENCH_EMAIL.format(0)).first()
+        staff = MstUsers.objects.filter(email=BENCH_EMAIL.format("staff")).first()
+        if user is None or staff is None:
+            raise CommandError("No benchmark data. Run with --seed first.")
+
+        scenarios = self.scenarios(user, staff)
+        if options["current"]:
+            result = {"current": self.measure(scenarios, options["repeat"])}
+        else:
+            # モデルのMeta.indexesを外した状態と戻した状態で計測
+            indexes = [(model, index) for model in (MstImages, TransAnalysis) for index in model._meta.indexes]
+            with connection.schema_editor() as editor:
+                for model, index in indexes:
+                    editor.remove_index(model, index)
+            try:
+                result = {"before": self.measure(scenarios, options["repeat"])}
+            finally:
+                with connection.schema_editor() as editor:
+                    for model, index in indexes:
+                        editor.add_index(model, index)
+            result["after"] = self.measure(scenarios, options["repeat"])
+
+        self.stdout.write(json.dumps(result, indent=2, ensure_ascii=False))
+
+    def seed(self, n_users, n_images):
+        """ユーザーごとに画像・解析結果を一括作成（ステータス・ラベルは実運用に近い偏りで）"""
+        rng = random.Random(0)
+        statuses = [s for s, weight in STATUSES for _ in range(weight)]
+        with transaction.atomic():
+            MstUsers.objects.filter(email__startswith="bench-").delete()
+            users = [MstUsers(email=BENCH_EMAIL.format(i), password="!", is_active=True) for i in range(n_users)]
+            users.append(MstUsers(email=BENCH_EMAIL.format("staff"), password="!", is_active=True, is_staff=True))
+            MstUsers.objects.bulk_create(users)
+
+        seq = 0
+        for user in MstUsers.objects.filter(email__startswith="bench-", is_staff=False):
+            with transaction.atomic():
+                keys = [f"uploads/bench/{user.pk}/{i}.jpg" for i in range(n_images)]
+                MstImages.objects.bulk_create([MstImages(user=user, image=k) for k in keys], batch_size=1000)
+                analyses = []
+                for image_id, uploaded_at in MstImages.objects.filter(user=user).values_list("image_id", "uploaded_at"):
+                    status = rng.choice(statuses)
+                    seq += 1
+                    analyses.append(TransAnalysis(
+                        image_id=image_id,
+                        user=user,
+                        uploaded_at=uploaded_at,
+                        model_name=rng.choice(MODELS),
+                        status=status,
+                        label=rng.choice(LABELS) if status == "成功" else None,
+                        error_name=rng.choice(ERRORS) if status == "失敗" else None,
+                        enqueue_seq=seq,
+                    ))
+                TransAnalysis.objects.bulk_create(analyses, batch_size=1000)
+        facets.rebuild()
+        self.stderr.write(f"seeded {n_users} users x {n_images} images")
+
+    def scenarios(self, user, staff):
+        return [
+            ("top", TopView, user, {}),
+            ("top status", TopView, user, {"status": "成功"}),
+            ("top label asc", TopView, user, {"label": LABELS[0], "sort": "asc"}),
+            ("pictures_manager", PicturesManagerView, staff, {}),
+            ("pictures_manager status", PicturesManagerView, staff, {"status": "準備中"}),
+            ("pictures_manager error", PicturesManagerView, staff, {"error": ERRORS[0]}),
+            ("pictures_manager model", PicturesManagerView, staff, {"model": MODELS[0]}),
+            ("pictures_manager user", PicturesManagerView, staff, {"user": user.email}),
+        ]
+
+    def run_view(self, view_class, user, params):
+        """テンプレートは描画せず、コンテキストのクエリセットを全て評価する（＝画面のDB処理）"""
+        request = RequestFactory().get("/", params)
+        request.user = user
+        view = view_class()
+        view.setup(request)
+        cache.clear()  # 待ち件数のキャッシュを使わない
+        context = view.get_context_data()
+        for value in context.values():
+            if isinstance(value, QuerySet):
+                list(value)
+
+    def measure(self, scenarios, repeat):
+        results = {}
+        for name, view_class, user, params in scenarios:
+            queries = []
+
+            def record(execute, sql, params_, many, ctx):
+                queries.append((sql, params_))
+                return execute(sql, params_, many, ctx)
+
+            with connection.execute_wrapper(record):
+                self.run_view(view_class, user, params)
+
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                self.run_view(view_class, user, params)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            plans = [self.explain(sql, p) for sql, p in queries if sql.lstrip().upper().startswith("SELECT")]
+            results[name] = {
+                "queries": len(queries),
+                "ms_median": round(statistics.median(timings), 2),
+                "ms_max": round(max(timings), 2),
+                # ORDER BY のために並べ替えているクエリの数（一覧のクエリがインデックス順に読めているか）
+                "sorting_queries": sum(
+                    any(marker in line for line in plan["plan"] for marker in SORT_MARKERS) for plan in plans
+                ),
+                "plans": plans,
+            }
+        return results
+
+    def explain(self, sql, params):
+        prefix = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+        return {"sql": sql, "plan": [" | ".join(str(c) for c in row) for row in rows]}
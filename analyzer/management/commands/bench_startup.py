@@ -0,0 +1,65 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# 新しいPythonプロセスで対象を読み込み、所要時間とRSSを出力する
+SCRIPT = """
+import json, os, sys, time
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", {settings_module!r})
+start = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - start
+from analyzer.registry import current_rss_bytes
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_mb": current_rss_bytes() / 1024 / 1024,
+    "tensorflow_loaded": "tensorflow" in sys.modules,
+}}))
+"""
+
+TARGETS = {
+    # WSGIアプリ + URLConf（ビュー）まで読み込む
+    "web": "import pic_analyzer.wsgi\nfrom django.urls import resolve\nresolve('/')",
+    # Celeryワーカーと同じくタスクモジュールまで読み込む
+    "worker": "import django\ndjango.setup()\nfrom pic_analyzer.celery import app\napp.loader.import_default_modules()",
+}
+
+
+class Command(BaseCommand):
+    help = "Webプロセス・ワーカープロセスの起動時間（import時間）とRSSを計測する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("targets", nargs="*", default=list(TARGETS))
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        unknown = [t for t in options["targets"] if t not in TARGETS]
+        if unknown:
+            raise CommandError(f"Unknown target(s): {', '.join(unknown)}")
+
+        report = {}
+        for target in options["targets"]:
+            script = SCRIPT.format(settings_module=settings.SETTINGS_MODULE, body=TARGETS[target])
+            runs = []
+            for _ in range(options["repeat"]):
+                proc = subprocess.run(
+                    [sys.executable, "-c", script],
+                    cwd=str(settings.BASE_DIR), env=os.environ.copy(),
+                    capture_output=True, text=True,
+                )
+                if proc.returncode != 0:
+                    raise CommandError(f"{target} failed:\n{proc.stderr}")
+                runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            report[target] = {
+                "seconds_median": statistics.median(r["seconds"] for r in runs),
+                "rss_mb_median": statistics.median(r["rss_mb"] for r in runs),
+                "tensorflow_loaded": runs[0]["tensorflow_loaded"],
+                "runs": runs,
+            }
+
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analyzer import artifacts
+
+# --publish-stock 用：Keras標準モデルの配布元（バンドル作成時に一度だけ取得する）
+STOCK_ORIGINS = {
+    "imagenet_class_index.json":
+        "https://storage.googleapis.com/download.tensorflow.org/data/imagenet_class_index.json",
+    "efficientnetb0.h5":
+        "https://storage.googleapis.com/keras-applications/efficientnetb0.h5",
+    "mobilenet_v2_1.0_224.h5":
+        "https://storage.googleapis.com/tensorflow/keras-applications/mobilenet_v2/"
+        "mobilenet_v2_weights_tf_dim_ordering_tf_kernels_1.0_224.h5",
+    "resnet50.h5":
+        "https://storage.googleapis.com/tensorflow/keras-applications/resnet/"
+        "resnet50_weights_tf_dim_ordering_tf_kernels.h5",
+}
+
+
+class Command(BaseCommand):
+    help = "モデル・ラベルの成果物をS3から並列にダウンロードし、ローカルキャッシュを検証する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("names", nargs="*", help="対象の成果物（省略時は全て）")
+        parser.add_argument("--refresh", action="store_true", help="ダウンロード済みでも取り直す")
+        parser.add_argument("--verify", action="store_true", help="ダウンロードせずS3との一致だけ確認")
+        parser.add_argument("--publish-stock", action="store_true",
+                            help="Keras標準モデルの重み・ラベルを取得して自前のS3バンドルへアップロード")
+
+    def handle(self, *args, **options):
+        names = options["names"] or artifacts.default_names()
+        unknown = [n for n in names if n not in artifacts.ARTIFACTS]
+        if unknown:
+            raise CommandError(f"Unknown artifact(s): {', '.join(unknown)}")
+
+        if options["publish_stock"]:
+            from keras.utils import get_file
+
+            for name, origin in STOCK_ORIGINS.items():
+                key = artifacts.publish(name, get_file(name, origin, cache_subdir="models"))
+                self.stdout.write(f"published {name} -> {key}")
+            return
+
+        if options["verify"]:
+            failed = False
+            for name, state in artifacts.verify(names).items():
+                self.stdout.write(f"{name}: {state}")
+                failed = failed or state != "ok"
+            if failed:
+                raise CommandError("Some artifacts are missing or stale.")
+            return
+
+        for name, path in artifacts.ensure(names, refresh=options["refresh"]).items():
+            self.stdout.write(f"{name}: {path}")
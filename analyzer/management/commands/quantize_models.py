@@ -0,0 +1,88 @@
+import json
+import os
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analyzer import quantize
+from analyzer.imaging import decode_batch
+from analyzer.tasks import (MODEL_MAP, build_float_model, int8_model_path)
+
+
+class Command(BaseCommand):
+    help = ("MODEL_MAPのモデルをint8 TFLiteに変換し、floatモデルとの精度差をレポートする"
+            "（ワーカーは変換しないので、int8を使うモデルは事前にこのコマンドで変換しておく）")
+
+    def add_arguments(self, parser):
+        parser.add_argument("images", help="キャリブレーション・評価に使う画像ディレクトリ")
+        parser.add_argument("--models", nargs="*", default=None, help="対象モデル（省略時は全モデル）")
+        parser.add_argument("--calibration", type=int, default=100,
+                            help="キャリブレーションに使う枚数（残りの画像で精度を評価する）")
+        parser.add_argument("--seed", type=int, default=0, help="キャリブレーション・評価への振り分けの乱数シード")
+        parser.add_argument("--force", action="store_true", help="変換済みのファイルがあっても作り直す")
+        parser.add_argument("--json", action="store_true", help="レポートをJSONで出力")
+
+    def handle(self, *args, **options):
+        model_names = options["models"] or list(MODEL_MAP)
+        unknown = [m for m in model_names if m not in MODEL_MAP]
+        if unknown:
+            raise CommandError(f"Unknown model(s): {', '.join(unknown)}")
+
+        paths = quantize.list_images(options["images"])
+        if not paths:
+            raise CommandError("No images found.")
+        # キャリブレーションに使った画像で評価すると精度を高く見積もるので、評価は残りの画像で行う
+        random.Random(options["seed"]).shuffle(paths)
+        calibration_paths = paths[:options["calibration"]]
+        eval_paths = paths[options["calibration"]:]
+        if not eval_paths:
+            raise CommandError(
+                f"Need more than {options['calibration']} images to keep a held-out evaluation set."
+            )
+        raw_calibration = decode_batch(calibration_paths)
+        raw_eval = decode_batch(eval_paths)
+
+        report = {}
+        for name in model_names:
+            _, preprocess, _ = MODEL_MAP[name]
+            x = preprocess(raw_eval.astype("float32"))
+            float_model = build_float_model(name)
+
+            path = int8_model_path(name)
+            if options["force"] or not os.path.exists(path):
+                self.stderr.write(f"converting {name} to int8...")
+                calibration = preprocess(raw_calibration.astype("float32"))
+                quantize.write_atomic(path, quantize.convert_to_int8(float_model, calibration))
+            int8_model = quantize.TFLiteModel(path)
+
+            start = time.perf_counter()
+            float_preds = float_model.predict(x, verbose=0)
+            float_sec = time.perf_counter() - start
+
+            start = time.perf_counter()
+            int8_preds = int8_model.predict(x)
+            int8_sec = time.perf_counter() - start
+
+            result = quantize.compare_predictions(float_preds, int8_preds)
+            result.update({
+                "path": path,
+                "calibration_images": len(calibration_paths),
+                "float_ms_per_image": float_sec * 1000 / len(x),
+                "int8_ms_per_image": int8_sec * 1000 / len(x),
+                "int8_size_bytes": os.path.getsize(path),
+            })
+            report[name] = result
+
+            if not options["json"]:
+                self.stdout.write(
+                    f"{name}: top1={result['top1_agreement']:.3f} "
+                    f"top5={result['top5_overlap']:.3f} "
+                    f"mean_delta={result['mean_abs_prob_delta']:.5f} "
+                    f"float={result['float_ms_per_image']:.1f}ms "
+                    f"int8={result['int8_ms_per_image']:.1f}ms -> {path}"
+                )
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from analyzer import facets
+
+
+class Command(BaseCommand):
+    help = "絞り込みの選択肢・ステータス別件数の集計テーブルを TransAnalysis から作り直す"
+
+    def handle(self, *args, **options):
+        rows = facets.rebuild()
+        self.stdout.write(f"{rows} facet rows rebuilt")
@@ -0,0 +1,77 @@
+import os
+import shlex
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "settings.ANALYZER_WORKER_PROFILES のプロファイル（キュー・プール・並列数）でCeleryワーカーを起動する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("profile", help="、".join(settings.ANALYZER_WORKER_PROFILES))
+        parser.add_argument("--concurrency", type=int, help="プロファイルの並列数を上書き")
+        parser.add_argument("--loglevel", default="info")
+        parser.add_argument("--print", action="store_true",
+                            help="起動せずにceleryコマンドを表示（systemd等の設定用、exporterのポートは環境変数で渡す）")
+
+    def handle(self, *args, **options):
+        profiles = settings.ANALYZER_WORKER_PROFILES
+        if options["profile"] not in profiles:
+            raise CommandError(f"unknown profile: {options['profile']} (choose from {', '.join(profiles)})")
+        conf = profiles[options["profile"]]
+
+        concurrency = options["concurrency"] or conf.get("concurrency") or os.cpu_count() or 1
+        argv = [
+            "worker",
+            "-Q", ",".join(conf["queues"]),
+            "-P", conf.get("pool", "prefork"),
+            "-c", str(concurrency),
+            "--prefetch-multiplier", str(conf.get("prefetch_multiplier", 1)),
+            "-n", f"{options['profile']}@%h",
+            "-l", options["loglevel"],
+        ]
+        if conf.get("max_tasks_per_child"):
+            argv += ["--max-tasks-per-child", str(conf["max_tasks_per_child"])]
+
+        env = []
+        if conf.get("metrics_port") and settings.ANALYZER_METRICS.get("worker_port"):
+            # 同じホストで複数のプロファイルを動かしてもexporterのポートが重ならないように
+            self.check_metrics_ports(options["profile"], concurrency)
+            settings.ANALYZER_METRICS = {**settings.ANALYZER_METRICS, "worker_port": conf["metrics_port"]}
+            env = ["env", f"ANALYZER_METRICS_PORT={conf['metrics_port']}"]
+
+        if options["print"]:
+            self.stdout.write(shlex.join([*env, "celery", "-A", "pic_analyzer", *argv]))
+            return
+
+        from pic_analyzer.celery import app
+
+        app.worker_main(argv)
+
+
+    def check_metrics_ports(self, name, concurrency):
+        """
+        exporterのポート範囲（preforkなら親 + 子プロセスごとに+1+番号）が他のプロファイルと重ならないか
+        キューが重なるプロファイル（all など）は同じホストで一緒に動かさないので比べない
+        """
+        profiles = settings.ANALYZER_WORKER_PROFILES
+        conf = profiles[name]
+        start, end = metrics_ports(conf, concurrency)
+        for other_name, other in profiles.items():
+            if other_name == name or not other.get("metrics_port") or set(other["queues"]) & set(conf["queues"]):
+                continue
+            other_start, other_end = metrics_ports(other, other.get("concurrency") or os.cpu_count() or 1)
+            if start <= other_end and other_start <= end:
+                raise CommandError(
+                    f"metrics ports of {name} ({start}-{end}) overlap {other_name} ({other_start}-{other_end}); "
+                    "change metrics_port in ANALYZER_WORKER_PROFILES"
+                )
+
+
+def metrics_ports(conf, concurrency):
+    """プロファイルのexporterが使うポートの範囲（両端を含む）"""
+    port = conf["metrics_port"]
+    if conf.get("pool", "prefork") == "prefork":
+        return port, port + concurrency
+    return port, port
@@ -0,0 +1,288 @@
+# Prometheus形式（text exposition format）のメトリクス
+# Webプロセスは /metrics/ で、ワーカーは各プロセスの exporter（HTTP）で公開する
+import hmac
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+
+from .registry import current_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+PREFIX = "picanalyzer"
+
+# タスク所要時間のヒストグラムの区切り（秒）
+TASK_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_FAILURE = "failure"
+OUTCOME_SKIPPED = "skipped"  # 完了済み・削除済みで処理しなかった
+
+_lock = threading.Lock()
+_tasks = {}
+_queue_depth = {"at": 0.0, "values": {}}
+
+
+def _conf():
+    conf = {
+        "token": "",
+        "auth": True,
+        "bind": "127.0.0.1",
+        "worker_port": 9808,
+        "queue_depth_cache_seconds": 15,
+    }
+    conf.update(getattr(settings, "ANALYZER_METRICS", {}) or {})
+    return conf
+
+
+def authorized(header):
+    """
+    Authorization: Bearer <token> を要求する
+    authをFalseにした場合だけ認証なしで公開し、tokenが未設定なら常に拒否する
+    """
+    conf = _conf()
+    if not conf["auth"]:
+        return True
+    token = conf["token"]
+    if not token:
+        return False
+    return hmac.compare_digest((header or "").encode(), f"Bearer {token}".encode())
+
+
+def observe_task(model_name, outcome, seconds):
+    """解析1件の所要時間を記録"""
+    with _lock:
+        entry = _tasks.setdefault((model_name, outcome), {
+            "count": 0, "sum": 0.0, "buckets": [0] * len(TASK_BUCKETS),
+        })
+        entry["count"] += 1
+        entry["sum"] += seconds
+        for i, bound in enumerate(TASK_BUCKETS):
+            if seconds <= bound:
+                entry["buckets"][i] += 1
+
+
+class Exposition:
+    """メトリクスをテキスト形式に組み立てる"""
+
+    def __init__(self):
+        self._lines = []
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        escaped = (
+            '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for k, v in labels.items()
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    def add(self, name, kind, help_text, samples):
+        """samples: [(ラベルの辞書, 値)]。空なら何も出力しない"""
+        samples = [(labels, value) for labels, value in samples if isinstance(value, (int, float))]
+        if not samples:
+            return
+        name = f"{PREFIX}_{name}"
+        self._lines.append(f"# HELP {name} {help_text}")
+        self._lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self._lines.append(f"{name}{self._labels(labels)} {float(value)!r}")
+
+    def histogram(self, name, help_text, series):
+        """series: [(ラベルの辞書, {"count", "sum", "buckets"})]"""
+        if not series:
+            return
+        name = f"{PREFIX}_{name}"
+        self._lines.append(f"# HELP {name} {help_text}")
+        self._lines.append(f"# TYPE {name} histogram")
+        for labels, entry in series:
+            for bound, n in zip(TASK_BUCKETS, entry["buckets"]):
+                self._lines.append(f"{name}_bucket{self._labels({**labels, 'le': bound})} {n}")
+            self._lines.append(f"{name}_bucket{self._labels({**labels, 'le': '+Inf'})} {entry['count']}")
+            self._lines.append(f"{name}_sum{self._labels(labels)} {entry['sum']!r}")
+            self._lines.append(f"{name}_count{self._labels(labels)} {entry['count']}")
+
+    def stats(self, component, stats, label="key"):
+        """
+        既存の .stats() の辞書を出力する
+        数値はそのまま、{名前: 数値} はラベル付き、{名前: {項目: 数値}} は項目ごとにラベル付きで出力（リストは無視）
+        """
+        for key, value in (stats or {}).items():
+            name = f"{component}_{key}" if key else component
+            help_text = f"{component} {key}".strip()
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                self.add(name, "gauge", help_text, [({}, value)])
+            elif isinstance(value, dict):
+                self.add(name, "gauge", help_text,
+                         [({label: k}, v) for k, v in value.items() if not isinstance(v, dict)])
+                fields = sorted({f for v in value.values() if isinstance(v, dict) for f in v})
+                for field in fields:
+                    self.add(f"{name}_{field}", "gauge", f"{help_text} {field}",
+                             [({label: k}, v.get(field)) for k, v in value.items() if isinstance(v, dict)])
+
+    def render(self):
+        return "\n".join(self._lines) + "\n"
+
+
+def queue_names():
+    """ルーティング・ワーカープロファイルに出てくるキュー（プレフィックスなし）"""
+    names = {route["queue"] for route in getattr(settings, "CELERY_TASK_ROUTES", {}).values()}
+    for profile in getattr(settings, "ANALYZER_WORKER_PROFILES", {}).values():
+        names.update(profile["queues"])
+    return sorted(names)
+
+
+def queue_depth():
+    """
+    SQSキューごとの (待ち件数, 処理中件数)。APIを呼びすぎないよう一定時間キャッシュする
+    取得できなかったキューは含めない
+    """
+    conf = _conf()
+    with _lock:
+        if time.monotonic() - _queue_depth["at"] < conf["queue_depth_cache_seconds"]:
+            return dict(_queue_depth["values"])
+
+    from . import transport
+
+    prefix = settings.CELERY_BROKER_TRANSPORT_OPTIONS.get("queue_name_prefix", "")
+    values = {}
+    for name in queue_names():
+        try:
+            client = transport.sqs_client()
+            url = client.get_queue_url(QueueName=f"{prefix}{name}")["QueueUrl"]
+            attrs = client.get_queue_attributes(
+                QueueUrl=url,
+                AttributeNames=["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesNotVisible"],
+            )["Attributes"]
+            values[f"{prefix}{name}"] = (
+                int(attrs["ApproximateNumberOfMessages"]),
+                int(attrs["ApproximateNumberOfMessagesNotVisible"]),
+            )
+        except Exception:
+            logger.warning("queue depth unavailable: %s%s", prefix, name, exc_info=True)
+
+    with _lock:
+        _queue_depth.update(at=time.monotonic(), values=values)
+    return values
+
+
+def _process(exposition):
+    exposition.add("process_resident_memory_bytes", "gauge", "Resident set size of this process.",
+                   [({}, current_rss_bytes())])
+
+
+def web_metrics():
+    """Webプロセス: SQSのキュー深さ・解析状態別件数・SSE接続数・RSS"""
+    from . import events, facets
+
+    exposition = Exposition()
+    depth = queue_depth()
+    exposition.add("queue_messages", "gauge", "Approximate number of messages waiting in the SQS queue.",
+                   [({"queue": q}, v[0]) for q, v in depth.items()])
+    exposition.add("queue_messages_in_flight", "gauge", "Approximate number of messages being processed.",
+                   [({"queue": q}, v[1]) for q, v in depth.items()])
+    exposition.add("analyses", "gauge", "Number of analyses by status.",
+                   [({"status": s}, n) for s, n in facets.counts(facets.STATUS).items()])
+    exposition.add("event_connections", "gauge", "Open Server-Sent Events connections.",
+                   [({}, events.broker.connections())])
+    _process(exposition)
+    return exposition.render()
+
+
+def worker_metrics():
+    """ワーカープロセス: 解析タスク・モデルのロード・各コンポーネントの .stats()・RSS"""
+    from . import persistence, result_cache, tasks, tensor_cache, transport
+
+    exposition = Exposition()
+    with _lock:
+        series = sorted((key, {**v, "buckets": list(v["buckets"])}) for key, v in _tasks.items())
+    exposition.add("tasks_total", "counter", "Analyses processed by model and outcome.",
+                   [({"model_name": m, "outcome": o}, v["count"]) for (m, o), v in series])
+    exposition.histogram("task_duration_seconds", "Time spent per analysis by model and outcome.",
+                         [({"model_name": m, "outcome": o}, v) for (m, o), v in series])
+
+    registry = tasks.model_registry.stats()
+    loads = registry.pop("load_seconds")
+    exposition.add("model_loads_total", "counter", "Model loads by model.",
+                   [({"model_name": m}, len(v)) for m, v in loads.items()])
+    exposition.add("model_load_seconds_sum", "counter", "Total time spent loading each model.",
+                   [({"model_name": m}, sum(v)) for m, v in loads.items()])
+    exposition.add("model_load_seconds_last", "gauge", "Duration of the most recent load of each model.",
+                   [({"model_name": m}, v[-1]) for m, v in loads.items() if v])
+    exposition.add("model_loaded", "gauge", "Models currently held by the registry.",
+                   [({"model_name": m}, 1) for m in registry.pop("loaded")])
+    exposition.stats("model_registry", registry)
+
+    batcher = tasks._micro_batcher
+    if batcher is not None:
+        batching = batcher.stats()
+        sizes = batching.pop("batch_sizes")
+        exposition.add("batch_size", "counter", "Micro-batches executed by model and batch size.",
+                       [({"model_name": m, "size": s}, n) for m, h in sizes.items() for s, n in h.items()])
+        exposition.stats("batcher", batching, label="model_name")
+
+    exposition.stats("result_cache", result_cache.stats())
+    exposition.stats("tensor_cache", tensor_cache.stats())
+    exposition.stats("transport", {"": transport.stats()}, label="op")
+    exposition.stats("result_writer", persistence.get_writer().stats())
+    _process(exposition)
+    return exposition.render()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        if not authorized(self.headers.get("Authorization")):
+            self.send_error(401)
+            return
+        try:
+            body = worker_metrics().encode("utf-8")
+        except Exception:
+            logger.exception("metrics collection failed")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_pid = None
+
+
+def start_exporter(port):
+    """
+    ワーカープロセス内でexporterを起動（既に起動済み・ポート使用中なら何もしない）
+    待ち受けるアドレスは ANALYZER_METRICS['bind']（既定はローカルのみ）
+    """
+    global _server, _server_pid
+    # fork後の子プロセスには親のサーバースレッドが無いので作り直す
+    if _server is not None and _server_pid == os.getpid():
+        return _server
+    host = _conf()["bind"]
+    try:
+        _server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError:
+        logger.warning("metrics exporter could not bind %s:%d", host, port, exc_info=True)
+        return None
+    _server_pid = os.getpid()
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-exporter", daemon=True).start()
+    logger.info("metrics exporter listening on %s:%d", host, port)
+    return _server
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mstimages',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True, verbose_name='content_hash'),
+        ),
+        migrations.CreateModel(
+            name='TransResultCache',
+            fields=[
+                ('cache_id', models.AutoField(primary_key=True, serialize=False, verbose_name='cache_id')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='content_hash')),
+                ('model_name', models.CharField(max_length=20, verbose_name='model_name')),
+                ('use_category', models.BooleanField(default=False, verbose_name='use_category')),
+                ('version', models.CharField(max_length=40, verbose_name='version')),
+                ('label', models.CharField(max_length=20, null=True, verbose_name='label')),
+                ('top_preds', models.JSONField(blank=True, null=True, verbose_name='top_predictions')),
+                ('reliability', models.FloatField(null=True, verbose_name='reliability')),
+                ('hits', models.PositiveIntegerField(default=0, verbose_name='hits')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created_at')),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='last_used_at')),
+            ],
+            options={
+                'verbose_name': 'Trans Result Cache',
+                'verbose_name_plural': 'Trans Result Caches',
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'model_name', 'use_category', 'version'), name='uniq_result_cache_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:10
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0002_result_cache'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransBatch',
+            fields=[
+                ('batch_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='batch_id')),
+                ('model_name', models.CharField(max_length=20, verbose_name='model_name')),
+                ('use_category', models.BooleanField(default=False, verbose_name='use_category')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='total')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created_at')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'Trans Batch',
+                'verbose_name_plural': 'Trans Batches',
+            },
+        ),
+        migrations.AddField(
+            model_name='transanalysis',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='analyses', to='analyzer.transbatch', verbose_name='batch'),
+        ),
+    ]
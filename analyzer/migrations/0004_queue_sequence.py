@@ -0,0 +1,46 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:14
+
+from django.db import migrations, models
+
+
+def seed_queue(apps, schema_editor):
+    """既存の準備中の行にアップロード順で投入番号を振り、カウンタを初期化する"""
+    TransAnalysis = apps.get_model("analyzer", "TransAnalysis")
+    TransQueueCounter = apps.get_model("analyzer", "TransQueueCounter")
+
+    pending = list(
+        TransAnalysis.objects.filter(status="準備中").order_by("image__uploaded_at", "analysis_id")
+    )
+    for seq, analysis in enumerate(pending, 1):
+        analysis.enqueue_seq = seq
+    TransAnalysis.objects.bulk_update(pending, ["enqueue_seq"], batch_size=500)
+
+    TransQueueCounter.objects.update_or_create(name="enqueued", defaults={"value": len(pending)})
+    TransQueueCounter.objects.update_or_create(name="dequeued", defaults={"value": 0})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0003_bulk_batch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransQueueCounter',
+            fields=[
+                ('name', models.CharField(max_length=20, primary_key=True, serialize=False, verbose_name='name')),
+                ('value', models.BigIntegerField(default=0, verbose_name='value')),
+            ],
+            options={
+                'verbose_name': 'Trans Queue Counter',
+                'verbose_name_plural': 'Trans Queue Counters',
+            },
+        ),
+        migrations.AddField(
+            model_name='transanalysis',
+            name='enqueue_seq',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True, verbose_name='enqueue_seq'),
+        ),
+        migrations.RunPython(seed_queue, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0004_queue_sequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transanalysis',
+            name='enqueue_seq',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='enqueue_seq'),
+        ),
+        migrations.AddIndex(
+            model_name='mstimages',
+            index=models.Index(fields=['user', 'uploaded_at'], name='mst_images_user_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mstimages',
+            index=models.Index(fields=['uploaded_at'], name='mst_images_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transanalysis',
+            index=models.Index(fields=['status', 'enqueue_seq'], name='trans_an_status_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transanalysis',
+            index=models.Index(fields=['image', 'status'], name='trans_an_image_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transanalysis',
+            index=models.Index(fields=['image', 'label'], name='trans_an_image_label_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transanalysis',
+            index=models.Index(fields=['error_name'], name='trans_an_error_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transanalysis',
+            index=models.Index(fields=['model_name', 'status'], name='trans_an_model_status_idx'),
+        ),
+    ]
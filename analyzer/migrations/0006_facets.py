@@ -0,0 +1,49 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:18
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_facets(apps, schema_editor):
+    """既存の解析から選択肢・件数を集計する（analyzer.facets.rebuild と同じ内容）"""
+    TransAnalysis = apps.get_model("analyzer", "TransAnalysis")
+    TransFacet = apps.get_model("analyzer", "TransFacet")
+
+    rows = []
+    for kind, field, per_user in [("label", "label", True), ("error", "error_name", False),
+                                  ("model", "model_name", False), ("status", "status", False)]:
+        group = ["image__user_id", field] if per_user else [field]
+        aggregated = (
+            TransAnalysis.objects.exclude(**{f"{field}__isnull": True}).exclude(**{field: ""})
+            .values(*group).annotate(n=Count("analysis_id")).values_list(*group, "n")
+        )
+        for row in aggregated:
+            user_id, value, n = row if per_user else (0, *row)
+            rows.append(TransFacet(kind=kind, user_id=user_id, value=value, count=n))
+    TransFacet.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0005_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransFacet',
+            fields=[
+                ('facet_id', models.AutoField(primary_key=True, serialize=False, verbose_name='facet_id')),
+                ('kind', models.CharField(max_length=10, verbose_name='kind')),
+                ('user_id', models.IntegerField(default=0, verbose_name='user_id')),
+                ('value', models.CharField(max_length=40, verbose_name='value')),
+                ('count', models.IntegerField(default=0, verbose_name='count')),
+            ],
+            options={
+                'verbose_name': 'Trans Facet',
+                'verbose_name_plural': 'Trans Facets',
+                'constraints': [models.UniqueConstraint(fields=('kind', 'user_id', 'value'), name='uniq_facet_key')],
+            },
+        ),
+        migrations.RunPython(build_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0006_facets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transanalysis',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='updated_at'),
+        ),
+        migrations.AddIndex(
+            model_name='transanalysis',
+            index=models.Index(fields=['updated_at', 'analysis_id'], name='trans_an_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0007_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transanalysis',
+            name='stage_timings',
+            field=models.JSONField(blank=True, null=True, verbose_name='stage_timings'),
+        ),
+        migrations.AddIndex(
+            model_name='transanalysis',
+            index=models.Index(fields=['ended_at'], name='trans_an_ended_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0008_stage_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transanalysis',
+            name='enqueue_queue',
+            field=models.CharField(default='inference', max_length=20, verbose_name='enqueue_queue'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.2 on 2026-10-18 10:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_from_images(apps, schema_editor):
+    """既存の解析に画像の所有ユーザーとアップロード日時を写す（1回のUPDATE）"""
+    MstImages = apps.get_model("analyzer", "MstImages")
+    TransAnalysis = apps.get_model("analyzer", "TransAnalysis")
+
+    images = MstImages.objects.filter(pk=OuterRef("image_id"))
+    TransAnalysis.objects.update(
+        user_id=Subquery(images.values("user_id")[:1]),
+        uploaded_at=Subquery(images.values("uploaded_at")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0009_enqueue_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transanalysis',
+            name='uploaded_at',
+            field=models.DateTimeField(null=True, verbose_name='uploaded_at'),
+        ),
+        migrations.AddField(
+            model_name='transanalysis',
+            name='user',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='user'),
+        ),
+        migrations.RunPython(copy_from_images, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='transanalysis',
+            name='uploaded_at',
+            field=models.DateTimeField(verbose_name='uploaded_at'),
+        ),
+        migrations.AlterField(
+            model_name='transanalysis',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='user'),
+        ),
+        migrations.AddIndex(
+            model_name='transanalysis',
+            index=models.Index(fields=['user', 'uploaded_at', 'analysis_id'], name='trans_an_user_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transanalysis',
+            index=models.Index(fields=['uploaded_at', 'analysis_id'], name='trans_an_uploaded_idx'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+# 解析に使えるモデル名（analyzer.tasks.MODEL_MAP のキー）
+# Webプロセス・管理コマンドからTensorFlowを読み込まずに参照できるよう分けている
+MODEL_NAMES = (
+    'efficientnet_b0',
+    'mobilenet_v2',
+    'resnet50',
+    'effb0_1001human',
+    'effb0_5class',
+)
+
+DEFAULT_MODEL = 'efficientnet_b0'
+HUMAN_MODEL = 'effb0_1001human'
+
+
+def is_valid(model_name):
+    return model_name in MODEL_NAMES
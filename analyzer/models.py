@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
@@ -9,6 +11,8 @@ class MstImages(models.Model):
     user = models.ForeignKey(MstUsers, verbose_name=_("user"), on_delete=models.CASCADE)
     image = models.ImageField(verbose_name=_("image"), upload_to='uploads/')
     uploaded_at = models.DateTimeField(verbose_name=_("uploaded_at"), auto_now_add=True)
+    content_hash = models.CharField(verbose_name=_("content_hash"), max_length=64,
+                                    null=True, blank=True, db_index=True)  # 画像バイト列のSHA-256
 
     def __str__(self):
         return f"{self.image_id}({self.image.name})"
@@ -16,6 +20,29 @@ class MstImages(models.Model):
     class Meta:
         verbose_name = _("Mst Image")
         verbose_name_plural = _("Mst Images")
+        indexes = [
+            # ユーザーごとの一覧（アップロード日時順）
+            models.Index(fields=["user", "uploaded_at"], name="mst_images_user_uploaded_idx"),
+            # 管理画面の全件一覧（アップロード日時順）
+            models.Index(fields=["uploaded_at"], name="mst_images_uploaded_idx"),
+        ]
+
+
+class TransBatch(models.Model):
+    """一括アップロード1回分（進捗の問い合わせに使う）"""
+    batch_id = models.UUIDField(verbose_name=_("batch_id"), primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(MstUsers, verbose_name=_("user"), on_delete=models.CASCADE)
+    model_name = models.CharField(verbose_name=_("model_name"), max_length=20)
+    use_category = models.BooleanField(verbose_name=_("use_category"), default=False)
+    total = models.PositiveIntegerField(verbose_name=_("total"), default=0)
+    created_at = models.DateTimeField(verbose_name=_("created_at"), auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.batch_id}({self.total})"
+
+    class Meta:
+        verbose_name = _("Trans Batch")
+        verbose_name_plural = _("Trans Batches")
 
 
 class TransAnalysis(models.Model):
@@ -28,8 +55,15 @@ class TransAnalysis(models.Model):
 
     analysis_id = models.AutoField(verbose_name=_("analysis_id"), primary_key=True)
     image = models.ForeignKey(MstImages, verbose_name=_("image"), on_delete=models.CASCADE)
+    # 画像の所有ユーザーとアップロード日時の写し（一覧の絞り込みと並べ替えを TransAnalysis のインデックスだけで済ませる）
+    # 作成時に画像から設定する（画像側の値は作成後に変わらない）
+    user = models.ForeignKey(MstUsers, verbose_name=_("user"), on_delete=models.CASCADE,
+                             db_index=False, related_name="+")
+    uploaded_at = models.DateTimeField(verbose_name=_("uploaded_at"))
     model_name = models.CharField(verbose_name=_("model_name"), max_length=20)
     use_category = models.BooleanField(verbose_name=_("use_category"), default=False)
+    batch = models.ForeignKey(TransBatch, verbose_name=_("batch"), on_delete=models.SET_NULL,
+                              null=True, blank=True, related_name="analyses")
 
     status = models.CharField(verbose_name=_("status"), max_length=10,
                               choices=S_CHOICES, default="準備中")
@@ -43,9 +77,98 @@ class TransAnalysis(models.Model):
     error_log = models.TextField(verbose_name=_("error_log"), null=True)
     error_name = models.CharField(verbose_name=_("error_name"), max_length=20, null=True)
 
+    # 状態・結果の最終更新日時（.update()/bulk_update では自動で入らないので明示的に設定する）
+    updated_at = models.DateTimeField(verbose_name=_("updated_at"), auto_now=True)
+
+    # 解析待ちの順番（投入時に TransQueueCounter から採番）
+    enqueue_seq = models.BigIntegerField(verbose_name=_("enqueue_seq"), null=True, blank=True)
+    enqueue_queue = models.CharField(verbose_name=_("enqueue_queue"), max_length=20, default="inference")
+
+    # 工程ごとの所要時間（ミリ秒）。例: {"download": 35.2, "predict": 120.4, ...}（analyzer.timing）
+    stage_timings = models.JSONField(verbose_name=_("stage_timings"), null=True, blank=True)
+
     def __str__(self):
         return f"{self.analysis_id}({self.image.image.name[:20]})"
 
     class Meta:
         verbose_name = _("Trans Analysis")
-        verbose_name_plural = _("Trans Analyses")
\ No newline at end of file
+        verbose_name_plural = _("Trans Analyses")
+        indexes = [
+            # 一覧のアップロード日時順のキーセットページング（ユーザーごと・管理画面の全件）
+            models.Index(fields=["user", "uploaded_at", "analysis_id"], name="trans_an_user_uploaded_idx"),
+            models.Index(fields=["uploaded_at", "analysis_id"], name="trans_an_uploaded_idx"),
+            # 準備中の件数・待ち順、管理画面のステータス絞り込み
+            models.Index(fields=["status", "enqueue_seq"], name="trans_an_status_seq_idx"),
+            # ユーザーの画像に対するステータス・ラベル絞り込みとラベル一覧
+            models.Index(fields=["image", "status"], name="trans_an_image_status_idx"),
+            models.Index(fields=["image", "label"], name="trans_an_image_label_idx"),
+            # 管理画面のエラー名・モデル名の絞り込みと一覧
+            models.Index(fields=["error_name"], name="trans_an_error_idx"),
+            models.Index(fields=["model_name", "status"], name="trans_an_model_status_idx"),
+            # 状態APIの「カーソル以降に変わった行」
+            models.Index(fields=["updated_at", "analysis_id"], name="trans_an_updated_idx"),
+            # 管理画面の工程別所要時間（終了日時の期間で集計）
+            models.Index(fields=["ended_at"], name="trans_an_ended_idx"),
+        ]
+
+
+class TransQueueCounter(models.Model):
+    """解析待ちの順番管理（enqueued: 最後に採番した番号 / dequeued: 解析を開始した番号の最大値）"""
+    name = models.CharField(verbose_name=_("name"), max_length=20, primary_key=True)
+    value = models.BigIntegerField(verbose_name=_("value"), default=0)
+
+    def __str__(self):
+        return f"{self.name}({self.value})"
+
+    class Meta:
+        verbose_name = _("Trans Queue Counter")
+        verbose_name_plural = _("Trans Queue Counters")
+
+
+class TransFacet(models.Model):
+    """絞り込みの選択肢と件数（解析の作成・状態変更・削除のたびに差分で更新）"""
+    facet_id = models.AutoField(verbose_name=_("facet_id"), primary_key=True)
+    kind = models.CharField(verbose_name=_("kind"), max_length=10)  # label / error / model / status
+    user_id = models.IntegerField(verbose_name=_("user_id"), default=0)  # labelはユーザーごと、それ以外は0（全体）
+    value = models.CharField(verbose_name=_("value"), max_length=40)
+    count = models.IntegerField(verbose_name=_("count"), default=0)
+
+    def __str__(self):
+        return f"{self.kind}:{self.value}({self.count})"
+
+    class Meta:
+        verbose_name = _("Trans Facet")
+        verbose_name_plural = _("Trans Facets")
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "user_id", "value"], name="uniq_facet_key"),
+        ]
+
+
+class TransResultCache(models.Model):
+    """同じ画像・モデル・設定の解析結果を再利用するためのキャッシュ"""
+    cache_id = models.AutoField(verbose_name=_("cache_id"), primary_key=True)
+    content_hash = models.CharField(verbose_name=_("content_hash"), max_length=64)
+    model_name = models.CharField(verbose_name=_("model_name"), max_length=20)
+    use_category = models.BooleanField(verbose_name=_("use_category"), default=False)
+    version = models.CharField(verbose_name=_("version"), max_length=40)  # カテゴリーマップ・推論バックエンドの版
+
+    label = models.CharField(verbose_name=_("label"), max_length=20, null=True)
+    top_preds = models.JSONField(verbose_name=_("top_predictions"), null=True, blank=True)
+    reliability = models.FloatField(verbose_name=_("reliability"), null=True)
+
+    hits = models.PositiveIntegerField(verbose_name=_("hits"), default=0)
+    created_at = models.DateTimeField(verbose_name=_("created_at"), auto_now_add=True)
+    last_used_at = models.DateTimeField(verbose_name=_("last_used_at"), auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.content_hash[:12]}({self.model_name})"
+
+    class Meta:
+        verbose_name = _("Trans Result Cache")
+        verbose_name_plural = _("Trans Result Caches")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["content_hash", "model_name", "use_category", "version"],
+                name="uniq_result_cache_key",
+            ),
+        ]
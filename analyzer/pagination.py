@@ -0,0 +1,104 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+# 1ページの件数
+PAGE_SIZE = 50
+
+NEXT = "n"
+PREV = "p"
+
+
+def encode_cursor(analysis, direction):
+    """(アップロード日時, analysis_id, 方向) をURLに載せられる文字列にする"""
+    raw = f"{analysis.uploaded_at.isoformat()}|{analysis.analysis_id}|{direction}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """不正なカーソルはNone（先頭ページ）"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        uploaded_at, analysis_id, direction = raw.split("|")
+        if direction not in (NEXT, PREV):
+            return None
+        return datetime.fromisoformat(uploaded_at), int(analysis_id), direction
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _after(uploaded_at, analysis_id, descending):
+    """並び順で (uploaded_at, analysis_id) より後ろの行（先頭列の範囲条件でインデックスを使える形）"""
+    if descending:
+        return Q(uploaded_at__lte=uploaded_at) & (
+            Q(uploaded_at__lt=uploaded_at) | Q(analysis_id__lt=analysis_id)
+        )
+    return Q(uploaded_at__gte=uploaded_at) & (
+        Q(uploaded_at__gt=uploaded_at) | Q(analysis_id__gt=analysis_id)
+    )
+
+
+class Page:
+    def __init__(self, items, next_cursor, prev_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def paginate(queryset, cursor=None, descending=True, page_size=PAGE_SIZE):
+    """
+    (uploaded_at, analysis_id) のキーセットページング
+    OFFSETを使わないので、深いページでも読み飛ばす行を数えなくてよい
+    並び順のキーは TransAnalysis に写したアップロード日時なので、user での絞り込みと合わせて
+    (user, uploaded_at, analysis_id) のインデックスを順に読むだけで済む（並べ替えをしない）
+    """
+    order = ["-uploaded_at", "-analysis_id"] if descending else ["uploaded_at", "analysis_id"]
+    reverse_order = [f[1:] if f.startswith("-") else f"-{f}" for f in order]
+
+    key = decode_cursor(cursor)
+    if key is None:
+        rows = list(queryset.order_by(*order)[:page_size + 1])
+        has_more = len(rows) > page_size
+        items = rows[:page_size]
+        return Page(items, encode_cursor(items[-1], NEXT) if has_more else None, None)
+
+    uploaded_at, analysis_id, direction = key
+    if direction == NEXT:
+        rows = list(
+            queryset.filter(_after(uploaded_at, analysis_id, descending)).order_by(*order)[:page_size + 1]
+        )
+        has_more = len(rows) > page_size
+        items = rows[:page_size]
+        return Page(
+            items,
+            encode_cursor(items[-1], NEXT) if has_more else None,
+            encode_cursor(items[0], PREV) if items else None,
+        )
+
+    # 前のページは逆順に取得して並べ直す
+    rows = list(
+        queryset.filter(_after(uploaded_at, analysis_id, not descending)).order_by(*reverse_order)[:page_size + 1]
+    )
+    has_more = len(rows) > page_size
+    items = rows[:page_size][::-1]
+    return Page(
+        items,
+        encode_cursor(items[-1], NEXT) if items else None,
+        encode_cursor(items[0], PREV) if has_more else None,
+    )
+
+
+def page_queries(params, page):
+    """次・前のページへのクエリ文字列（絞り込み・並び順を引き継ぐ）"""
+    queries = {}
+    for name, cursor in (("next_query", page.next_cursor), ("prev_query", page.prev_cursor)):
+        if cursor:
+            query = params.copy()
+            query["cursor"] = cursor
+            queries[name] = query.urlencode()
+        else:
+            queries[name] = None
+    return queries
@@ -0,0 +1,208 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import TransAnalysis
+from . import events, facets, queue_position
+
+logger = logging.getLogger(__name__)
+
+def mark_started(analysis_id, use_category):
+    """
+    解析開始を記録（変更する列だけを条件付きUPDATE）
+    解析中の行は前回のワーカーが途中で落ちた場合の再配信なので、状態はそのままで開始日時だけ更新する
+    既に完了している行（重複配信など）や存在しない行ならFalse
+    """
+    now = timezone.now()
+    rows = TransAnalysis.objects.filter(pk=analysis_id)
+    # 状態の更新と集計の差分は同じトランザクションで（片方だけ反映されないように）
+    with transaction.atomic():
+        if rows.filter(status="準備中").update(status="解析中", started_at=now, use_category=use_category,
+                                             updated_at=now):
+            facets.apply(facets.diff(facets.ALL_USERS, {"status": "準備中"}, {"status": "解析中"}))
+        elif not rows.filter(status="解析中").update(started_at=now, use_category=use_category, updated_at=now):
+            return False
+    queue_position.mark_dequeued(analysis_id)
+    events.publish_analyses({analysis_id: {"status": "解析中"}})
+    return True
+
+
+class ResultWriter:
+    """
+    解析結果の書き込み
+    max_rows が1なら即時に変更列だけをUPDATE、それ以上なら件数か経過時間でまとめて bulk_update する
+    解析中の行だけに書き込む（書き込むまでの間に再解析で準備中に戻された行は上書きしない）
+    """
+
+    def __init__(self, max_rows=1, max_delay=0.5):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._pending = {}
+        self._first_at = None
+        self._cond = threading.Condition()
+        self._flusher = None
+
+        self.rows = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.flush_seconds_max = 0.0
+        self.failures = 0
+        self.skipped = 0
+        self._started_at = time.monotonic()
+
+    def write(self, analysis_id, fields):
+        """fields: {列名: 値}。同じ行への書き込みはまとめられる"""
+        if self.max_rows <= 1:
+            self._flush({analysis_id: fields})
+            return
+
+        with self._cond:
+            self._pending.setdefault(analysis_id, {}).update(fields)
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name="result-writer", daemon=True)
+                self._flusher.start()
+            full = len(self._pending) >= self.max_rows
+            self._cond.notify_all()
+        if full:
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._first_at is None:
+                    self._cond.wait()
+                remaining = self._first_at + self.max_delay - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+            try:
+                self.flush()
+            except Exception:
+                # 失敗した行は flush() が戻しているので、次の周期で書き直す（スレッドは止めない）
+                with self._cond:
+                    self.failures += 1
+
+    def _take(self):
+        with self._cond:
+            pending, self._pending = self._pending, {}
+            self._first_at = None
+        return pending
+
+    def _restore(self, pending):
+        """書き込めなかった行を戻す（その後に届いた同じ行の値を優先）"""
+        with self._cond:
+            for analysis_id, fields in self._pending.items():
+                pending.setdefault(analysis_id, {}).update(fields)
+            self._pending = pending
+            self._first_at = time.monotonic()
+            self._cond.notify_all()
+
+    def flush(self):
+        pending = self._take()
+        if pending:
+            close_old_connections()
+            try:
+                self._flush(pending)
+            except Exception:
+                self._restore(pending)
+                raise
+
+    def _flush(self, pending):
+        start = time.perf_counter()
+        # update()/bulk_update では auto_now が効かないので更新日時も書き込む
+        # 溜めている間ではなく書き込む直前の時刻にする（status_api のカーソルが書き込み順に進むように）
+        now = timezone.now()
+        pending = {analysis_id: {**fields, "updated_at": now} for analysis_id, fields in pending.items()}
+        # 更新する列の組み合わせごとにまとめる（成功と失敗で列が異なる）
+        groups = {}
+        for analysis_id, fields in pending.items():
+            groups.setdefault(tuple(sorted(fields)), []).append((analysis_id, fields))
+
+        # 実際に書き込んだ行（集計とイベントはこの行だけ）
+        written = {}
+        try:
+            with transaction.atomic():
+                for names, rows in groups.items():
+                    if len(rows) == 1:
+                        analysis_id, fields = rows[0]
+                        if TransAnalysis.objects.filter(pk=analysis_id, status="解析中").update(**fields):
+                            written[analysis_id] = fields
+                        continue
+                    # bulk_update は条件を付けられないので、解析中の行をロックしてから書き込む
+                    running = set(
+                        TransAnalysis.objects.select_for_update()
+                        .filter(pk__in=[analysis_id for analysis_id, _ in rows], status="解析中")
+                        .values_list("analysis_id", flat=True)
+                    )
+                    rows = [(analysis_id, fields) for analysis_id, fields in rows if analysis_id in running]
+                    if rows:
+                        objs = [TransAnalysis(pk=analysis_id, **fields) for analysis_id, fields in rows]
+                        TransAnalysis.objects.bulk_update(objs, list(names), batch_size=200)
+                        written.update(rows)
+                facets.record_results(written)
+        except Exception:
+            logger.exception("result flush failed (%d rows)", len(pending))
+            raise
+        if len(written) < len(pending):
+            logger.info("skipped %d results for analyses no longer running", len(pending) - len(written))
+        events.publish_analyses(written)
+
+        elapsed = time.perf_counter() - start
+        with self._cond:
+            self.rows += len(written)
+            self.skipped += len(pending) - len(written)
+            self.flushes += 1
+            self.flush_seconds += elapsed
+            self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+
+    def stats(self):
+        with self._cond:
+            uptime = time.monotonic() - self._started_at
+            return {
+                "rows": self.rows,
+                "flushes": self.flushes,
+                "pending": len(self._pending),
+                "failures": self.failures,
+                "skipped": self.skipped,
+                "rows_per_second": self.rows / uptime if uptime else 0.0,
+                "flush_seconds_avg": self.flush_seconds / self.flushes if self.flushes else 0.0,
+                "flush_seconds_max": self.flush_seconds_max,
+            }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """プロセス共通のResultWriter（ANALYZER_WRITE_BEHINDで設定）"""
+    global _writer
+    if _writer is None:
+        from django.conf import settings
+
+        conf = getattr(settings, "ANALYZER_WRITE_BEHIND", {}) or {}
+        with _writer_lock:
+            if _writer is None:
+                if conf.get("enabled"):
+                    _writer = ResultWriter(conf.get("max_rows", 50), conf.get("max_delay_ms", 500) / 1000)
+                else:
+                    _writer = ResultWriter()
+                # 終了時に溜まっている結果を書き出す（preforkの子プロセスは worker_process_shutdown から）
+                atexit.register(flush_writer)
+    return _writer
+
+
+def flush_writer():
+    """溜まっている結果を書き出す（ResultWriterを作っていなければ何もしない）"""
+    if _writer is None:
+        return
+    try:
+        _writer.flush()
+    except Exception:
+        logger.warning("pending results could not be written (%d rows)", len(_writer._pending))
@@ -0,0 +1,118 @@
+import logging
+import os
+import threading
+
+import numpy as np
+
+from .uploads import IMAGE_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+BACKEND_FLOAT = "float"
+BACKEND_INT8 = "int8"
+BACKENDS = (BACKEND_FLOAT, BACKEND_INT8)
+
+
+class QuantizedModelMissing(Exception):
+    """int8モデルが変換されていない"""
+
+
+def _interpreter_class():
+    """軽量ランタイムがあればそちらを使い、無ければTensorFlow同梱のものを使う"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    """TFLiteインタプリタをKerasモデルと同じ predict(x) で呼べるようにする"""
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self._interpreter = _interpreter_class()(model_path=path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch = 1
+        # インタプリタはスレッドセーフではない
+        self._lock = threading.Lock()
+
+    def predict(self, x, verbose=0):
+        x = np.asarray(x, dtype=self._input["dtype"])
+        with self._lock:
+            if len(x) != self._batch:
+                self._interpreter.resize_tensor_input(self._input["index"], [len(x), *x.shape[1:]])
+                self._interpreter.allocate_tensors()
+                self._batch = len(x)
+            self._interpreter.set_tensor(self._input["index"], x)
+            self._interpreter.invoke()
+            return np.array(self._interpreter.get_tensor(self._output["index"]))
+
+
+def convert_to_int8(keras_model, calibration=None):
+    """
+    学習後量子化でint8のTFLiteモデル（bytes）を作る
+    calibration（前処理済みの(n, 224, 224, 3)）があれば重み・活性とも int8、無ければ重みのみ int8
+    入出力はfloat32のままなので前処理・デコードは変えなくてよい
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if calibration is not None and len(calibration):
+        def representative_dataset():
+            for sample in calibration:
+                yield [np.expand_dims(sample, 0).astype(np.float32)]
+
+        # int8化できない演算だけfloatのまま残る
+        converter.representative_dataset = representative_dataset
+    return converter.convert()
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def load(path, num_threads=None):
+    """
+    変換済みのint8モデルを読み込む
+    変換には数分かかりワーカーを止めてしまうので、ここでは変換せず manage.py quantize_models に任せる
+    """
+    if not os.path.exists(path):
+        raise QuantizedModelMissing(f"{path} does not exist; run 'manage.py quantize_models' first")
+    return TFLiteModel(path, num_threads=num_threads)
+
+
+def list_images(directory, limit=None):
+    """ディレクトリ内の画像ファイルパス（ソート済み）"""
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return paths[:limit] if limit else paths
+
+
+def compare_predictions(float_preds, int8_preds, top=5):
+    """float と int8 の予測の差分（精度レポート用）"""
+    float_preds = np.asarray(float_preds)
+    int8_preds = np.asarray(int8_preds)
+    f_top = np.argsort(-float_preds, axis=-1)[:, :top]
+    q_top = np.argsort(-int8_preds, axis=-1)[:, :top]
+    overlap = [len(set(a) & set(b)) / top for a, b in zip(f_top, q_top)]
+    return {
+        "images": len(float_preds),
+        "top1_agreement": float(np.mean(f_top[:, 0] == q_top[:, 0])),
+        f"top{top}_overlap": float(np.mean(overlap)),
+        "mean_abs_prob_delta": float(np.mean(np.abs(float_preds - int8_preds))),
+        "max_abs_prob_delta": float(np.max(np.abs(float_preds - int8_preds))),
+    }
@@ -0,0 +1,80 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import TransAnalysis, TransQueueCounter
+from . import facets
+
+ENQUEUED = "enqueued"
+DEQUEUED = "dequeued"
+
+# 投入番号はキューごとに採番する（再解析キューの進み具合で新規アップロードの順番がずれないように）
+# 新規アップロードのキューは従来の enqueued / dequeued をそのまま使う
+DEFAULT_QUEUE = "inference"
+
+
+def _counter_name(name, queue):
+    return name if queue == DEFAULT_QUEUE else f"{name}:{queue}"
+
+# 全体の待ち件数は画面更新のたびに数えず短時間キャッシュする
+PENDING_COUNT_CACHE_KEY = "analyzer:pending_count"
+PENDING_COUNT_TTL = 5
+
+
+def allocate(n=1, queue=DEFAULT_QUEUE):
+    """queueのn件分の投入番号を採番し、先頭の番号を返す（先頭から連番で使う）"""
+    name = _counter_name(ENQUEUED, queue)
+    with transaction.atomic():
+        counter, _ = TransQueueCounter.objects.select_for_update().get_or_create(name=name)
+        TransQueueCounter.objects.filter(name=name).update(value=F("value") + n)
+    return counter.value + 1
+
+
+def mark_dequeued(analysis_id):
+    """解析を開始した行の投入番号まで、その行のキューの dequeued を進める（小さくはしない）"""
+    row = TransAnalysis.objects.filter(pk=analysis_id).values_list("enqueue_seq", "enqueue_queue").first()
+    if row is None or row[0] is None:
+        return
+    seq, queue = row
+    name = _counter_name(DEQUEUED, queue)
+    if not TransQueueCounter.objects.filter(name=name, value__lt=seq).update(value=seq):
+        # 初めて解析を開始したキューならカウンタを作る
+        TransQueueCounter.objects.get_or_create(name=name, defaults={"value": seq})
+
+
+def watermarks(queues):
+    """{キュー: dequeued}"""
+    names = {_counter_name(DEQUEUED, q): q for q in queues}
+    values = dict(TransQueueCounter.objects.filter(name__in=names).values_list("name", "value"))
+    return {q: values.get(name, 0) for name, q in names.items()}
+
+
+def watermark(queue=DEFAULT_QUEUE):
+    return watermarks([queue])[queue]
+
+
+def pending_count():
+    return cache.get_or_set(
+        PENDING_COUNT_CACHE_KEY,
+        lambda: facets.counts(facets.STATUS).get("準備中", 0),
+        PENDING_COUNT_TTL,
+    )
+
+
+def annotate(analyses):
+    """
+    各行に waiting_number（準備中なら待ち順、それ以外はNone）を付ける
+    順番は 投入番号 - その行のキューの dequeued の引き算で求め、全体の待ち件数を上限にする
+    """
+    analyses = list(analyses)
+    pending = [a for a in analyses if a.status == "準備中" and a.enqueue_seq is not None]
+    for analysis in analyses:
+        analysis.waiting_number = None
+    if not pending:
+        return analyses
+
+    done = watermarks({a.enqueue_queue for a in pending})
+    total = pending_count()
+    for analysis in pending:
+        analysis.waiting_number = max(1, min(analysis.enqueue_seq - done[analysis.enqueue_queue], total))
+    return analyses
@@ -0,0 +1,149 @@
+import gc
+import logging
+import os
+import resource
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import timing
+
+logger = logging.getLogger(__name__)
+
+
+def current_rss_bytes():
+    """現在のプロセスのRSS(byte)を返す"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # /procが無い環境ではピークRSSで代用（Linuxはkb単位）
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ModelRegistry:
+    """
+    ワーカープロセス単位のモデルキャッシュ
+    MODEL_MAPの名前をキーに一度だけロードし、RSS上限を超えたら最も古く使われたモデルから解放する
+    ロード中に別のモデルを get したら（融合モデルの部品など）参照関係を記録し、部品を解放するときは参照元も解放する
+    """
+
+    def __init__(self, loader, rss_budget_mb=None, rss_func=current_rss_bytes):
+        self._loader = loader
+        self._rss_budget_mb = rss_budget_mb
+        self._rss_func = rss_func
+        self._models = OrderedDict()
+        self._lock = threading.RLock()
+        self._loading = {}
+        self._deps = {}
+        self._local = threading.local()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = {}
+
+    @property
+    def rss_budget_bytes(self):
+        budget = self._rss_budget_mb
+        if budget is None:
+            budget = getattr(settings, "ANALYZER_MODEL_RSS_BUDGET_MB", None)
+        return int(budget * 1024 * 1024) if budget else None
+
+    def get(self, name):
+        """モデルを取得（無ければロード）"""
+        stack = getattr(self._local, "stack", None)
+        with self._lock:
+            if stack:
+                self._deps.setdefault(stack[-1], set()).add(name)
+            if name in self._models:
+                self._models.move_to_end(name)
+                self.hits += 1
+                return self._models[name]
+            self.misses += 1
+            # 同じモデルの同時ロードを防ぐ
+            name_lock = self._loading.setdefault(name, threading.Lock())
+
+        with name_lock:
+            with self._lock:
+                if name in self._models:
+                    self._models.move_to_end(name)
+                    return self._models[name]
+
+            start = time.perf_counter()
+            if stack is None:
+                stack = self._local.stack = []
+            stack.append(name)
+            try:
+                with timing.stage(timing.MODEL_LOAD):
+                    model = self._loader(name)
+            finally:
+                stack.pop()
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self._models[name] = model
+                self._models.move_to_end(name)
+                self.load_seconds.setdefault(name, []).append(elapsed)
+                self._loading.pop(name, None)
+                logger.info("model loaded: %s (%.2fs)", name, elapsed)
+                self._enforce_budget(keep=name)
+            return model
+
+    def _enforce_budget(self, keep=None):
+        """
+        RSS上限を超えていたら最も古く使われたモデルを1つ解放する
+        解放してもRSSはすぐには下がらないので、下がるまで繰り返すと全モデルを解放してしまう
+        """
+        budget = self.rss_budget_bytes
+        if not budget or self._rss_func() <= budget:
+            return
+        # ロードしたモデルとその部品、ロード中の参照元が使っている部品は解放しない
+        protected = set()
+        for n in [keep] + list(getattr(self._local, "stack", None) or []):
+            protected |= {n} | self._deps.get(n, set())
+        victim = next((n for n in self._models if n not in protected), None)
+        if victim is not None:
+            self._evict(victim)
+
+    def _evict(self, name):
+        # 参照元（部品として使っているモデル）が残っているとメモリは解放されないので一緒に解放する
+        names = [name] + [n for n, deps in self._deps.items() if name in deps and n in self._models]
+        for n in names:
+            self._models.pop(n, None)
+            self._deps.pop(n, None)
+            self.evictions += 1
+            logger.info("model evicted: %s", n)
+        gc.collect()
+
+    def evict(self, name):
+        with self._lock:
+            if name in self._models:
+                self._evict(name)
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._models):
+                self._evict(name)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    def stats(self):
+        """ヒット数・ミス数・ロード時間などの集計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "loaded": list(self._models),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "load_seconds": {n: list(v) for n, v in self.load_seconds.items()},
+                "rss_bytes": self._rss_func(),
+                "rss_budget_bytes": self.rss_budget_bytes,
+            }
@@ -0,0 +1,107 @@
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from .models import TransResultCache
+
+logger = logging.getLogger(__name__)
+
+# 何回保存するごとに件数上限をチェックするか
+PRUNE_EVERY = 100
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "stores": 0, "pruned": 0}
+
+
+def _conf():
+    return getattr(settings, "ANALYZER_RESULT_CACHE", {}) or {}
+
+
+def enabled():
+    return bool(_conf().get("enabled"))
+
+
+def content_hash(data):
+    """画像バイト列（bytes またはファイルオブジェクト）のSHA-256"""
+    h = hashlib.sha256()
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        h.update(data)
+    else:
+        for chunk in iter(lambda: data.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _count(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+
+def lookup(hash_value, model_name, use_category, version):
+    """キャッシュがあれば TransResultCache を返す（ヒット数・最終利用日時を更新）"""
+    if not enabled() or not hash_value:
+        return None
+    entry = (
+        TransResultCache.objects
+        .filter(content_hash=hash_value, model_name=model_name,
+                use_category=use_category, version=version)
+        .first()
+    )
+    if entry is None:
+        _count("misses")
+        return None
+    _count("hits")
+    TransResultCache.objects.filter(pk=entry.pk).update(
+        hits=F("hits") + 1, last_used_at=timezone.now()
+    )
+    return entry
+
+
+def store(hash_value, model_name, use_category, version, top_preds, label, reliability):
+    if not enabled() or not hash_value:
+        return
+    try:
+        TransResultCache.objects.create(
+            content_hash=hash_value, model_name=model_name, use_category=use_category,
+            version=version, top_preds=top_preds, label=label, reliability=reliability,
+        )
+    except IntegrityError:
+        # 同じ画像を別のワーカーが先に保存した
+        return
+
+    with _lock:
+        _counters["stores"] += 1
+        should_prune = _counters["stores"] % PRUNE_EVERY == 0
+    if should_prune:
+        prune()
+
+
+def prune(max_rows=None):
+    """件数上限を超えた分を最終利用日時の古い順に削除"""
+    max_rows = max_rows if max_rows is not None else _conf().get("max_rows")
+    if not max_rows:
+        return 0
+    excess = TransResultCache.objects.count() - max_rows
+    if excess <= 0:
+        return 0
+    old_ids = list(
+        TransResultCache.objects.order_by("last_used_at")
+        .values_list("cache_id", flat=True)[:excess]
+    )
+    deleted, _ = TransResultCache.objects.filter(cache_id__in=old_ids).delete()
+    _count("pruned", deleted)
+    logger.info("result cache pruned: %d rows", deleted)
+    return deleted
+
+
+def stats():
+    with _lock:
+        counters = dict(_counters)
+    lookups = counters["hits"] + counters["misses"]
+    counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+    return counters
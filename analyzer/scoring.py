@@ -0,0 +1,133 @@
+import hashlib
+import json
+import threading
+
+import numpy as np
+
+from .category_map import CATEGORY_MAP
+
+# カテゴリーマップの内容が変わったら変わる値（解析結果キャッシュのキーなどに使う）
+CATEGORY_MAP_VERSION = hashlib.sha256(
+    json.dumps(CATEGORY_MAP, sort_keys=True).encode("utf-8")
+).hexdigest()[:12]
+
+
+def top_k_indices(preds, k):
+    """各行の上位k件のインデックスを確率の降順で返す（全体をソートしない）"""
+    preds = np.asarray(preds)
+    k = min(k, preds.shape[-1])
+    idx = np.argpartition(preds, -k, axis=-1)[..., -k:]
+    part = np.take_along_axis(preds, idx, axis=-1)
+    order = np.argsort(-part, axis=-1, kind="stable")
+    return np.take_along_axis(idx, order, axis=-1)
+
+
+class CategoryScorer:
+    """
+    CATEGORY_MAPをクラス番号×カテゴリの所属行列にしておき、確率ベクトルとの行列積でカテゴリスコアを出す
+    """
+
+    def __init__(self, labels, category_map=CATEGORY_MAP):
+        self.categories = list(category_map)
+        keyword_sets = [set(category_map[c]) for c in self.categories]
+        self.matrix = np.array(
+            [[label.lower() in kws for kws in keyword_sets] for label in labels],
+            dtype=np.float32,
+        )
+
+    def score(self, preds, top=None):
+        """(n, classes) → (n, categories)。topを指定すると上位top件のラベルだけを集計"""
+        preds = np.asarray(preds, dtype=np.float32)
+        if top is not None and top < preds.shape[-1]:
+            idx = top_k_indices(preds, top)
+            masked = np.zeros_like(preds)
+            np.put_along_axis(masked, idx, np.take_along_axis(preds, idx, axis=-1), axis=-1)
+            preds = masked
+        return preds @ self.matrix
+
+    def ranking(self, scores):
+        """1行分のカテゴリスコアを [(カテゴリ, スコア), ...] の降順で返す"""
+        order = np.argsort(-scores, kind="stable")
+        return [(self.categories[i], float(scores[i])) for i in order]
+
+
+class LabelIndex:
+    """
+    クラス番号→ラベルの対応表（初回利用時に読み込んでメモリに保持）
+    decode_predictionsと同じ形式 [[(id, label, score), ...], ...] で返す
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._ids = None
+        self._labels = None
+        self._scorer = None
+
+    def _load(self):
+        with self._lock:
+            if self._labels is None:
+                ids, labels = self._loader()
+                self._ids = list(ids)
+                self._labels = list(labels)
+        return self._labels
+
+    @property
+    def labels(self):
+        return self._labels if self._labels is not None else self._load()
+
+    @property
+    def scorer(self):
+        if self._scorer is None:
+            self._scorer = CategoryScorer(self.labels)
+        return self._scorer
+
+    def decode(self, preds, top=5):
+        labels = self.labels
+        ids = self._ids
+        preds = np.asarray(preds)
+        results = []
+        for row, indices in zip(preds, top_k_indices(preds, top)):
+            results.append([(ids[i], labels[i], float(row[i])) for i in indices])
+        return results
+
+    __call__ = decode
+
+
+def index_from_mapping(mapping):
+    """{"0": "label", ...} 形式の辞書を (ids, labels) に変換（欠番はUnknown）"""
+    id_to_label = {int(k): v for k, v in mapping.items()}
+    size = max(id_to_label) + 1 if id_to_label else 0
+    ids = list(range(size))
+    return ids, [id_to_label.get(i, "Unknown") for i in ids]
+
+
+def _load_imagenet_labels():
+    """
+    Kerasの標準モデル用ImageNetラベル（decode_predictionsと同じファイル）
+    ANALYZER_STOCK_WEIGHTS_FROM_BUNDLE が有効なら自前のバンドルから、無効ならKerasの配布元から取得する
+    """
+    from . import artifacts
+
+    if artifacts.stock_from_bundle():
+        path = artifacts.path("imagenet_class_index.json")
+    else:
+        from keras.utils import get_file
+
+        path = get_file(
+            "imagenet_class_index.json",
+            "https://storage.googleapis.com/download.tensorflow.org/data/imagenet_class_index.json",
+            cache_subdir="models",
+            file_hash="c2c37ea517e94d9795004a39431a14cb",
+        )
+    with open(path, "r", encoding="utf-8") as f:
+        class_index = json.load(f)
+    ids, labels = [], []
+    for i in range(len(class_index)):
+        wnid, label = class_index[str(i)]
+        ids.append(wnid)
+        labels.append(label)
+    return ids, labels
+
+
+imagenet_labels = LabelIndex(_load_imagenet_labels)
@@ -0,0 +1,23 @@
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from accounts.models import MstUsers
+from .models import MstImages, TransAnalysis
+from . import facets
+
+# TransAnalysis自体には受信側を付けない（付けると CASCADE の一括削除が1件ずつの削除になる）
+
+
+@receiver(pre_delete, sender=MstUsers)
+def remove_user_from_facets(sender, instance, **kwargs):
+    """ユーザーの削除（CASCADEで消える解析）を集計テーブルから除く"""
+    facets.record_deleted(TransAnalysis.objects.filter(image__user=instance))
+
+
+@receiver(pre_delete, sender=MstImages)
+def remove_image_from_facets(sender, instance, origin=None, **kwargs):
+    """画像の削除（CASCADEで消える解析）を集計テーブルから除く"""
+    # ユーザーの削除に伴う場合はユーザー側でまとめて差し引いている
+    if isinstance(origin, MstUsers) or getattr(origin, "model", None) is MstUsers:
+        return
+    facets.record_deleted(TransAnalysis.objects.filter(image=instance))
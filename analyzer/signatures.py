@@ -0,0 +1,52 @@
+from pic_analyzer.celery import app
+
+# Webプロセスからはタスク名で投入する（analyzer.tasks を import すると TensorFlow まで読み込まれるため）
+ANALYZE_IMAGE_TASK = "analyzer.tasks.analyze_image_task"
+SAVE_IMAGE_AND_ANALYZE_TASK = "analyzer.tasks.save_image_and_analyze_task"
+ANALYZE_IMAGES_TASK = "analyzer.tasks.analyze_images_task"
+
+# 再解析用のキュー（通常の振り分けは settings.CELERY_TASK_ROUTES）
+REANALYZE_QUEUE = "reanalyze"
+
+
+def analyze_image(analysis_id, full_path, model_name, use_category=True, **options):
+    """analyze_image_task.delay と同じ引数で投入"""
+    return app.send_task(
+        ANALYZE_IMAGE_TASK,
+        kwargs={
+            "analysis_id": analysis_id,
+            "full_path": full_path,
+            "model_name": model_name,
+            "use_category": use_category,
+        },
+        **options,
+    )
+
+
+def save_image_and_analyze(image_key, user_id, model_name, use_category, content_hash=None, temp_path=None, **options):
+    """save_image_and_analyze_task.delay と同じ引数で投入"""
+    return app.send_task(
+        SAVE_IMAGE_AND_ANALYZE_TASK,
+        kwargs={
+            "image_key": image_key,
+            "user_id": user_id,
+            "model_name": model_name,
+            "use_category": use_category,
+            "content_hash": content_hash,
+            "temp_path": temp_path,
+        },
+        **options,
+    )
+
+
+def analyze_images(analysis_ids, model_name, use_category=True, **options):
+    """複数の解析を1メッセージで投入（一括アップロード用）"""
+    return app.send_task(
+        ANALYZE_IMAGES_TASK,
+        kwargs={
+            "analysis_ids": list(analysis_ids),
+            "model_name": model_name,
+            "use_category": use_category,
+        },
+        **options,
+    )
@@ -0,0 +1,73 @@
+import base64
+import hashlib
+from datetime import datetime, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.http import parse_etags
+
+# 1回の応答で返す件数の上限
+MAX_ITEMS = 100
+
+# updated_at を付けてからコミットされるまでの猶予
+# これより新しい行は次回に回す（後からコミットされた古い updated_at の行をカーソルが追い越さないように）
+SAFETY_WINDOW = timedelta(seconds=2)
+
+FIELDS = ("analysis_id", "status", "label", "reliability", "top_preds", "error_name", "updated_at")
+
+
+def encode_cursor(updated_at, analysis_id):
+    raw = f"{updated_at.isoformat()}|{analysis_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """不正なカーソルはValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        updated_at, analysis_id = raw.split("|")
+        return datetime.fromisoformat(updated_at), int(analysis_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor.")
+
+
+def changed_since(queryset, cursor=None):
+    """(updated_at, analysis_id) がカーソルより後で、SAFETY_WINDOW より前に更新された行を更新順に"""
+    queryset = queryset.filter(updated_at__lte=timezone.now() - SAFETY_WINDOW)
+    if cursor:
+        updated_at, analysis_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(updated_at__gte=updated_at) & (Q(updated_at__gt=updated_at) | Q(analysis_id__gt=analysis_id))
+        )
+    return queryset.order_by("updated_at", "analysis_id")
+
+
+def versions(queryset, limit=MAX_ITEMS):
+    """
+    ETag用に (analysis_id, updated_at) だけを読む（本体の列は読まない）
+    """
+    return list(queryset.values_list("analysis_id", "updated_at")[:limit])
+
+
+def etag(versions):
+    """行ごとの更新日時から弱いETagを作る"""
+    digest = hashlib.sha1()
+    for analysis_id, updated_at in versions:
+        digest.update(f"{analysis_id}:{updated_at.isoformat()};".encode("ascii"))
+    return f'W/"{digest.hexdigest()[:20]}"'
+
+
+def _opaque(tag):
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(header, value):
+    """If-None-Match は弱い比較（W/ の有無を無視）"""
+    tags = parse_etags(header or "")
+    return "*" in tags or _opaque(value) in {_opaque(t) for t in tags}
+
+
+def fetch(queryset, analysis_ids):
+    """応答の本体（versionsと同じ順番）"""
+    rows = {row["analysis_id"]: row for row in queryset.filter(pk__in=analysis_ids).values(*FIELDS)}
+    return [rows[aid] for aid in analysis_ids if aid in rows]
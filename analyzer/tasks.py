@@ -1,160 +1,427 @@
 from celery import shared_task
 from tensorflow.keras.applications import mobilenet_v2, resnet50, efficientnet
 from tensorflow.keras.applications import MobileNetV2, ResNet50, EfficientNetB0
-from tensorflow.keras.preprocessing import image
 import numpy as np
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 
 from django.utils import timezone
-from django.utils.text import slugify
-from django.db import transaction
-from django.core.files.images import ImageFile
+from django.db import connection, transaction
 from django.conf import settings
 
-from storages.backends.s3boto3 import S3Boto3Storage
-import boto3, os, uuid, requests, traceback
+import logging, mimetypes, os, threading, time, traceback
 
 from .models import MstImages,TransAnalysis
-from .category_map import CATEGORY_MAP  # カテゴリーマップのインポート
-from .ai import load_effb0_custom, decode_1001, load_5class_model, decode_5class
+from .scoring import imagenet_labels, CATEGORY_MAP_VERSION
+from . import result_cache, tensor_cache
+from .ai import load_effb0_custom, decode_1001, load_5class_model, decode_5class, MODEL_FILES, stock_weights
+from . import artifacts
+from .registry import ModelRegistry
+from .batching import MicroBatcher
+from .fusion import BackboneNotShared, build_fused_model
+from . import quantize
+from .imaging import decode_image
+from .uploads import build_upload_key
+from .model_names import MODEL_NAMES, DEFAULT_MODEL, HUMAN_MODEL
+from .signatures import ANALYZE_IMAGE_TASK, ANALYZE_IMAGES_TASK, SAVE_IMAGE_AND_ANALYZE_TASK
+from . import transport, persistence, queue_position, facets, metrics, timing
+
+logger = logging.getLogger(__name__)
 
 MODEL_MAP = {
-    'efficientnet_b0': (EfficientNetB0, efficientnet.preprocess_input, efficientnet.decode_predictions),
-    'mobilenet_v2': (MobileNetV2, mobilenet_v2.preprocess_input, mobilenet_v2.decode_predictions),
-    'resnet50': (ResNet50, resnet50.preprocess_input, resnet50.decode_predictions),
+    'efficientnet_b0': (EfficientNetB0, efficientnet.preprocess_input, imagenet_labels),
+    'mobilenet_v2': (MobileNetV2, mobilenet_v2.preprocess_input, imagenet_labels),
+    'resnet50': (ResNet50, resnet50.preprocess_input, imagenet_labels),
     'effb0_1001human': (load_effb0_custom, efficientnet.preprocess_input, decode_1001),
     'effb0_5class': (load_5class_model, efficientnet.preprocess_input, decode_5class),
 }
 
-def run_model_inference(model_name, image_data, use_category=True, top=30):
-    ModelClass, preprocess, decode = MODEL_MAP.get(model_name, MODEL_MAP['efficientnet_b0'])
-    model = ModelClass(weights='imagenet')
-    x = preprocess(image_data)
-    preds = model.predict(x)
-    decoded = decode(preds, top=top)[0]
+# 名前の一覧は model_names.MODEL_NAMES と揃えること
+assert tuple(MODEL_MAP) == MODEL_NAMES
+
+
+def configure_inference_threads():
+    """ANALYZER_INFERENCE_THREADSをTensorFlowに反映（最初の推論より前に呼ぶこと）"""
+    threads = getattr(settings, "ANALYZER_INFERENCE_THREADS", None)
+    if threads:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+    return threads
+
+
+configure_inference_threads()
+
+# Human専用モデルと1つのグラフで同時に推論できるモデル（前処理が共通のEfficientNet系）
+FUSED_HUMAN_PRIMARIES = ('efficientnet_b0', 'effb0_5class')
+
+# ベースを共有できず融合しなかったモデル（以後は必要な時だけHuman専用モデルを推論する）
+_unfused_primaries = set()
+
+
+def resolve_model_name(model_name):
+    """MODEL_MAPに無い名前はデフォルトモデルに置き換える"""
+    return model_name if model_name in MODEL_MAP else DEFAULT_MODEL
+
+
+def fused_model_name(model_name):
+    return f"{model_name}+{HUMAN_MODEL}"
+
+
+def _split_model_name(model_name):
+    """'主モデル+Human専用モデル' 形式の名前を分解"""
+    primary, _, human = model_name.partition('+')
+    return primary, human or None
+
+
+def model_backend(model_name):
+    """モデルごとの推論バックエンド（float / int8）。ANALYZER_MODEL_BACKENDSで指定"""
+    backends = getattr(settings, "ANALYZER_MODEL_BACKENDS", {}) or {}
+    backend = backends.get(model_name, quantize.BACKEND_FLOAT)
+    return backend if backend in quantize.BACKENDS else quantize.BACKEND_FLOAT
+
+
+def int8_model_path(model_name):
+    """int8モデルの保存先（カスタムモデルは元の.kerasファイルの隣）"""
+    if model_name in MODEL_FILES:
+        return os.path.splitext(artifacts.local_path(MODEL_FILES[model_name]))[0] + ".int8.tflite"
+    return artifacts.local_path(f"{model_name}.int8.tflite")
+
+
+def build_float_model(model_name):
+    ModelClass, _, _ = MODEL_MAP[model_name]
+    return ModelClass(weights=stock_weights(model_name))
+
+
+def _load_model(model_name):
+    primary, human = _split_model_name(model_name)
+    if human:
+        # 単体モデルもレジストリ経由で共有する
+        return build_fused_model(model_registry.get(primary), model_registry.get(human))
+    if model_backend(model_name) == quantize.BACKEND_INT8:
+        return quantize.load(
+            int8_model_path(model_name),
+            num_threads=getattr(settings, "ANALYZER_INFERENCE_THREADS", None),
+        )
+    return build_float_model(model_name)
+
+
+# プロセス内で使い回すモデル（タスクごとに再構築しない）
+model_registry = ModelRegistry(_load_model)
+
+_micro_batcher = None
+_micro_batcher_lock = threading.Lock()
+
+
+def _predict_direct(model_name, x):
+    primary, _ = _split_model_name(model_name)
+    _, preprocess, _ = MODEL_MAP[primary]
+    model = model_registry.get(model_name)
+    # preprocessは入力を書き換えることがあるためコピーしてから渡す
+    return model.predict(preprocess(np.array(x, dtype="float32")), verbose=0)
+
+
+def get_micro_batcher():
+    """ANALYZER_BATCHINGが有効ならプロセス共通のMicroBatcherを返す"""
+    global _micro_batcher
+    conf = getattr(settings, "ANALYZER_BATCHING", {}) or {}
+    if not conf.get("enabled"):
+        return None
+    with _micro_batcher_lock:
+        if _micro_batcher is None:
+            _micro_batcher = MicroBatcher(
+                _predict_direct,
+                window=conf.get("window_ms", 50) / 1000,
+                max_batch_size=conf.get("max_batch_size", 16),
+            )
+    return _micro_batcher
+
+
+def predict(model_name, x):
+    """x: (n, 224, 224, 3) を推論し (n, classes) の確率を返す"""
+    model_name = resolve_model_name(model_name)
+    batcher = get_micro_batcher()
+    if batcher is not None:
+        return batcher.predict(model_name, x)
+    return _predict_direct(model_name, x)
+
+
+def predict_with_human(model_name, x):
+    """
+    主モデルの予測と、可能ならHuman専用モデルの予測を1回の推論で返す
+    同時に推論できない場合、Human専用の予測はNone（必要になった時点で別途推論する）
+    """
+    model_name = resolve_model_name(model_name)
+    if model_name == HUMAN_MODEL:
+        preds = predict(model_name, x)
+        return preds, preds
+    fusable = (
+        model_name in FUSED_HUMAN_PRIMARIES
+        and model_name not in _unfused_primaries
+        and model_backend(model_name) == quantize.BACKEND_FLOAT
+        and model_backend(HUMAN_MODEL) == quantize.BACKEND_FLOAT
+    )
+    if getattr(settings, "ANALYZER_FUSED_HUMAN", False) and fusable:
+        batcher = get_micro_batcher()
+        name = fused_model_name(model_name)
+        try:
+            preds, human_preds = batcher.predict(name, x) if batcher else _predict_direct(name, x)
+            return preds, human_preds
+        except BackboneNotShared:
+            logger.info("fused model unavailable for %s; human model runs only when needed", model_name)
+            _unfused_primaries.add(model_name)
+    return predict(model_name, x), None
+
+
+def summarize_predictions(model_name, preds, use_category=True, top=30, row=0):
+    """予測(n, classes)のrow行目をラベル・カテゴリ集計に変換"""
+    _, _, labels = MODEL_MAP[resolve_model_name(model_name)]
+    preds = np.asarray(preds)[row:row + 1]
+    decoded = labels.decode(preds, top=top)[0]
 
     best_label = decoded[0][1]
     best_score = decoded[0][2]
 
-    from keras import backend as K
-    K.clear_session()
-
-    category_ranking = [] 
+    category_ranking = []
     if use_category:
-        scores = {cat: 0.0 for cat in CATEGORY_MAP}
-        for _, label, score in decoded:
-            label_lower = label.lower()
-            for category, keywords in CATEGORY_MAP.items():
-                if label_lower in keywords:
-                    scores[category] += score
-
-        category_ranking = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        # 上位top件のラベル確率をカテゴリ所属行列で集計
+        scores = labels.scorer.score(preds, top=top)[0]
+        category_ranking = labels.scorer.ranking(scores)
         best_label = category_ranking[0][0]
         best_score = category_ranking[0][1]
 
-
     return decoded, best_label, best_score, category_ranking
 
 
-@shared_task
+def result_cache_version(model_name):
+    """カテゴリーマップや推論バックエンドが変わったら古いキャッシュを使わない"""
+    return f"{CATEGORY_MAP_VERSION}:{model_backend(resolve_model_name(model_name))}"
+
+
+def run_model_inference(model_name, image_data, use_category=True, top=30):
+    preds = predict(model_name, image_data)
+    return summarize_predictions(model_name, preds, use_category, top)
+
+
+def fetch_image_bytes(image_ref):
+    """
+    S3キーならget_objectで直接、旧形式のメッセージ（署名付きURL）ならHTTPで取得
+    S3の場合は再利用バッファのmemoryviewを返すので、同じスレッドで次に取得するまでに使い終えること
+    """
+    if image_ref.startswith(("http://", "https://")):
+        return transport.http_get(image_ref)
+    return transport.get_object_view(image_ref)
+
+
+@shared_task(name=ANALYZE_IMAGE_TASK)
 def analyze_image_task(analysis_id, full_path, model_name, use_category=True):
-    try:
-        analysis = None
-        analysis = TransAnalysis.objects.get(pk=analysis_id)
-        analysis.status = "解析中"
-        analysis.started_at = timezone.now()
-        analysis.use_category = use_category
-        analysis.save()
-
-        # 画像読み込み
-        response = requests.get(full_path)
-        response.raise_for_status()
-        img = image.load_img(BytesIO(response.content), target_size=(224, 224))
-        x = np.expand_dims(image.img_to_array(img), axis=0)
-
-        # 推論
-        decoded, best_label, best_score, category_ranking = run_model_inference(model_name, x, use_category, top=30)
-
-        # decodeにカテゴリ集計結果を追加
-        for rank, (cat, score) in enumerate(category_ranking, 1):
-            decoded.append((
-                None,
-                f"{rank} {cat}",
-                float(score)
-            ))
-
-
-        # Humanカテゴリなら専用推論
-        if best_label == "Human (category)":
-            _, _, human_score, _ = run_model_inference("effb0_1001human", x, use_category=True, top=10)
-            # Human専用推論結果を追加（ラベル名を明示的に変更）
-            decoded.append((
-                None,
-                "Human (specialized)",
-                float(human_score)
-            ))
-
-            # best_score更新（高い方を採用）
-            if human_score > best_score:
-                best_score = human_score
-
-        # DB登録（Human専用推論も含めてまとめて1回）
-        analysis.top_preds = [
-            {'label': lbl, 'prob': float(prob)}
-            for (_id, lbl, prob) in decoded
-        ]
-
-        # 最終best_label / best_scoreを登録
-        analysis.label = best_label
-        analysis.reliability = best_score * 100
-        analysis.status = "成功"
-
-    except Exception as e:
-        if analysis:
-            analysis.status = "失敗"
-            analysis.error_name = type(e).__name__
-            analysis.error_log = traceback.format_exc()
-            analysis.save()
-        else: # DBエラーなどでanalysisが未定義の場合
-            print("TransAnalysisレコード取得失敗:", e)
+    """full_path: 画像のS3キー（旧形式のメッセージでは署名付きURL）"""
+    analyze_image(analysis_id, full_path, model_name, use_category)
+
 
+@shared_task(name=ANALYZE_IMAGES_TASK)
+def analyze_images_task(analysis_ids, model_name, use_category=True):
+    """
+    一括アップロードでまとめて投入された解析を順に処理する
+    マイクロバッチが有効なら並列に実行して1回のpredictにまとめる
+    """
+    keys = dict(
+        TransAnalysis.objects.filter(pk__in=analysis_ids).values_list('analysis_id', 'image__image')
+    )
+    jobs = [(aid, keys[aid]) for aid in analysis_ids if aid in keys]
+    batcher = get_micro_batcher()
+    if batcher is not None and len(jobs) > 1:
+        # 1回のpredictにまとまる件数より多くスレッドを作っても速くならない
+        with ThreadPoolExecutor(max_workers=min(len(jobs), batcher.max_batch_size)) as pool:
+            list(pool.map(lambda job: _analyze_in_thread(job[0], job[1], model_name, use_category), jobs))
+    else:
+        for aid, key in jobs:
+            analyze_image(aid, key, model_name, use_category)
+
+
+def _analyze_in_thread(analysis_id, image_ref, model_name, use_category):
+    """スレッドプールから呼ぶ analyze_image（スレッドごとに開いたDB接続を閉じる）"""
+    try:
+        analyze_image(analysis_id, image_ref, model_name, use_category)
     finally:
-        analysis.ended_at = timezone.now()
-        analysis.save()
-        import gc
-        gc.collect()
+        connection.close()
+
 
-@shared_task
-def save_image_and_analyze_task(temp_path, user_id, model_name, use_category):
-    s3_storage = S3Boto3Storage()
-    s3_client = boto3.client("s3", region_name=settings.AWS_S3_REGION_NAME)
+def analyze_image(analysis_id, image_ref, model_name, use_category=True, image_bytes=None):
+    """
+    解析本体。image_bytesが渡されればダウンロードせずにそのまま使う
+    工程ごとの所要時間を stage_timings に記録する（結果の書き込み自体の時間は含まない）
+    """
+    start = time.perf_counter()
+    timer = timing.StageTimer()
+    with timing.activate(timer):
+        # 開始時は状態・開始日時だけを条件付きで更新（完了済みの行は処理しない）
+        with timing.stage(timing.DB):
+            started = persistence.mark_started(analysis_id, use_category)
+        if not started:
+            logger.warning("TransAnalysis %s is missing or already finished", analysis_id)
+            metrics.observe_task(resolve_model_name(model_name), metrics.OUTCOME_SKIPPED, time.perf_counter() - start)
+            return
 
-    base, ext = os.path.splitext(os.path.basename(temp_path))
-    safe = slugify(base)[:40] or "image"
-    unique = uuid.uuid4().hex[:6]
-    filename = f"{safe}-{unique}{ext.lower()}"
-    with open(temp_path, "rb") as f:
-        key = s3_storage.save(f"uploads/{filename}", ImageFile(f))
+        try:
+            result = run_analysis(analysis_id, image_ref, model_name, use_category, image_bytes)
+        except Exception as e:
+            result = {
+                "status": "失敗",
+                "error_name": type(e).__name__[:20],
+                "error_log": traceback.format_exc(),
+            }
 
-    os.remove(temp_path) # S3に保存後、一時ファイルを削除
+    # 結果は変更した列だけを書き込む（設定によりまとめて書き込み）
+    result["ended_at"] = timezone.now()
+    result["stage_timings"] = timer.as_dict()
+    persistence.get_writer().write(analysis_id, result)
+    outcome = metrics.OUTCOME_SUCCESS if result["status"] == "成功" else metrics.OUTCOME_FAILURE
+    metrics.observe_task(resolve_model_name(model_name), outcome, time.perf_counter() - start)
+    import gc
+    gc.collect()
+
+
+def _cached_result(image_hash, cache_key):
+    """同じ画像・モデル・設定の解析結果があれば書き込む列の辞書を返す"""
+    with timing.stage(timing.CACHE):
+        cached = result_cache.lookup(image_hash, *cache_key)
+    if cached is None:
+        return None
+    return {
+        "status": "成功",
+        "top_preds": cached.top_preds,
+        "label": cached.label,
+        "reliability": cached.reliability,
+    }
+
+
+def run_analysis(analysis_id, image_ref, model_name, use_category=True, image_bytes=None):
+    """推論して TransAnalysis に書き込む列の辞書を返す"""
+    with timing.stage(timing.DB):
+        image_id, image_hash = (
+            TransAnalysis.objects
+            .filter(pk=analysis_id)
+            .values_list('image_id', 'image__content_hash')
+            .get()
+        )
+
+    # 同じ画像・モデル・設定の解析結果があれば推論しない
+    cache_key = (resolve_model_name(model_name), use_category, result_cache_version(model_name))
+    cached = _cached_result(image_hash, cache_key)
+    if cached is not None:
+        return cached
+
+    # 画像読み込み（再解析時は保存済みの224x224配列を使い、元画像をダウンロードしない）
+    # 画像が渡されている場合は初回の解析なので、キャッシュは探さずにそのままデコードする
+    pixels = None
+    if image_bytes is None:
+        with timing.stage(timing.DOWNLOAD):
+            pixels = tensor_cache.load(image_hash)
+    if pixels is None:
+        if image_bytes is None:
+            with timing.stage(timing.DOWNLOAD):
+                image_bytes = fetch_image_bytes(image_ref)
+        if not image_hash:
+            # ハッシュ未登録の画像（ブラウザから直接S3へアップロードした画像など）は補完し、
+            # 同じ画像の解析結果があればデコード・推論せずに使う
+            with timing.stage(timing.DECODE):
+                image_hash = result_cache.content_hash(image_bytes)
+            with timing.stage(timing.DB):
+                MstImages.objects.filter(pk=image_id).update(content_hash=image_hash)
+            cached = _cached_result(image_hash, cache_key)
+            if cached is not None:
+                return cached
+        # 224px付近まで縮小デコード（uint8のままpreprocess直前まで扱う）
+        with timing.stage(timing.DECODE):
+            pixels = decode_image(image_bytes)
+        with timing.stage(timing.CACHE):
+            tensor_cache.save(image_hash, pixels)
+    x = np.expand_dims(pixels, axis=0)
+
+    # 推論（EfficientNet系はHuman専用モデルと同時に推論）
+    with timing.stage(timing.PREDICT):
+        preds, human_preds = predict_with_human(model_name, x)
+    with timing.stage(timing.SCORING):
+        decoded, best_label, best_score, category_ranking = summarize_predictions(model_name, preds, use_category, top=30)
+
+    # decodeにカテゴリ集計結果を追加
+    for rank, (cat, score) in enumerate(category_ranking, 1):
+        decoded.append((
+            None,
+            f"{rank} {cat}",
+            float(score)
+        ))
+
+    # Humanカテゴリなら専用推論
+    if best_label == "Human (category)":
+        if human_preds is None:
+            with timing.stage(timing.PREDICT):
+                human_preds = predict(HUMAN_MODEL, x)
+        with timing.stage(timing.SCORING):
+            _, _, human_score, _ = summarize_predictions(HUMAN_MODEL, human_preds, use_category=True, top=10)
+        # Human専用推論結果を追加（ラベル名を明示的に変更）
+        decoded.append((
+            None,
+            "Human (specialized)",
+            float(human_score)
+        ))
+
+        # best_score更新（高い方を採用）
+        if human_score > best_score:
+            best_score = human_score
+
+    # 最終best_label / best_scoreを登録（Human専用推論も含めてまとめて1回）
+    result = {
+        "status": "成功",
+        "top_preds": [
+            {'label': lbl, 'prob': float(prob)}
+            for (_id, lbl, prob) in decoded
+        ],
+        "label": best_label,
+        "reliability": best_score * 100,
+    }
+    with timing.stage(timing.CACHE):
+        result_cache.store(image_hash, *cache_key, result["top_preds"], result["label"], result["reliability"])
+    return result
+
+
+@shared_task(name=SAVE_IMAGE_AND_ANALYZE_TASK)
+def save_image_and_analyze_task(image_key, user_id, model_name, use_category, content_hash=None, temp_path=None):
+    """
+    Webが S3 に保存した画像のレコードを作成し、解析を投入する（ingestキュー）
+    content_hash はWebがアップロード時に計算したSHA-256（解析結果キャッシュの検索に使う）
+    temp_path が渡された場合（ANALYZER_SINGLE_HOP）は一時ファイルを読んでS3に保存し、
+    メモリ上の画像でこのタスクの中で推論まで行う（キューの往復とダウンロードを省く）
+    """
+    image_bytes = None
+    if temp_path is not None:
+        with open(temp_path, "rb") as f:
+            image_bytes = f.read()
+        content_hash = result_cache.content_hash(image_bytes)
+        image_key = build_upload_key(temp_path)
+        transport.put_object(image_key, image_bytes,
+                             ContentType=mimetypes.guess_type(temp_path)[0] or "application/octet-stream")
+        os.remove(temp_path) # S3に保存後、一時ファイルを削除
+    key = image_key
 
     with transaction.atomic():
-        mst_img = MstImages.objects.create(user_id=user_id, image=key)
+        mst_img = MstImages.objects.create(user_id=user_id, image=key, content_hash=content_hash)
         analysis = TransAnalysis.objects.create(
             image=mst_img,
+            user_id=user_id,
+            uploaded_at=mst_img.uploaded_at,
             model_name=model_name,
-            status="準備中"
+            status="準備中",
+            enqueue_seq=queue_position.allocate()
         )
+        facets.record_created(user_id, model_name)
 
-        signed_url = s3_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={"Bucket": settings.AWS_STORAGE_BUCKET_NAME, "Key": key},
-            ExpiresIn=60 * 60 * 24
-        )
+    if image_bytes is not None:
+        analyze_image(analysis.analysis_id, key, model_name, use_category, image_bytes=image_bytes)
+        return
 
     analyze_image_task.delay(
         analysis.analysis_id,
-        signed_url,
+        key,
         model_name,
         use_category
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,159 @@
+import logging
+import os
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+from django.conf import settings
+
+from . import transport
+
+logger = logging.getLogger(__name__)
+
+S3_PREFIX = "tensors/"
+
+# ローカルキャッシュの合計サイズは書き込みごとに加算して見積もり、
+# 上限を超えたときか一定時間ごと（他のプロセスの書き込みを反映するため）にだけディレクトリを走査する
+RESCAN_SECONDS = 60
+# 上限を超えたら上限のこの割合まで減らす（毎回の書き込みで削除が走らないように）
+EVICT_TO_RATIO = 0.9
+
+_lock = threading.Lock()
+_counters = {"local_hits": 0, "s3_hits": 0, "misses": 0, "stores": 0, "evicted": 0, "scans": 0}
+_usage = {"bytes": None, "scanned_at": 0.0}
+
+
+def _conf():
+    return getattr(settings, "ANALYZER_TENSOR_CACHE", {}) or {}
+
+
+def enabled():
+    return bool(_conf().get("enabled"))
+
+
+def _count(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+
+def s3_key(hash_value):
+    return f"{S3_PREFIX}{hash_value}.npy"
+
+
+def _local_path(hash_value):
+    return os.path.join(_conf().get("dir", "tensor_cache"), f"{hash_value}.npy")
+
+
+def to_bytes(x):
+    buf = BytesIO()
+    np.save(buf, np.asarray(x, dtype=np.uint8), allow_pickle=False)
+    return buf.getvalue()
+
+
+def from_bytes(data):
+    return np.load(BytesIO(data), allow_pickle=False)
+
+
+def load(hash_value):
+    """前処理前の(224, 224, 3) uint8配列を返す。ローカル → S3 の順に探し、無ければNone"""
+    if not enabled() or not hash_value:
+        return None
+
+    path = _local_path(hash_value)
+    try:
+        x = np.load(path, allow_pickle=False)
+        os.utime(path)  # LRU用に最終利用日時を更新
+        _count("local_hits")
+        return x
+    except (OSError, ValueError):
+        pass
+
+    if _conf().get("s3", True):
+        try:
+            data = transport.get_object(s3_key(hash_value))
+        except Exception as e:
+            if not transport.is_not_found(e):
+                logger.warning("tensor cache download failed: %s", hash_value, exc_info=True)
+            data = None
+        if data is not None:
+            _count("s3_hits")
+            _write_local(path, data)
+            return from_bytes(data)
+
+    _count("misses")
+    return None
+
+
+def save(hash_value, x):
+    """初回の解析時にデコード済み配列をローカルとS3に保存する"""
+    if not enabled() or not hash_value:
+        return
+    data = to_bytes(x)
+    _write_local(_local_path(hash_value), data)
+    if _conf().get("s3", True):
+        try:
+            transport.put_object(s3_key(hash_value), data)
+        except Exception:
+            logger.warning("tensor cache upload failed: %s", hash_value, exc_info=True)
+    _count("stores")
+
+
+def _write_local(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    _evict(directory, len(data))
+
+
+def _evict(directory, added):
+    """ローカルキャッシュが上限を超えていたら最終利用日時の古い順に削除"""
+    max_bytes = _conf().get("max_bytes")
+    if not max_bytes:
+        return
+    with _lock:
+        if _usage["bytes"] is not None:
+            _usage["bytes"] += added
+        due = (
+            _usage["bytes"] is None
+            or _usage["bytes"] > max_bytes
+            or time.monotonic() - _usage["scanned_at"] >= RESCAN_SECONDS
+        )
+        if not due:
+            return
+        _usage["scanned_at"] = time.monotonic()
+    _usage["bytes"] = _scan_and_evict(directory, max_bytes)
+
+
+def _scan_and_evict(directory, max_bytes):
+    """ディレクトリを走査し、上限を超えていれば削除する。削除後の合計サイズを返す"""
+    _count("scans")
+    entries = []
+    total = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.endswith(".npy"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+    if total <= max_bytes:
+        return total
+    target = max_bytes * EVICT_TO_RATIO
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        _count("evicted")
+        if total <= target:
+            break
+    return total
+
+
+def stats():
+    with _lock:
+        return dict(_counters)
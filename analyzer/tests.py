@@ -1,3 +1,674 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from PIL import Image
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import MstUsers
+from .models import MstImages, TransAnalysis, TransFacet
+from . import artifacts, bulk, facets, imaging, pagination, queue_position, signatures, status_api, tensor_cache, transport
+from .batching import MicroBatcher
+from .category_map import CATEGORY_MAP
+from .persistence import ResultWriter
+from .registry import ModelRegistry
+from .scoring import CategoryScorer, LabelIndex, top_k_indices
+
+
+def create_user(email="user@example.com"):
+    return MstUsers.objects.create_user(email=email, password="password", is_active=True)
+
+
+def jpeg_bytes(size=(8, 8), **save_options):
+    buffer = BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buffer, "JPEG", **save_options)
+    return buffer.getvalue()
+
+
+def create_analysis(user, uploaded_at=None, **fields):
+    image = MstImages.objects.create(user=user, image="uploads/test.jpg")
+    if uploaded_at is not None:
+        MstImages.objects.filter(pk=image.pk).update(uploaded_at=uploaded_at)
+    else:
+        uploaded_at = image.uploaded_at
+    return TransAnalysis.objects.create(image=image, user=user, uploaded_at=uploaded_at,
+                                        model_name="efficientnet_b0", **fields)
+
+
+class UploadViewTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.client.force_login(self.user)
+
+    def test_upload_page_renders(self):
+        response = self.client.get(reverse("analyzer:upload"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "direct_upload.js", count=1)
+
+    def test_confirm_rejects_unknown_model(self):
+        response = self.client.post(
+            reverse("analyzer:upload_confirm"),
+            data=json.dumps({"keys": ["uploads/x.jpg"], "model": "no_such_model"}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TransAnalysis.objects.exists())
+
+    def test_upload_streams_to_s3_and_sends_hash(self):
+        data = jpeg_bytes()
+        uploaded = {}
+
+        def upload_fileobj(key, fileobj, bucket=None, content_type=None):
+            uploaded[key] = b"".join(iter(lambda: fileobj.read(3), b""))
+
+        with mock.patch.object(transport, "upload_fileobj", side_effect=upload_fileobj), \
+                mock.patch.object(signatures.app, "send_task") as send_task:
+            self.client.post(reverse("analyzer:upload"), {
+                "images": SimpleUploadedFile("a.jpg", data, content_type="image/jpeg"),
+                "model": "efficientnet_b0",
+            })
+
+        [(key, body)] = uploaded.items()
+        self.assertEqual(body, data)
+        kwargs = send_task.call_args.kwargs["kwargs"]
+        self.assertEqual(kwargs["image_key"], key)
+        self.assertEqual(kwargs["content_hash"], hashlib.sha256(data).hexdigest())
+
+    @override_settings(ANALYZER_SINGLE_HOP=True)
+    def test_single_hop_passes_local_file_to_worker(self):
+        data = jpeg_bytes()
+        with mock.patch.object(transport, "upload_fileobj") as upload_fileobj, \
+                mock.patch.object(signatures.app, "send_task") as send_task:
+            self.client.post(reverse("analyzer:upload"), {
+                "images": SimpleUploadedFile("a.jpg", data, content_type="image/jpeg"),
+                "model": "efficientnet_b0",
+            })
+
+        upload_fileobj.assert_not_called()
+        temp_path = send_task.call_args.kwargs["kwargs"]["temp_path"]
+        self.addCleanup(os.remove, temp_path)
+        with open(temp_path, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+
+class BulkIngestTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        put_object = mock.patch.object(transport, "put_object")
+        delete_objects = mock.patch.object(transport, "delete_objects")
+        send_task = mock.patch.object(signatures.app, "send_task")
+        self.put_object = put_object.start()
+        self.delete_objects = delete_objects.start()
+        self.send_task = send_task.start()
+        self.addCleanup(mock.patch.stopall)
+
+    def members(self, n):
+        return [(f"img{i}.jpg", BytesIO(b"image%d" % i)) for i in range(n)]
+
+    def test_creates_records_and_enqueues_in_groups(self):
+        batch = bulk.ingest(self.user, "efficientnet_b0", True, self.members(12), max_files=20)
+
+        self.assertEqual(batch.total, 12)
+        images = MstImages.objects.filter(user=self.user)
+        self.assertEqual(
+            sorted(images.values_list("content_hash", flat=True)),
+            sorted(hashlib.sha256(b"image%d" % i).hexdigest() for i in range(12)),
+        )
+        self.assertEqual(TransAnalysis.objects.filter(batch=batch, status="準備中").count(), 12)
+        groups = [c.kwargs["kwargs"]["analysis_ids"] for c in self.send_task.call_args_list]
+        self.assertEqual([len(g) for g in groups], [10, 2])
+        self.delete_objects.assert_not_called()
+
+    def test_stops_at_max_files(self):
+        batch = bulk.ingest(self.user, "efficientnet_b0", True, self.members(5), max_files=3)
+        self.assertEqual(batch.total, 3)
+        self.assertEqual(self.put_object.call_count, 3)
+
+    def test_deletes_uploaded_objects_when_members_fail(self):
+        def members():
+            yield from self.members(2)
+            raise bulk.BulkUploadError("The archive is not a valid zip file.")
+
+        with self.assertRaises(bulk.BulkUploadError):
+            bulk.ingest(self.user, "efficientnet_b0", True, members(), max_files=20)
+
+        uploaded = {c.args[0] for c in self.put_object.call_args_list}
+        self.assertEqual(len(uploaded), 2)
+        self.assertEqual(set(self.delete_objects.call_args.args[0]), uploaded)
+        self.assertFalse(MstImages.objects.exists())
+        self.send_task.assert_not_called()
+
+    def test_deletes_uploaded_objects_when_records_fail(self):
+        with mock.patch.object(bulk, "_create_records", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                bulk.ingest(self.user, "efficientnet_b0", True, self.members(3), max_files=20)
+
+        self.assertEqual(len(self.delete_objects.call_args.args[0]), 3)
+        self.send_task.assert_not_called()
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        user = create_user()
+        base = timezone.now()
+        # 2件ずつ同じアップロード日時（analysis_idで順番が決まる）
+        self.analyses = [create_analysis(user, base + timedelta(minutes=i // 2)) for i in range(7)]
+
+    def paginate(self, cursor=None, descending=True):
+        queryset = TransAnalysis.objects.select_related("image")
+        return pagination.paginate(queryset, cursor=cursor, descending=descending, page_size=3)
+
+    def ids(self, page):
+        return [a.analysis_id for a in page.items]
+
+    def test_next_pages_cover_all_rows_in_order(self):
+        expected = [a.analysis_id for a in reversed(self.analyses)]
+        page = self.paginate()
+        seen = self.ids(page)
+        self.assertIsNone(page.prev_cursor)
+        while page.next_cursor:
+            page = self.paginate(page.next_cursor)
+            seen += self.ids(page)
+        self.assertEqual(seen, expected)
+
+    def test_prev_returns_to_the_previous_page(self):
+        first = self.paginate()
+        second = self.paginate(first.next_cursor)
+        third = self.paginate(second.next_cursor)
+        self.assertEqual(self.ids(self.paginate(third.prev_cursor)), self.ids(second))
+        back = self.paginate(second.prev_cursor)
+        self.assertEqual(self.ids(back), self.ids(first))
+        self.assertIsNone(back.prev_cursor)
+
+    def test_ascending(self):
+        page = self.paginate(descending=False)
+        page = self.paginate(page.next_cursor, descending=False)
+        self.assertEqual(self.ids(page), [a.analysis_id for a in self.analyses[3:6]])
+
+    def test_invalid_cursor_starts_from_the_first_page(self):
+        self.assertEqual(self.ids(self.paginate("not-a-cursor")), self.ids(self.paginate()))
+
+
+class FacetTests(TestCase):
+    def test_diff(self):
+        deltas = facets.diff(7, {"status": "解析中"}, {"status": "成功", "label": "cat"})
+        self.assertEqual(deltas, Counter({
+            (facets.STATUS, facets.ALL_USERS, "解析中"): -1,
+            (facets.STATUS, facets.ALL_USERS, "成功"): 1,
+            (facets.LABEL, 7, "cat"): 1,
+        }))
+
+    def test_diff_ignores_unchanged_and_missing_fields(self):
+        self.assertEqual(facets.diff(7, {"status": "成功", "label": "cat"}, {"status": "成功"}), Counter())
+
+    def test_diff_on_delete(self):
+        deltas = facets.diff(7, {"status": "失敗", "error_name": "ValueError"}, None)
+        self.assertEqual(deltas[(facets.STATUS, facets.ALL_USERS, "失敗")], -1)
+        self.assertEqual(deltas[(facets.ERROR, facets.ALL_USERS, "ValueError")], -1)
+
+    def test_apply(self):
+        facets.apply(Counter({(facets.LABEL, 7, "cat"): 2, (facets.LABEL, 7, "dog"): 1}))
+        facets.apply(Counter({(facets.LABEL, 7, "cat"): -1, (facets.LABEL, 7, "dog"): -1}))
+        self.assertEqual(facets.counts(facets.LABEL, 7), {"cat": 1})
+        self.assertEqual(facets.values(facets.LABEL, 7), ["cat"])
+        self.assertEqual(TransFacet.objects.get(kind=facets.LABEL, user_id=7, value="dog").count, 0)
+
+
+class AnalysisStatusTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.client.force_login(self.user)
+        self.analysis = create_analysis(self.user, status="成功", label="cat")
+        self.url = reverse("analyzer:analysis_status")
+
+    def test_etag_and_not_modified(self):
+        response = self.client.get(self.url, {"ids": str(self.analysis.pk)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["analyses"][0]["label"], "cat")
+        etag = response["ETag"]
+
+        response = self.client.get(self.url, {"ids": str(self.analysis.pk)}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        TransAnalysis.objects.filter(pk=self.analysis.pk).update(
+            label="dog", updated_at=timezone.now() + timedelta(seconds=1))
+        response = self.client.get(self.url, {"ids": str(self.analysis.pk)}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_since_holds_back_rows_inside_the_safety_window(self):
+        old = create_analysis(self.user, status="成功")
+        TransAnalysis.objects.filter(pk=old.pk).update(
+            updated_at=timezone.now() - status_api.SAFETY_WINDOW - timedelta(seconds=1))
+        body = self.client.get(self.url).json()
+        self.assertEqual([row["analysis_id"] for row in body["analyses"]], [old.pk])
+
+        body = self.client.get(self.url, {"since": body["cursor"]}).json()
+        self.assertEqual(body["analyses"], [])
+
+    def test_other_users_rows_are_hidden(self):
+        other = create_analysis(create_user("other@example.com"))
+        response = self.client.get(self.url, {"ids": str(other.pk)})
+        self.assertEqual(response.json()["analyses"], [])
+
+
+class ResultWriterTests(TestCase):
+    def setUp(self):
+        self.analyses = [create_analysis(create_user(f"user{i}@example.com"), status="解析中") for i in range(2)]
+
+    def test_immediate_write(self):
+        before = TransAnalysis.objects.get(pk=self.analyses[0].pk).updated_at
+        ResultWriter().write(self.analyses[0].pk, {"status": "成功", "label": "cat"})
+        analysis = TransAnalysis.objects.get(pk=self.analyses[0].pk)
+        self.assertEqual((analysis.status, analysis.label), ("成功", "cat"))
+        self.assertGreater(analysis.updated_at, before)
+        self.assertEqual(facets.counts(facets.STATUS).get("成功"), 1)
+
+    def test_batched_flush(self):
+        writer = ResultWriter(max_rows=10, max_delay=60)
+        for analysis in self.analyses:
+            writer.write(analysis.pk, {"status": "成功", "label": "cat"})
+        self.assertFalse(TransAnalysis.objects.filter(status="成功").exists())
+
+        writer.flush()
+        self.assertEqual(TransAnalysis.objects.filter(status="成功", label="cat").count(), 2)
+        stats = writer.stats()
+        self.assertEqual((stats["rows"], stats["flushes"], stats["pending"]), (2, 1, 0))
+
+    def test_failed_flush_keeps_rows_for_the_next_flush(self):
+        writer = ResultWriter(max_rows=10, max_delay=60)
+        writer.write(self.analyses[0].pk, {"status": "成功", "label": "cat"})
+        with mock.patch("analyzer.persistence.facets.record_results", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError), self.assertLogs("analyzer.persistence", level="ERROR"):
+                writer.flush()
+        self.assertEqual(TransAnalysis.objects.get(pk=self.analyses[0].pk).status, "解析中")
+        self.assertEqual(writer.stats()["pending"], 1)
+
+        # 失敗後に届いた同じ行の書き込みが優先される
+        writer.write(self.analyses[0].pk, {"label": "dog"})
+        writer.flush()
+        analysis = TransAnalysis.objects.get(pk=self.analyses[0].pk)
+        self.assertEqual((analysis.status, analysis.label), ("成功", "dog"))
+        self.assertEqual(writer.stats()["pending"], 0)
+
+    def test_does_not_overwrite_rows_reset_for_reanalysis(self):
+        writer = ResultWriter(max_rows=10, max_delay=60)
+        for analysis in self.analyses:
+            writer.write(analysis.pk, {"status": "成功", "label": "cat"})
+        # 書き込み前に再解析で準備中へ戻された
+        TransAnalysis.objects.filter(pk=self.analyses[1].pk).update(status="準備中")
+
+        writer.flush()
+        self.assertEqual(TransAnalysis.objects.get(pk=self.analyses[0].pk).status, "成功")
+        analysis = TransAnalysis.objects.get(pk=self.analyses[1].pk)
+        self.assertEqual((analysis.status, analysis.label), ("準備中", None))
+        self.assertEqual(facets.counts(facets.STATUS).get("成功"), 1)
+        stats = writer.stats()
+        self.assertEqual((stats["rows"], stats["skipped"]), (1, 1))
+
+    def test_immediate_write_skips_rows_no_longer_running(self):
+        TransAnalysis.objects.filter(pk=self.analyses[0].pk).update(status="準備中")
+        ResultWriter().write(self.analyses[0].pk, {"status": "失敗", "error_name": "ValueError"})
+        self.assertEqual(TransAnalysis.objects.get(pk=self.analyses[0].pk).status, "準備中")
+        self.assertEqual(facets.counts(facets.ERROR), {})
+
+
+
+class ReanalyzeViewTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.client.force_login(self.user)
+        self.analysis = create_analysis(self.user, status="成功", label="cat")
+        self.url = reverse("analyzer:reanalyze", args=[self.analysis.pk])
+
+    def test_rejects_unknown_model(self):
+        with mock.patch.object(signatures.app, "send_task") as send_task:
+            response = self.client.post(self.url, {"model_name": "no_such_model"})
+        self.assertEqual(response.status_code, 400)
+        analysis = TransAnalysis.objects.get(pk=self.analysis.pk)
+        self.assertEqual((analysis.status, analysis.model_name), ("成功", "efficientnet_b0"))
+        send_task.assert_not_called()
+
+    def test_resets_and_enqueues(self):
+        with mock.patch.object(signatures.app, "send_task") as send_task:
+            response = self.client.post(self.url, {"model_name": "resnet50"})
+        self.assertEqual(response.status_code, 302)
+        analysis = TransAnalysis.objects.get(pk=self.analysis.pk)
+        self.assertEqual((analysis.status, analysis.label, analysis.model_name), ("準備中", None, "resnet50"))
+        self.assertEqual(send_task.call_args.kwargs["queue"], signatures.REANALYZE_QUEUE)
+
+
+class DecodeImageTests(SimpleTestCase):
+    def test_large_jpeg_is_decoded_at_reduced_scale(self):
+        data = jpeg_bytes((2000, 1500))
+        resize = Image.Image.resize
+        decoded_sizes = []
+
+        def record(img, *args, **kwargs):
+            decoded_sizes.append(img.size)
+            return resize(img, *args, **kwargs)
+
+        with mock.patch.object(Image.Image, "resize", autospec=True, side_effect=record):
+            pixels = imaging.decode_image(data)
+
+        self.assertEqual((pixels.shape, pixels.dtype), ((224, 224, 3), np.uint8))
+        # 1/4 の縮尺でデコードされ、224px を下回らない
+        self.assertEqual(decoded_sizes, [(500, 375)])
+        self.assertTrue((abs(pixels[112, 112].astype(int) - (200, 30, 30)) < 10).all())
+
+    def test_exif_orientation_is_applied(self):
+        img = Image.new("RGB", (400, 200), (255, 0, 0))
+        img.paste((0, 0, 255), (200, 0, 400, 200))
+        exif = Image.Exif()
+        exif[0x0112] = 6  # 時計回りに90度回転して表示
+        buffer = BytesIO()
+        img.save(buffer, "JPEG", exif=exif)
+
+        pixels = imaging.decode_image(buffer.getvalue())
+        # 左半分（赤）が上、右半分（青）が下になる
+        self.assertGreater(pixels[20, 112, 0], 200)
+        self.assertGreater(pixels[200, 112, 2], 200)
+
+    def test_batch(self):
+        batch = imaging.decode_batch([jpeg_bytes(), BytesIO(jpeg_bytes((300, 300)))])
+        self.assertEqual(batch.shape, (2, 224, 224, 3))
+        self.assertEqual(imaging.decode_batch([]).shape, (0, 224, 224, 3))
+
+
+class ArtifactTests(SimpleTestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        override = override_settings(ANALYZER_MODEL_ARTIFACTS={"cache_dir": cache_dir.name, "bucket": "bucket"})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_missing_stock_weights_name_the_publish_command(self):
+        from botocore.exceptions import ClientError
+
+        client = mock.Mock()
+        client.head_object.side_effect = ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        with mock.patch.object(transport, "s3_client", return_value=client), \
+                self.assertLogs("analyzer.artifacts", level="WARNING"):
+            with self.assertRaisesMessage(artifacts.ArtifactError, "--publish-stock"):
+                artifacts.path("resnet50.h5")
+
+    def test_stock_weights_come_from_the_bundle_by_default(self):
+        self.assertTrue(artifacts.stock_from_bundle())
+        self.assertIn("resnet50.h5", artifacts.default_names())
+
+
+class ModelRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.rss = 0
+        self.loads = []
+        self.registry = ModelRegistry(self.load, rss_budget_mb=1, rss_func=lambda: self.rss)
+
+    def load(self, name):
+        self.loads.append(name)
+        if name == "fused":
+            return ("fused", self.registry.get("backbone"))
+        return name
+
+    def test_loads_once_under_budget(self):
+        self.registry.get("a")
+        self.registry.get("b")
+        self.registry.get("a")
+        self.assertEqual(self.loads, ["a", "b"])
+        self.assertEqual(self.registry.loaded(), ["b", "a"])
+        self.assertEqual(self.registry.stats()["evictions"], 0)
+
+    def test_evicts_least_recently_used_model_over_budget(self):
+        self.registry.get("a")
+        self.registry.get("b")
+        self.registry.get("a")
+        self.rss = 2 * 1024 * 1024
+        self.registry.get("c")
+        # RSSがすぐには下がらなくても、1回のロードで解放するのは1つだけ
+        self.assertEqual(self.registry.loaded(), ["a", "c"])
+        self.registry.get("b")
+        self.assertEqual(self.registry.loaded(), ["c", "b"])
+        self.assertEqual(self.registry.stats()["evictions"], 2)
+
+    def test_keeps_parts_of_the_model_being_loaded(self):
+        self.rss = 2 * 1024 * 1024
+        self.registry.get("fused")
+        self.assertEqual(sorted(self.registry.loaded()), ["backbone", "fused"])
+
+    def test_evicting_a_part_drops_its_dependents(self):
+        self.registry.get("fused")
+        self.registry.get("other")
+        self.registry.evict("backbone")
+        self.assertEqual(self.registry.loaded(), ["other"])
+
+        self.registry.get("fused")
+        self.assertEqual(self.loads, ["fused", "backbone", "other", "fused", "backbone"])
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.calls = []
+
+    def predict(self, model_name, x):
+        self.calls.append((model_name, len(x)))
+        return x[:, :1] * 10
+
+    def rows(self, *values):
+        return np.array([[v, 0] for v in values], dtype=np.float32)
+
+    def test_flushes_when_max_batch_size_is_reached(self):
+        batcher = MicroBatcher(self.predict, window=10, max_batch_size=4)
+        futures = [batcher.submit("m", self.rows(i)) for i in range(4)]
+        # 窓（10秒）を待たずに実行される
+        results = [f.result(timeout=2) for f in futures]
+        self.assertEqual([r.tolist() for r in results], [[[0.0]], [[10.0]], [[20.0]], [[30.0]]])
+        self.assertEqual(self.calls, [("m", 4)])
+        self.assertEqual(batcher.stats()["batch_sizes"], {"m": {4: 1}})
+
+    def test_flushes_a_partial_batch_when_the_window_closes(self):
+        batcher = MicroBatcher(self.predict, window=0.05, max_batch_size=16)
+        start = time.monotonic()
+        futures = [batcher.submit("m", self.rows(1)), batcher.submit("m", self.rows(2, 3))]
+        results = [f.result(timeout=2) for f in futures]
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual([r.tolist() for r in results], [[[10.0]], [[20.0], [30.0]]])
+        self.assertEqual(self.calls, [("m", 3)])
+
+    def test_does_not_split_a_request_across_batches(self):
+        batcher = MicroBatcher(self.predict, window=0.05, max_batch_size=4)
+        futures = [batcher.submit("m", self.rows(1, 2, 3)), batcher.submit("m", self.rows(4, 5, 6))]
+        self.assertEqual(futures[1].result(timeout=2).tolist(), [[40.0], [50.0], [60.0]])
+        self.assertEqual(futures[0].result(timeout=2).tolist(), [[10.0], [20.0], [30.0]])
+        # 合わせると上限を超えるので、1件ずつ別のバッチで実行される
+        self.assertEqual(self.calls, [("m", 3), ("m", 3)])
+
+    def test_models_are_batched_separately_and_errors_reach_every_request(self):
+        def predict(model_name, x):
+            if model_name == "broken":
+                raise RuntimeError("predict failed")
+            return [x[:, :1], x[:, 1:]]
+
+        batcher = MicroBatcher(predict, window=0.01, max_batch_size=2)
+        broken = [batcher.submit("broken", self.rows(i)) for i in range(2)]
+        ok = batcher.submit("ok", self.rows(7))
+        for future in broken:
+            with self.assertRaisesMessage(RuntimeError, "predict failed"):
+                future.result(timeout=2)
+        self.assertEqual([out.tolist() for out in ok.result(timeout=2)], [[[7.0]], [[0.0]]])
+
+
+class CategoryScorerTests(SimpleTestCase):
+    """従来のループ（上位top件のラベルを1件ずつCATEGORY_MAPと照合して足す）と同じ結果になるか"""
+
+    def setUp(self):
+        keywords = sorted({kw for kws in CATEGORY_MAP.values() for kw in kws})
+        rng = np.random.default_rng(0)
+        # カテゴリーのキーワード（大文字混じりも含む）と、どのカテゴリーにも属さないラベル
+        self.labels = [kw.title() if i % 3 == 0 else kw for i, kw in enumerate(keywords[:200])]
+        self.labels += [f"other_{i}" for i in range(100)]
+        logits = rng.normal(size=(4, len(self.labels)))
+        self.preds = np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+        self.ids = list(range(len(self.labels)))
+
+    def legacy_decode(self, row, top):
+        top_indices = row.argsort()[-top:][::-1]
+        return [(i, self.labels[i], float(row[i])) for i in top_indices]
+
+    def legacy_ranking(self, row, top=30):
+        scores = {cat: 0.0 for cat in CATEGORY_MAP}
+        for _, label, score in self.legacy_decode(row, top):
+            label_lower = label.lower()
+            for category, keywords in CATEGORY_MAP.items():
+                if label_lower in keywords:
+                    scores[category] += score
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+    def test_top_k_matches_argsort(self):
+        for k in (1, 5, 30, len(self.labels) + 10):
+            expected = np.argsort(self.preds, axis=-1)[:, ::-1][:, :k]
+            np.testing.assert_array_equal(top_k_indices(self.preds, k), expected)
+
+    def test_decode_matches_legacy(self):
+        index = LabelIndex(lambda: (self.ids, self.labels))
+        for row, decoded in zip(self.preds, index.decode(self.preds, top=5)):
+            self.assertEqual(decoded, self.legacy_decode(row, 5))
+
+    def test_ranking_matches_legacy_loop(self):
+        scorer = CategoryScorer(self.labels)
+        scores = scorer.score(self.preds, top=30)
+        for row, row_scores in zip(self.preds, scores):
+            ranking = scorer.ranking(row_scores)
+            expected = self.legacy_ranking(row)
+            self.assertEqual([c for c, _ in ranking], [c for c, _ in expected])
+            for (_, score), (_, expected_score) in zip(ranking, expected):
+                self.assertAlmostEqual(score, expected_score, places=5)
+
+
+class TensorCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.dir = cache_dir.name
+        self.file_size = len(tensor_cache.to_bytes(self.array(0)))
+        self.configure(s3=False, max_bytes=3 * self.file_size)
+        for patcher in (
+            mock.patch.dict(tensor_cache._counters, {name: 0 for name in tensor_cache._counters}),
+            mock.patch.dict(tensor_cache._usage, {"bytes": None, "scanned_at": 0.0}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def configure(self, **conf):
+        override = override_settings(ANALYZER_TENSOR_CACHE={"enabled": True, "dir": self.dir, **conf})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def array(self, value):
+        return np.full((8, 8, 3), value, dtype=np.uint8)
+
+    def cached(self):
+        return sorted(name[:-4] for name in os.listdir(self.dir) if name.endswith(".npy"))
+
+    def test_round_trip(self):
+        tensor_cache.save("a", self.array(7))
+        np.testing.assert_array_equal(tensor_cache.load("a"), self.array(7))
+        self.assertIsNone(tensor_cache.load("b"))
+        stats = tensor_cache.stats()
+        self.assertEqual((stats["stores"], stats["local_hits"], stats["misses"]), (1, 1, 1))
+
+    def test_falls_back_to_s3_and_keeps_a_local_copy(self):
+        self.configure(s3=True, max_bytes=None)
+        from botocore.exceptions import ClientError
+
+        def get_object(key):
+            if key == tensor_cache.s3_key("a"):
+                return tensor_cache.to_bytes(self.array(3))
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+
+        with mock.patch.object(transport, "get_object", side_effect=get_object):
+            np.testing.assert_array_equal(tensor_cache.load("a"), self.array(3))
+            with self.assertNoLogs("analyzer.tensor_cache", level="WARNING"):
+                self.assertIsNone(tensor_cache.load("b"))
+        self.assertEqual(self.cached(), ["a"])
+        self.assertEqual(tensor_cache.stats()["s3_hits"], 1)
+
+    def test_evicts_least_recently_used_files_over_the_limit(self):
+        for i, name in enumerate("abc"):
+            tensor_cache.save(name, self.array(i))
+            os.utime(os.path.join(self.dir, f"{name}.npy"), (1000 + i, 1000 + i))
+        tensor_cache.load("a")  # 最終利用日時が新しくなる
+
+        tensor_cache.save("d", self.array(9))
+        # 上限の9割まで減らすので、古い順に2つ消える
+        self.assertEqual(self.cached(), ["a", "d"])
+        self.assertEqual(tensor_cache.stats()["evicted"], 2)
+
+    def test_scans_only_when_over_the_limit_or_due(self):
+        tensor_cache.save("a", self.array(0))
+        tensor_cache.save("b", self.array(1))
+        tensor_cache.save("c", self.array(2))
+        # 最初の1回だけ走査し、その後は書き込んだサイズを足して見積もる
+        self.assertEqual(tensor_cache.stats()["scans"], 1)
+        tensor_cache.save("d", self.array(3))
+        self.assertEqual(tensor_cache.stats()["scans"], 2)
+
+
+class QueuePositionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+
+    def enqueue(self, queue=queue_position.DEFAULT_QUEUE):
+        facets.record_created(self.user.pk, "efficientnet_b0")
+        return create_analysis(self.user, enqueue_seq=queue_position.allocate(queue=queue), enqueue_queue=queue)
+
+    def test_allocate_numbers_each_queue_separately(self):
+        self.assertEqual(queue_position.allocate(), 1)
+        self.assertEqual(queue_position.allocate(3), 2)
+        self.assertEqual(queue_position.allocate(), 5)
+        self.assertEqual(queue_position.allocate(queue="reanalyze"), 1)
+
+    def test_dequeued_only_moves_forward(self):
+        first, second = self.enqueue(), self.enqueue()
+        queue_position.mark_dequeued(second.pk)
+        queue_position.mark_dequeued(first.pk)
+        self.assertEqual(queue_position.watermark(), 2)
+
+        # 初めて解析を開始したキューはカウンタが作られる
+        reanalysis = self.enqueue("reanalyze")
+        queue_position.mark_dequeued(reanalysis.pk)
+        self.assertEqual(queue_position.watermarks(["inference", "reanalyze"]), {"inference": 2, "reanalyze": 1})
+
+    def test_annotate_counts_from_each_queues_watermark(self):
+        analyses = [self.enqueue() for _ in range(3)]
+        reanalysis = self.enqueue("reanalyze")
+        done = create_analysis(self.user, status="成功", enqueue_seq=1)
+        queue_position.mark_dequeued(analyses[0].pk)
+        TransAnalysis.objects.filter(pk=analyses[0].pk).update(status="解析中")
+
+        rows = queue_position.annotate(TransAnalysis.objects.order_by("analysis_id"))
+        numbers = {row.pk: row.waiting_number for row in rows}
+        self.assertEqual(numbers[analyses[0].pk], None)
+        self.assertEqual([numbers[a.pk] for a in analyses[1:]], [1, 2])
+        self.assertEqual(numbers[reanalysis.pk], 1)
+        self.assertIsNone(numbers[done.pk])
+
+    def test_annotate_caps_at_the_pending_count(self):
+        analyses = [self.enqueue() for _ in range(3)]
+        # 準備中のまま削除された行などで投入番号が飛んでも、全体の待ち件数を超えない
+        facets.apply(Counter({(facets.STATUS, facets.ALL_USERS, "準備中"): -2}))
+        rows = queue_position.annotate(TransAnalysis.objects.filter(pk=analyses[-1].pk))
+        self.assertEqual(rows[0].waiting_number, 1)
@@ -0,0 +1,105 @@
+# 解析1件の工程ごとの所要時間（TransAnalysis.stage_timings にミリ秒で保存する）
+import threading
+import time
+from contextlib import contextmanager
+
+DOWNLOAD = "download"      # 元画像・デコード済み配列の取得
+DECODE = "decode"          # 縮小デコード・ハッシュ計算
+MODEL_LOAD = "model_load"  # モデルのロード（レジストリに無かった場合）
+PREDICT = "predict"        # 推論（マイクロバッチの待ち時間を含む）
+SCORING = "scoring"        # ラベルのデコード・カテゴリ集計
+CACHE = "cache"            # 解析結果・デコード済み配列のキャッシュの読み書き
+DB = "db"                  # 開始時の更新・画像情報の取得
+TOTAL = "total"            # 開始から結果の書き込み直前まで
+
+STAGES = (DOWNLOAD, DECODE, MODEL_LOAD, PREDICT, SCORING, CACHE, DB, TOTAL)
+
+_local = threading.local()
+
+
+class StageTimer:
+    """
+    工程ごとの経過時間を積算する
+    工程の中で別の工程が始まったら（推論中のモデルのロードなど）、内側の時間は外側に含めない
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = {}
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self._add(self._stack[-1][0], now - self._stack[-1][1])
+        self._stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            stage_name, since = self._stack.pop()
+            self._add(stage_name, now - since)
+            if self._stack:
+                self._stack[-1][1] = now
+
+    def _add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def as_dict(self):
+        """{工程: ミリ秒}（小数1桁）。totalは開始からの経過時間"""
+        timings = {name: round(s * 1000, 1) for name, s in self.seconds.items()}
+        timings[TOTAL] = round((time.perf_counter() - self.started) * 1000, 1)
+        return timings
+
+
+@contextmanager
+def activate(timer):
+    """このスレッドで stage() が記録するタイマーを設定"""
+    previous = getattr(_local, "timer", None)
+    _local.timer = timer
+    try:
+        yield timer
+    finally:
+        _local.timer = previous
+
+
+@contextmanager
+def stage(name):
+    """現在のタイマーに工程の時間を記録（タイマーが無いスレッドでは何もしない）"""
+    timer = getattr(_local, "timer", None)
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def percentile(sorted_values, q):
+    """最近傍順位法のパーセンタイル（sorted_valuesは昇順）"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(rows, quantiles=(50, 95, 99)):
+    """
+    rows: [(model_name, stage_timings)] から モデル → 工程 → {count, p50, p95, p99} を作る
+    """
+    values = {}
+    for model_name, timings in rows:
+        for name, ms in (timings or {}).items():
+            if isinstance(ms, (int, float)):
+                values.setdefault(model_name, {}).setdefault(name, []).append(ms)
+
+    summary = {}
+    for model_name, stages in sorted(values.items()):
+        summary[model_name] = {}
+        for name in sorted(stages, key=lambda n: STAGES.index(n) if n in STAGES else len(STAGES)):
+            ordered = sorted(stages[name])
+            entry = {"count": len(ordered)}
+            for q in quantiles:
+                entry[f"p{q}"] = percentile(ordered, q)
+            summary[model_name][name] = entry
+    return summary
@@ -0,0 +1,216 @@
+# ワーカー共通のS3/HTTPクライアント
+# プロセスごとに1つのクライアント（コネクションプール）を使い回し、呼び出しごとの転送量と所要時間を記録する
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_clients = {}
+_local = threading.local()
+_stats = {}
+
+
+def _conf():
+    conf = {
+        "max_pool_connections": 20,
+        "connect_timeout": 5,
+        "read_timeout": 60,
+        "max_attempts": 5,
+    }
+    conf.update(getattr(settings, "ANALYZER_TRANSPORT", {}) or {})
+    return conf
+
+
+def _per_process(name, factory):
+    """fork後の子プロセスでは親のコネクションを使わないようPIDごとに作る"""
+    key = (name, os.getpid())
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = factory()
+                _clients[key] = client
+    return client
+
+
+def s3_client():
+    def factory():
+        import boto3
+        from botocore.config import Config
+
+        conf = _conf()
+        return boto3.session.Session().client(
+            "s3",
+            region_name=settings.AWS_S3_REGION_NAME,
+            config=Config(
+                max_pool_connections=conf["max_pool_connections"],
+                connect_timeout=conf["connect_timeout"],
+                read_timeout=conf["read_timeout"],
+                retries={"max_attempts": conf["max_attempts"], "mode": "standard"},
+                tcp_keepalive=True,
+            ),
+        )
+    return _per_process("s3", factory)
+
+
+def sqs_client():
+    """キューの深さの取得用（ブローカーと同じリージョン）"""
+    def factory():
+        import boto3
+        from botocore.config import Config
+
+        conf = _conf()
+        return boto3.session.Session().client(
+            "sqs",
+            region_name=settings.CELERY_BROKER_TRANSPORT_OPTIONS.get("region"),
+            config=Config(
+                connect_timeout=conf["connect_timeout"],
+                read_timeout=conf["read_timeout"],
+                retries={"max_attempts": conf["max_attempts"], "mode": "standard"},
+            ),
+        )
+    return _per_process("sqs", factory)
+
+
+def http_session():
+    def factory():
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        conf = _conf()
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=conf["max_pool_connections"],
+            pool_maxsize=conf["max_pool_connections"],
+            max_retries=Retry(total=conf["max_attempts"], backoff_factor=0.2,
+                              status_forcelist=(500, 502, 503, 504)),
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    return _per_process("http", factory)
+
+
+def storage():
+    """django-storagesのS3ストレージ（プロセス内で使い回す）"""
+    def factory():
+        from storages.backends.s3boto3 import S3Boto3Storage
+        return S3Boto3Storage()
+    return _per_process("storage", factory)
+
+
+def _record(op, nbytes, seconds):
+    with _lock:
+        entry = _stats.setdefault(op, {"calls": 0, "bytes": 0, "seconds": 0.0, "max_seconds": 0.0})
+        entry["calls"] += 1
+        entry["bytes"] += nbytes
+        entry["seconds"] += seconds
+        entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+
+def _buffer(size):
+    """スレッドごとに再利用する受信バッファ"""
+    buf = getattr(_local, "buffer", None)
+    if buf is None or len(buf) < size:
+        buf = bytearray(max(size, 1024 * 1024))
+        _local.buffer = buf
+    return buf
+
+
+def get_object_view(key, bucket=None):
+    """
+    S3オブジェクトを再利用バッファへストリーミングで読み込み、memoryviewで返す
+    返り値は同じスレッドで次に呼ぶまでの間だけ有効
+    """
+    start = time.perf_counter()
+    response = s3_client().get_object(Bucket=bucket or settings.AWS_STORAGE_BUCKET_NAME, Key=key)
+    size = response["ContentLength"]
+    buf = _buffer(size)
+    view = memoryview(buf)
+    body = response["Body"]
+    n = 0
+    try:
+        while n < size:
+            chunk = body.read(min(size - n, 1024 * 1024))
+            if not chunk:
+                break
+            view[n:n + len(chunk)] = chunk
+            n += len(chunk)
+    finally:
+        body.close()
+    _record("s3_get", n, time.perf_counter() - start)
+    return view[:n]
+
+
+def is_not_found(exc):
+    """S3のキーが存在しないことによる例外か（NoSuchKey / 404）"""
+    from botocore.exceptions import ClientError
+
+    if not isinstance(exc, ClientError):
+        return False
+    return exc.response.get("Error", {}).get("Code") in ("NoSuchKey", "NotFound", "404")
+
+
+def get_object(key, bucket=None):
+    return bytes(get_object_view(key, bucket))
+
+
+def put_object(key, body, bucket=None, **kwargs):
+    start = time.perf_counter()
+    s3_client().put_object(Bucket=bucket or settings.AWS_STORAGE_BUCKET_NAME, Key=key, Body=body, **kwargs)
+    _record("s3_put", len(body), time.perf_counter() - start)
+
+
+def delete_objects(keys, bucket=None):
+    """複数のキーを削除（1回のリクエストは1000件まで）"""
+    keys = list(keys)
+    start = time.perf_counter()
+    for i in range(0, len(keys), 1000):
+        s3_client().delete_objects(
+            Bucket=bucket or settings.AWS_STORAGE_BUCKET_NAME,
+            Delete={"Objects": [{"Key": key} for key in keys[i:i + 1000]], "Quiet": True},
+        )
+    _record("s3_delete", 0, time.perf_counter() - start)
+
+
+def upload_fileobj(key, fileobj, bucket=None, content_type=None):
+    """ファイルオブジェクトをメモリに溜めずにストリーミングでアップロード"""
+    start = time.perf_counter()
+    extra = {"ContentType": content_type} if content_type else None
+    s3_client().upload_fileobj(fileobj, bucket or settings.AWS_STORAGE_BUCKET_NAME, key, ExtraArgs=extra)
+    _record("s3_upload", getattr(fileobj, "size", 0) or 0, time.perf_counter() - start)
+
+
+def save_file(name, content):
+    """ストレージへ保存し、実際に保存されたキーを返す（同名があれば別名になる）"""
+    start = time.perf_counter()
+    key = storage().save(name, content)
+    _record("s3_save", getattr(content, "size", 0) or 0, time.perf_counter() - start)
+    return key
+
+
+def download_file(key, path, bucket=None):
+    start = time.perf_counter()
+    s3_client().download_file(bucket or settings.AWS_STORAGE_BUCKET_NAME, key, path)
+    _record("s3_download", os.path.getsize(path), time.perf_counter() - start)
+
+
+def http_get(url):
+    start = time.perf_counter()
+    response = http_session().get(url, timeout=(_conf()["connect_timeout"], _conf()["read_timeout"]))
+    response.raise_for_status()
+    _record("http_get", len(response.content), time.perf_counter() - start)
+    return response.content
+
+
+def stats():
+    """操作ごとの呼び出し回数・転送量・所要時間"""
+    with _lock:
+        return {op: dict(entry) for op, entry in _stats.items()}
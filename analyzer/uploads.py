@@ -0,0 +1,67 @@
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
+from django.utils.text import slugify
+
+from . import transport
+
+UPLOAD_PREFIX = "uploads/"
+
+# ブラウザから直接S3へアップロードする際の制限
+PRESIGN_EXPIRES = 60 * 10
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp")
+
+def build_upload_key(filename):
+    """元のファイル名から uploads/<slug>-<ランダム6桁><拡張子> のキーを作る"""
+    base, ext = os.path.splitext(os.path.basename(filename))
+    safe = slugify(base)[:40] or "image"
+    unique = uuid.uuid4().hex[:6]
+    return f"{UPLOAD_PREFIX}{safe}-{unique}{ext.lower()}"
+
+
+def presigned_post(key, content_type):
+    """ブラウザが直接S3へPOSTするためのURLとフォーム項目"""
+    return transport.s3_client().generate_presigned_post(
+        Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+        Key=key,
+        Fields={"Content-Type": content_type},
+        Conditions=[
+            {"Content-Type": content_type},
+            ["content-length-range", 1, MAX_UPLOAD_BYTES],
+        ],
+        ExpiresIn=PRESIGN_EXPIRES,
+    )
+
+
+def uploaded_size(key):
+    """S3上のオブジェクトサイズ。存在しなければNone"""
+    try:
+        head = transport.s3_client().head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)
+    except Exception:
+        return None
+    return head["ContentLength"]
+
+
+class HashingReader:
+    """読み出しながらSHA-256とサイズを計算するストリーム（S3へ流しながらハッシュを取る）"""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self._hash.update(data)
+        self.size += len(data)
+        return data
+
+    def seekable(self):
+        return False
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
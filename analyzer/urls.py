@@ -1,5 +1,7 @@
 from django.urls import path
-from .views import TopView, UploadAnalyzeView, ReanalyzeView
+from .views import (TopView, UploadAnalyzeView, UploadPresignView,
+                    UploadConfirmView, BulkUploadView, BulkProgressView, ReanalyzeView,
+                    StatusStreamView, AnalysisStatusView, MetricsView)
 #from django.conf import settings
 #from django.conf.urls.static import static
 
@@ -12,7 +14,24 @@ urlpatterns =[
     # アップロード画面
     path("upload/", UploadAnalyzeView.as_view(), name="upload"),
 
+    # S3直接アップロード（署名付きPOSTの発行・アップロード完了通知）
+    path("upload/presign/", UploadPresignView.as_view(), name="upload_presign"),
+    path("upload/confirm/", UploadConfirmView.as_view(), name="upload_confirm"),
+
+    # 一括アップロードAPI・進捗
+    path("upload/bulk/", BulkUploadView.as_view(), name="bulk_upload"),
+    path("upload/bulk/<uuid:batch_id>/", BulkProgressView.as_view(), name="bulk_progress"),
+
     # 再解析ページ
     path('reanalyze/<int:analysis_id>/', ReanalyzeView.as_view(), name='reanalyze'),
+
+    # 解析状態の変更通知（Server-Sent Events）
+    path("events/", StatusStreamView.as_view(), name="status_stream"),
+
+    # 解析状態API（JSON、ETagによる条件付きGET）
+    path("api/analyses/", AnalysisStatusView.as_view(), name="analysis_status"),
+
+    # メトリクス（Prometheus形式）
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ] #+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
@@ -1,14 +1,25 @@
 from django.views import View
 from django.views.generic import TemplateView
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
 from django.db.models import Q
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.urls import reverse
 from PIL import Image
-import os, tempfile
+import asyncio, json, os, tempfile
 
-from .models import TransAnalysis
-from .tasks import analyze_image_task, save_image_and_analyze_task # Celeryタスクをimport
+from .models import MstImages, TransAnalysis, TransBatch
+from .model_names import DEFAULT_MODEL, is_valid as is_valid_model
+from . import bulk, events, facets, metrics, pagination, queue_position, status_api, transport
+from . import signatures # Celeryタスクは名前で投入（TensorFlowを読み込まない）
+from .uploads import (UPLOAD_PREFIX, MAX_UPLOAD_BYTES, HashingReader,
+                      build_upload_key, presigned_post, uploaded_size)
+
+MAX_UPLOAD_FILES = 3
 
 
 
@@ -24,51 +35,25 @@ class TopView(LoginRequiredMixin, TemplateView):
         sort_order = self.request.GET.get('sort', 'desc')
 
         # 絞り込み条件作成
-        filters = Q(image__user=self.request.user)
+        filters = Q(user=self.request.user)
         if selected_status:
             filters &= Q(status=selected_status)
         if selected_label:
             filters &= Q(label=selected_label)
 
-        # 並び順（降順がデフォルト）
-        sort_field = 'image__uploaded_at'
-        if sort_order == 'asc':
-            order_by = sort_field
-        else:
-            order_by = f'-{sort_field}'
-
-        # 対象データ取得
-        analyses = (
-            TransAnalysis.objects
-            .filter(filters)
-            .select_related('image')
-            .order_by(order_by)
+        # 対象データ取得（アップロード日時順のキーセットページング、降順がデフォルト）
+        page = pagination.paginate(
+            TransAnalysis.objects.filter(filters).select_related('image'),
+            cursor=self.request.GET.get('cursor'),
+            descending=sort_order != 'asc',
         )
+        analyses = page.items
 
-        # 「準備中」の順番算出
-        waiting_list = list(
-            TransAnalysis.objects
-            .filter(status="準備中")
-            .order_by('image__uploaded_at')
-            .values_list('analysis_id', flat=True)
-        )
-        waiting_position = {aid: idx + 1 for idx, aid in enumerate(waiting_list)}
+        # 「準備中」の順番算出（投入番号から求める）
+        queue_position.annotate(analyses)
 
-        for analysis in analyses:
-            if analysis.status == "準備中":
-                analysis.waiting_number = waiting_position.get(analysis.analysis_id, None)
-            else:
-                analysis.waiting_number = None
-
-        # ラベル一覧を自動生成（フィルタに使用）
-        all_labels = (
-            TransAnalysis.objects
-            .filter(image__user=self.request.user)
-            .exclude(label__isnull=True)
-            .exclude(label__exact="")
-            .values_list('label', flat=True)
-            .distinct()
-        )
+        # ラベル一覧（フィルタに使用、集計テーブルから取得）
+        all_labels = facets.values(facets.LABEL, self.request.user.pk)
 
         context.update({
             'analyses': analyses,
@@ -76,6 +61,7 @@ class TopView(LoginRequiredMixin, TemplateView):
             'selected_label': selected_label,
             'sort_order': sort_order,
             'label_options': all_labels,
+            **pagination.page_queries(self.request.GET, page),
         })
         return context
 
@@ -87,16 +73,20 @@ class UploadAnalyzeView(LoginRequiredMixin, View):
 
     def post(self, request):
         image_files   = request.FILES.getlist("images")
-        model_name    = request.POST.get("model", "mobilenet_v2")
+        model_name    = request.POST.get("model", DEFAULT_MODEL)
         use_category  = bool(request.POST.get("use_category"))   # チェック有無
 
+        if not is_valid_model(model_name):
+            messages.error(request, "Unknown model.")
+            return render(request, "analyzer/upload.html", status=400)
+
         # 画像なし
         if not image_files:
             messages.error(request, "Please select at least one image.")
             return render(request, "analyzer/upload.html")
 
         # 4 枚以上
-        if len(image_files) > 3:
+        if len(image_files) > MAX_UPLOAD_FILES:
             messages.error(request, "You can upload up to 3 images.")
             return render(request, "analyzer/upload.html")
 
@@ -113,36 +103,211 @@ class UploadAnalyzeView(LoginRequiredMixin, View):
             return render(request, "analyzer/upload.html",
                           {"error": "No valid image files were found."})
 
-        # Celeryへ投入（全て非同期）
+        # S3へ流しながらハッシュを取り、キーとハッシュをCeleryへ渡す（ワーカーは別のホストで動くので一時ファイルは渡さない）
         for img_file in valid_images:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(img_file.name)[1]) as tmp:
-                for chunk in img_file.chunks():
-                    tmp.write(chunk)
-                tmp_path = tmp.name
+            if settings.ANALYZER_SINGLE_HOP:
+                # 単一ホップ：同じホストのワーカーが一時ファイルを読み、S3保存から推論までを1タスクで行う
+                with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(img_file.name)[1]) as tmp:
+                    for chunk in img_file.chunks():
+                        tmp.write(chunk)
+                signatures.save_image_and_analyze(None, request.user.pk, model_name, use_category, temp_path=tmp.name)
+                continue
+
+            key = build_upload_key(img_file.name)
+            reader = HashingReader(img_file)
+            transport.upload_fileobj(key, reader, content_type=img_file.content_type)
 
             # Celeryタスク呼び出し
-            save_image_and_analyze_task.delay(
-                tmp_path,
-                request.user.id,
+            signatures.save_image_and_analyze(
+                key,
+                request.user.pk,
                 model_name,
-                use_category
+                use_category,
+                content_hash=reader.hexdigest(),
             )
 
         return redirect("analyzer:top")
 
 
+class UploadPresignView(LoginRequiredMixin, View):
+    """ブラウザから直接S3へアップロードするための署名付きPOSTを発行"""
+
+    def post(self, request):
+        try:
+            files = json.loads(request.body).get("files", [])
+        except (ValueError, AttributeError):
+            return JsonResponse({"error": "Invalid request."}, status=400)
+
+        if not files:
+            return JsonResponse({"error": "Please select at least one image."}, status=400)
+        if len(files) > MAX_UPLOAD_FILES:
+            return JsonResponse({"error": f"You can upload up to {MAX_UPLOAD_FILES} images."}, status=400)
+
+        uploads = []
+        for f in files:
+            content_type = str(f.get("type", ""))
+            if not content_type.startswith("image/"):
+                continue
+            key = build_upload_key(str(f.get("name", "")))
+            post = presigned_post(key, content_type)
+            uploads.append({"key": key, "url": post["url"], "fields": post["fields"]})
+
+        if not uploads:
+            return JsonResponse({"error": "No valid image files were found."}, status=400)
+
+        # 発行したキーだけを確定できるようセッションに保存
+        issued = request.session.get("issued_upload_keys", [])
+        request.session["issued_upload_keys"] = (issued + [u["key"] for u in uploads])[-50:]
+        return JsonResponse({"uploads": uploads})
+
+
+class UploadConfirmView(LoginRequiredMixin, View):
+    """S3へのアップロード完了後にレコードを作成して解析を依頼"""
+
+    def post(self, request):
+        try:
+            body = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({"error": "Invalid request."}, status=400)
+
+        keys = body.get("keys", [])
+        model_name = body.get("model", DEFAULT_MODEL)
+        use_category = bool(body.get("use_category"))
+        if not is_valid_model(model_name):
+            return JsonResponse({"error": "Unknown model."}, status=400)
+
+        issued = request.session.get("issued_upload_keys", [])
+        valid_keys = []
+        for key in keys[:MAX_UPLOAD_FILES]:
+            if key not in issued or not key.startswith(UPLOAD_PREFIX):
+                continue
+            size = uploaded_size(key)
+            if size is None or size > MAX_UPLOAD_BYTES:
+                continue
+            valid_keys.append(key)
+
+        if not valid_keys:
+            return JsonResponse({"error": "No uploaded images were found."}, status=400)
+
+        analyses = []
+        with transaction.atomic():
+            first_seq = queue_position.allocate(len(valid_keys))
+            for i, key in enumerate(valid_keys):
+                mst_img = MstImages.objects.create(user=request.user, image=key)
+                analyses.append(TransAnalysis.objects.create(
+                    image=mst_img,
+                    user=request.user,
+                    uploaded_at=mst_img.uploaded_at,
+                    model_name=model_name,
+                    status="準備中",
+                    enqueue_seq=first_seq + i
+                ))
+            facets.record_created(request.user.pk, model_name, len(analyses))
+
+        request.session["issued_upload_keys"] = [k for k in issued if k not in valid_keys]
+
+        # 画像の検証（壊れたファイル）はワーカーのデコード時に行われ、失敗として記録される
+        for analysis in analyses:
+            signatures.analyze_image(
+                analysis.analysis_id,
+                analysis.image.image.name,
+                model_name,
+                use_category
+            )
+
+        return JsonResponse({"analysis_ids": [a.analysis_id for a in analyses]})
+
+
+class BulkUploadView(LoginRequiredMixin, View):
+    """
+    一括アップロードAPI（複数ファイル images または zip の archive）
+    受け付けたらバッチIDを返し、進捗は BulkProgressView で問い合わせる
+    """
+
+    def post(self, request):
+        model_name = request.POST.get("model", DEFAULT_MODEL)
+        use_category = bool(request.POST.get("use_category"))
+        if not is_valid_model(model_name):
+            return JsonResponse({"error": "Unknown model."}, status=400)
+        members = bulk.iter_members(request.FILES.getlist("images"), request.FILES.get("archive"))
+
+        try:
+            batch = bulk.ingest(request.user, model_name, use_category, members,
+                                max_files=settings.ANALYZER_BULK_MAX_FILES)
+        except bulk.BulkUploadError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        return JsonResponse({
+            "batch_id": str(batch.batch_id),
+            "total": batch.total,
+            "progress_url": reverse("analyzer:bulk_progress", args=[batch.batch_id]),
+        }, status=202)
+
+
+class BulkProgressView(LoginRequiredMixin, View):
+    def get(self, request, batch_id):
+        batch = get_object_or_404(TransBatch, batch_id=batch_id, user=request.user)
+        return JsonResponse(bulk.progress(batch))
+
+
+class AnalysisStatusView(LoginRequiredMixin, View):
+    """
+    解析の状態・結果をJSONで返す（?ids=1,2,3 または ?since=カーソル で更新された行）
+    行ごとの更新日時から弱いETagを作り、変わっていなければ結果の列を読まずに304を返す
+    ?since は直近 status_api.SAFETY_WINDOW 内に更新された行を次回に回す
+    """
+
+    def get(self, request):
+        analyses = TransAnalysis.objects.filter(user=request.user)
+        ids = request.GET.get("ids")
+        cursor = request.GET.get("since")
+
+        try:
+            if ids:
+                id_list = [int(i) for i in ids.split(",") if i][:status_api.MAX_ITEMS]
+                analyses = analyses.filter(pk__in=id_list).order_by("analysis_id")
+            else:
+                analyses = status_api.changed_since(analyses, cursor)
+        except ValueError:
+            return JsonResponse({"error": "Invalid ids or cursor."}, status=400)
+
+        versions = status_api.versions(analyses)
+        etag = status_api.etag(versions)
+        if status_api.etag_matches(request.headers.get("If-None-Match"), etag):
+            response = HttpResponseNotModified()
+        else:
+            rows = status_api.fetch(analyses, [aid for aid, _ in versions])
+            # 読み込む間に更新された行があれば本体に合わせる
+            etag = status_api.etag([(row["analysis_id"], row["updated_at"]) for row in rows])
+            body = {"analyses": rows}
+            if not ids:
+                last = rows[-1] if rows else None
+                body["cursor"] = status_api.encode_cursor(last["updated_at"], last["analysis_id"]) if last else cursor
+                body["has_more"] = len(versions) >= status_api.MAX_ITEMS
+            response = JsonResponse(body)
+
+        response["ETag"] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
 class ReanalyzeView(View):
     def get(self, request, analysis_id):
         analysis = get_object_or_404(TransAnalysis, pk=analysis_id)
         return render(request, "analyzer/reanalyze.html", {"analysis": analysis})
 
     def post(self, request, analysis_id):
-        analysis = get_object_or_404(TransAnalysis, pk=analysis_id)
+        analysis = get_object_or_404(TransAnalysis.objects.select_related('image'), pk=analysis_id)
+        before = {f: getattr(analysis, f) for f in ('status', 'label', 'error_name', 'model_name')}
 
         # フォームからの新しい値を反映
         model_name = request.POST.get("model_name")
         use_category = bool(request.POST.get("use_category"))
 
+        if not is_valid_model(model_name):
+            messages.error(request, "Unknown model.")
+            return render(request, "analyzer/reanalyze.html", {"analysis": analysis}, status=400)
+
         analysis.model_name = model_name
         analysis.use_category = use_category
 
@@ -154,21 +319,85 @@ class ReanalyzeView(View):
         analysis.ended_at = None
         analysis.error_name = None
         analysis.error_log = None
-        analysis.save()
-
-        # Celeryへ再解析を依頼
-        image_url = analysis.image.image.url
-
-        analyze_image_task.delay(
+        # 再解析キューの最後尾に並び直す
+        analysis.enqueue_queue = signatures.REANALYZE_QUEUE
+        analysis.enqueue_seq = queue_position.allocate(queue=signatures.REANALYZE_QUEUE)
+        analysis.save(update_fields=[
+            'model_name', 'use_category', 'status', 'label', 'reliability',
+            'started_at', 'ended_at', 'error_name', 'error_log', 'enqueue_seq', 'enqueue_queue', 'updated_at',
+        ])
+        facets.apply(facets.diff(analysis.image.user_id, before,
+                                 {f: getattr(analysis, f) for f in before}))
+        events.publish(analysis.image.user_id, events.analysis_event(analysis.analysis_id, {
+            'status': analysis.status, 'label': None, 'error_name': None,
+        }))
+
+        # Celeryへ再解析を依頼（ワーカーはS3キーで直接取得する）
+        # 新規アップロードの推論を待たせないよう再解析用のキューへ
+        signatures.analyze_image(
             analysis_id=analysis.analysis_id,
-            full_path=image_url,
+            full_path=analysis.image.image.name,
             model_name=analysis.model_name,
-            use_category=analysis.use_category
+            use_category=analysis.use_category,
+            queue=signatures.REANALYZE_QUEUE,
         )
 
         return redirect("analyzer:top")
 
+class StatusStreamView(View):
+    """
+    ログイン中ユーザーの解析の状態・結果の変更を Server-Sent Events で送る
+    ASGIサーバー（pic_analyzer.asgi）で動かすこと（WSGIでは1接続がワーカーを占有する）
+    """
+
+    async def get(self, request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return HttpResponse(status=401)
+        if not events.enabled():
+            return HttpResponse(status=204)  # クライアントは再接続しない
+
+        keepalive = events.keepalive_seconds()
+
+        async def stream():
+            subscriber = events.subscribe(user.pk)
+            try:
+                yield "retry: 5000\n\n"
+                while True:
+                    try:
+                        event = await asyncio.wait_for(subscriber.get(), timeout=keepalive)
+                    except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                        continue
+                    yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            finally:
+                events.unsubscribe(subscriber)
+
+        response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # nginxでバッファさせない
+        return response
+
+
+class MetricsView(View):
+    """Prometheus形式のメトリクス（キューの深さ・状態別件数など）。ANALYZER_METRICS['token']が必要"""
+
+    def get(self, request):
+        if not metrics.authorized(request.headers.get("Authorization")):
+            return HttpResponse(status=401)
+        response = HttpResponse(metrics.web_metrics(), content_type=metrics.CONTENT_TYPE)
+        patch_cache_control(response, no_store=True)
+        return response
+
+
 top = TopView.as_view()
 upload = UploadAnalyzeView.as_view()
+upload_presign = UploadPresignView.as_view()
+upload_confirm = UploadConfirmView.as_view()
+bulk_upload = BulkUploadView.as_view()
+bulk_progress = BulkProgressView.as_view()
 reanalyze = ReanalyzeView.as_view()
+analysis_status = AnalysisStatusView.as_view()
+status_stream = StatusStreamView.as_view()
+metrics_view = MetricsView.as_view()
 
@@ -13,4 +13,6 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pic_analyzer.settings')
 
+# 解析状態の通知（analyzer:status_stream のServer-Sent Events）は長時間の接続になるため、
+# Webはこのエントリポイントを uvicorn などのASGIサーバーで動かす
 application = get_asgi_application()
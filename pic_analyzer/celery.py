@@ -1,8 +1,40 @@
 import os
 from celery import Celery
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pic_analyzer.settings')
 
 app = Celery('pic_analyzer', broker='sqs://')
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+# メトリクスのexporter（ANALYZER_METRICS['worker_port']）
+# メインプロセスは指定ポート、preforkの子プロセスは 指定ポート+1+プロセス番号 で待ち受ける
+@worker_init.connect
+def start_metrics_exporter(**kwargs):
+    from django.conf import settings
+    from analyzer import metrics
+
+    port = (getattr(settings, 'ANALYZER_METRICS', {}) or {}).get('worker_port')
+    if port:
+        metrics.start_exporter(port)
+
+
+@worker_process_init.connect
+def start_child_metrics_exporter(**kwargs):
+    from billiard.process import current_process
+    from django.conf import settings
+    from analyzer import metrics
+
+    port = (getattr(settings, 'ANALYZER_METRICS', {}) or {}).get('worker_port')
+    if port:
+        metrics.start_exporter(port + 1 + (getattr(current_process(), 'index', 0) or 0))
+
+
+# preforkの子プロセスは os._exit で終了し atexit が動かないので、まとめ書き込みの残りをここで書き出す
+@worker_process_shutdown.connect
+def flush_result_writer(**kwargs):
+    from analyzer import persistence
+
+    persistence.flush_writer()
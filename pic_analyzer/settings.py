@@ -197,3 +197,134 @@ CELERY_BROKER_TRANSPORT_OPTIONS = {
 }
 
 APPEND_SLASH = False
+
+
+# 推論ワーカー設定
+# モデルキャッシュのRSS上限（MB）。超えたら最も古く使われたモデルから解放する。Noneで無制限
+ANALYZER_MODEL_RSS_BUDGET_MB = int(os.getenv("ANALYZER_MODEL_RSS_BUDGET_MB", "0")) or None
+
+# マイクロバッチ推論（同一モデル宛ての解析をまとめて1回のpredictで処理）
+# 複数タスクを同時に受け取れるよう `celery worker --pool threads --concurrency N` で起動すること
+# window_msは単独リクエストの最大待ち時間。SQSのwait_time_secondsとは独立に効く
+ANALYZER_BATCHING = {
+    'enabled': os.getenv("ANALYZER_BATCHING", "0") == "1",
+    'window_ms': int(os.getenv("ANALYZER_BATCH_WINDOW_MS", "50")),
+    'max_batch_size': int(os.getenv("ANALYZER_BATCH_MAX_SIZE", "16")),
+}
+
+# 推論のスレッド数（TensorFlowの演算内並列・TFLiteのnum_threads）。0なら既定（CPUコア数）
+# manage.py bench_inference --threads で計測して決める
+ANALYZER_INFERENCE_THREADS = int(os.getenv("ANALYZER_INFERENCE_THREADS", "0")) or None
+
+# EfficientNet系モデルとHuman専用モデルを1つのグラフで同時に推論する
+# ベースの重みが同じ場合だけ融合する（共有できなければ従来どおりHuman専用モデルは必要な時だけ推論）
+ANALYZER_FUSED_HUMAN = os.getenv("ANALYZER_FUSED_HUMAN", "0") == "1"
+
+# モデルごとの推論バックエンド（'float' または 'int8'）。未指定のモデルはfloat
+# 例: ANALYZER_MODEL_BACKENDS = {'effb0_5class': 'int8', 'resnet50': 'int8'}
+# int8のモデルはワーカーでは変換しないので、事前に manage.py quantize_models で作っておくこと
+ANALYZER_MODEL_BACKENDS = {}
+
+# 解析結果キャッシュ（画像のSHA-256・モデル・use_category単位）。max_rowsを超えたら古い順に削除
+ANALYZER_RESULT_CACHE = {
+    'enabled': os.getenv("ANALYZER_RESULT_CACHE", "1") == "1",
+    'max_rows': int(os.getenv("ANALYZER_RESULT_CACHE_MAX_ROWS", "100000")) or None,
+}
+
+# デコード済み224x224配列(.npy)のキャッシュ。再解析時に元画像のダウンロード・デコードを省く
+# dirはワーカーのローカルLRUキャッシュ（max_bytesを超えたら古い順に削除）、s3はバケットのtensors/にも保存するか
+ANALYZER_TENSOR_CACHE = {
+    'enabled': os.getenv("ANALYZER_TENSOR_CACHE", "1") == "1",
+    'dir': os.getenv("ANALYZER_TENSOR_CACHE_DIR", str(BASE_DIR / "tensor_cache")),
+    'max_bytes': int(os.getenv("ANALYZER_TENSOR_CACHE_MAX_MB", "2048")) * 1024 * 1024,
+    's3': True,
+}
+
+# サーバー経由のアップロードで、S3への保存・レコード作成・推論をメモリ上の画像で1つのタスクで行う（キューの往復とダウンロードを省く）
+# Webが書いた一時ファイルをワーカーが読むので、Webと ingest ワーカーが同じホストで動く構成でのみ有効にすること
+ANALYZER_SINGLE_HOP = os.getenv("ANALYZER_SINGLE_HOP", "0") == "1"
+
+# ワーカーのS3/HTTP接続（プロセス内で共有するコネクションプール・タイムアウト秒・リトライ回数）
+ANALYZER_TRANSPORT = {
+    'max_pool_connections': 20,
+    'connect_timeout': 5,
+    'read_timeout': 60,
+    'max_attempts': 5,
+}
+
+# モデル・ラベルの成果物（S3の prefix 以下 → ローカルの cache_dir/version/ に保存）
+# 成果物を更新したらversionを変えると、別ディレクトリに取り直される
+ANALYZER_MODEL_ARTIFACTS = {
+    'version': os.getenv("ANALYZER_MODEL_VERSION", "v1"),
+    'cache_dir': str(BASE_DIR / "models"),
+    'bucket': AWS_STORAGE_BUCKET_NAME,
+    'prefix': 'models/',
+}
+
+# Keras標準モデルのImageNet重み・ラベルを自前のバンドルから読み込む（"0"なら実行時にKerasがインターネットから取得）
+# デプロイ前に manage.py fetch_model_artifacts --publish-stock でバンドルへアップロードしておくこと（無いと解析が失敗する）
+ANALYZER_STOCK_WEIGHTS_FROM_BUNDLE = os.getenv("ANALYZER_STOCK_WEIGHTS_FROM_BUNDLE", "1") == "1"
+
+# 一括アップロードで1回に受け付ける最大枚数
+ANALYZER_BULK_MAX_FILES = 500
+# 一括アップロードは多数のファイルを受けるため、multipartのファイル数上限を合わせる
+DATA_UPLOAD_MAX_NUMBER_FILES = ANALYZER_BULK_MAX_FILES
+
+# 解析結果の書き込みをまとめる（件数 max_rows か経過時間 max_delay_ms でbulk_update）
+# 無効時は1件ごとに変更した列だけをUPDATEする
+ANALYZER_WRITE_BEHIND = {
+    'enabled': os.getenv("ANALYZER_WRITE_BEHIND", "0") == "1",
+    'max_rows': 50,
+    'max_delay_ms': 500,
+}
+
+# 解析状態の変更通知（Server-Sent Events）
+# backend: "local"（同じプロセス内のみ）/ "redis"（ワーカーからpub/subで全Webプロセスへ）/ ""（無効）
+# max_queue: 1接続あたりに溜める通知の上限（超えたらクライアントに読み直させる）
+ANALYZER_EVENTS = {
+    'backend': os.getenv("ANALYZER_EVENTS_BACKEND", ""),
+    'redis_url': os.getenv("ANALYZER_EVENTS_REDIS_URL", "redis://localhost:6379/0"),
+    'channel': 'pic-analyzer-events',
+    'max_queue': 100,
+    'keepalive': 15,
+}
+
+# タスクの振り分け（SQSのキュー名は queue_name_prefix が付いて pic-analyzer-ingest などになる）
+# ingest: S3保存・レコード作成（I/O待ちが中心）/ inference: 推論（CPU）/ reanalyze: 再解析（新規アップロードより後回し）
+CELERY_TASK_ROUTES = {
+    'analyzer.tasks.save_image_and_analyze_task': {'queue': 'ingest'},
+    'analyzer.tasks.analyze_image_task': {'queue': 'inference'},
+    'analyzer.tasks.analyze_images_task': {'queue': 'inference'},
+}
+
+# ワーカーの起動設定（manage.py run_worker <profile>、concurrency が None ならCPUコア数）
+# metrics_port: exporterのポート。preforkでは子プロセスが +1+番号 を使うので、プロファイル間は1000ずつ空ける
+ANALYZER_WORKER_PROFILES = {
+    # I/O待ちが中心なのでスレッドを多めに
+    'ingest': {'queues': ['ingest'], 'pool': 'threads', 'concurrency': 32, 'prefetch_multiplier': 4,
+               'metrics_port': 9700},
+    # 1コア1プロセス、長い推論を先取りして抱え込まない
+    # マイクロバッチ推論が有効なら、1プロセスのスレッドでバッチ分のタスクを同時に受ける
+    'inference': {'queues': ['inference'], 'pool': 'prefork', 'concurrency': None, 'prefetch_multiplier': 1,
+                  'metrics_port': 10000}
+    if not ANALYZER_BATCHING['enabled'] else
+    {'queues': ['inference'], 'pool': 'threads', 'concurrency': ANALYZER_BATCHING['max_batch_size'],
+     'prefetch_multiplier': 1, 'metrics_port': 10000},
+    # 再解析は少ない並列数で専用に処理し、新規アップロードの推論を待たせない
+    'reanalyze': {'queues': ['reanalyze'], 'pool': 'prefork', 'concurrency': 1, 'prefetch_multiplier': 1,
+                  'metrics_port': 11000},
+    # 1台で全部動かす場合（開発用）
+    'all': {'queues': ['ingest', 'inference', 'reanalyze', 'celery'], 'pool': 'prefork', 'concurrency': None,
+            'prefetch_multiplier': 1, 'metrics_port': 10000},
+}
+
+# メトリクス（Prometheus形式）。Webは /metrics/、ワーカーは worker_port（preforkの子プロセスは +1+番号）
+# Authorization: Bearer <token> が必要（tokenが未設定なら常に401）。auth を False にした場合だけ認証なしで公開する
+# ワーカーのexporterは bind のアドレスで待ち受ける（既定はローカルのみ）。worker_portがNoneなら起動しない
+ANALYZER_METRICS = {
+    'token': os.getenv("ANALYZER_METRICS_TOKEN", ""),
+    'auth': os.getenv("ANALYZER_METRICS_AUTH", "1") == "1",
+    'bind': os.getenv("ANALYZER_METRICS_BIND", "127.0.0.1"),
+    'worker_port': int(os.getenv("ANALYZER_METRICS_PORT", "9800")) or None,
+    'queue_depth_cache_seconds': 15,
+}
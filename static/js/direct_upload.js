@@ -0,0 +1,72 @@
+// 画像をDjangoを経由せずブラウザから直接S3へアップロードする
+// 失敗した場合は通常のフォーム送信（サーバー経由）にフォールバック
+(function () {
+  const form = document.getElementById("upload-form");
+  if (!form || !window.fetch || !window.FormData) {
+    return;
+  }
+
+  const csrfToken = form.querySelector("input[name=csrfmiddlewaretoken]").value;
+
+  function postJson(url, body) {
+    return fetch(url, {
+      method: "POST",
+      headers: { "Content-Type": "application/json", "X-CSRFToken": csrfToken },
+      credentials: "same-origin",
+      body: JSON.stringify(body),
+    }).then(function (res) {
+      return res.json().then(function (data) {
+        if (!res.ok) {
+          throw new Error(data.error || "Upload failed.");
+        }
+        return data;
+      });
+    });
+  }
+
+  function uploadToS3(upload, file) {
+    const data = new FormData();
+    Object.keys(upload.fields).forEach(function (name) {
+      data.append(name, upload.fields[name]);
+    });
+    data.append("file", file);  // fileは最後に追加する（S3の仕様）
+    return fetch(upload.url, { method: "POST", body: data }).then(function (res) {
+      if (!res.ok) {
+        throw new Error("S3 upload failed.");
+      }
+      return upload.key;
+    });
+  }
+
+  form.addEventListener("submit", function (event) {
+    event.preventDefault();
+    const files = Array.from(form.querySelector("input[name=images]").files)
+      .filter(function (f) { return f.type.indexOf("image/") === 0; });
+    const button = form.querySelector("button[type=submit]");
+    button.disabled = true;
+
+    postJson(form.dataset.presignUrl, {
+      files: files.map(function (f) { return { name: f.name, type: f.type }; }),
+    })
+      .then(function (data) {
+        return Promise.all(data.uploads.map(function (upload, i) {
+          return uploadToS3(upload, files[i]);
+        }));
+      })
+      .then(function (keys) {
+        return postJson(form.dataset.confirmUrl, {
+          keys: keys,
+          model: form.querySelector("select[name=model]").value,
+          use_category: form.querySelector("input[name=use_category]").checked,
+        });
+      })
+      .then(function () {
+        window.location.href = form.dataset.doneUrl;
+      })
+      .catch(function () {
+        // サーバー経由のアップロードで再送信
+        button.disabled = false;
+        form.submit();
+      });
+  });
+})();
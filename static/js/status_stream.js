@@ -0,0 +1,67 @@
+// 解析状態の変更をServer-Sent Eventsで受け取り、一覧の該当行だけを書き換える
+// 受信しきれなかった場合（resync）は画面を読み直す
+(function () {
+  const page = document.querySelector("[data-stream-url]");
+  if (!page || !window.EventSource) {
+    return;
+  }
+
+  function statusNode(event) {
+    const span = document.createElement("span");
+    if (event.status === "解析中") {
+      span.className = "status-blue";
+      span.textContent = "解析中...";
+    } else if (event.status === "成功") {
+      span.className = "status-green";
+      span.textContent = "解析成功！";
+    } else if (event.status === "失敗") {
+      span.className = "status-red";
+      span.textContent = "解析失敗";
+      if (event.error_name) {
+        const small = document.createElement("small");
+        small.textContent = event.error_name;
+        span.append(document.createElement("br"), small);
+      }
+    } else {
+      span.textContent = event.status;
+    }
+    return span;
+  }
+
+  function reliabilityNode(value) {
+    const span = document.createElement("span");
+    if (value) {
+      span.className = value >= 80 ? "reliability-high" : value >= 50 ? "reliability-mid" : "reliability-low";
+      span.textContent = value + "%";
+    }
+    return span;
+  }
+
+  function setField(row, field, node) {
+    const cell = row.querySelector('[data-field="' + field + '"]');
+    if (cell) {
+      cell.replaceChildren(node);
+    }
+  }
+
+  const source = new EventSource(page.dataset.streamUrl);
+
+  source.addEventListener("analysis", function (message) {
+    const event = JSON.parse(message.data);
+    const rows = document.querySelectorAll('[data-analysis-id="' + event.analysis_id + '"]');
+    rows.forEach(function (row) {
+      if ("status" in event) {
+        setField(row, "status", statusNode(event));
+        setField(row, "reliability", reliabilityNode(event.reliability));
+      }
+      if ("label" in event) {
+        setField(row, "label", document.createTextNode(event.label || ""));
+      }
+    });
+  });
+
+  source.addEventListener("resync", function () {
+    source.close();
+    window.location.reload();
+  });
+})();